@@ -79,16 +79,43 @@ def create_app():
     from routes.branch_routes import branch_bp
     app.register_blueprint(branch_bp)
 
-    # Crear tablas
+    from routes.ip_pool_routes import ip_pool_bp
+    app.register_blueprint(ip_pool_bp)
+
+    # Crear tablas y aplicar migraciones pendientes
     with app.app_context():
         db.create_all()
+        from migrations import run_migrations
+        run_migrations(db.engine)
+
+    # Hilos de fondo solo en el proceso designado (no en workers de
+    # gunicorn/Celery ni en el proceso padre del recargador)
+    if app.config.get('BACKGROUND_SERVICES_ENABLED'):
+        start_background_services(app)
     
     return app
 
+def start_background_services(app):
+    """Inicia los hilos de fondo una sola vez por proceso"""
+    if app.extensions.get('background_services'):
+        return
+    app.extensions['background_services'] = True
+
+    # Captura periódica de sesiones PPPoE activas y listeners de eventos
+    from services.session_collector import SessionCollectorService
+    from services.session_listener import SessionListenerService
+    SessionCollectorService.start(app)
+    SessionListenerService.start(app)
+
+    # Índice de búsqueda de clientes en memoria (si este proceso lo usa)
+    from services.client_search import ClientSearchService
+    ClientSearchService.warm(app)
+
 # Crear instancia de la aplicación
 app = create_app()
 
 if __name__ == '__main__':
+    start_background_services(app)
     if SSL_CERT and SSL_KEY:
         app.run(ssl_context=(SSL_CERT, SSL_KEY), port=5000)
     else:
@@ -2,6 +2,7 @@ import os
 import secrets
 from datetime import timedelta
 from dotenv import load_dotenv
+from flask import current_app, has_app_context
 
 # Cargar variables del archivo .env
 load_dotenv()
@@ -24,6 +25,7 @@ class Config:
     # ========================================
     SECRET_KEY = os.environ.get('SECRET_KEY')
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
+    # Varias claves separadas por comas para rotarlas (se encripta con la primera)
     ENCRYPTION_KEY = os.environ.get('ENCRYPTION_KEY')
     
     # ========================================
@@ -74,6 +76,127 @@ class Config:
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_USERNAME')
     
+    # ========================================
+    # CONFIGURACIÓN DE CONEXIÓN A MIKROTIK
+    # ========================================
+    MIKROTIK_TIMEOUT = get_int_env('MIKROTIK_TIMEOUT', 10)
+    MIKROTIK_POOL_SIZE = get_int_env('MIKROTIK_POOL_SIZE', 4)
+    MIKROTIK_POOL_BLOCK = get_bool_env('MIKROTIK_POOL_BLOCK', False)
+    MIKROTIK_KEEPALIVE = get_bool_env('MIKROTIK_KEEPALIVE', True)
+    MIKROTIK_SESSION_IDLE_SECONDS = get_int_env('MIKROTIK_SESSION_IDLE_SECONDS', 300)
+    MIKROTIK_API_PORT = get_int_env('MIKROTIK_API_PORT', 8728)
+    MIKROTIK_API_SSL_PORT = get_int_env('MIKROTIK_API_SSL_PORT', 8729)
+    MIKROTIK_API_ENCODING = os.environ.get('MIKROTIK_API_ENCODING') or 'utf-8'
+    # Bytes leídos por vez al descargar tablas completas en la sincronización
+    MIKROTIK_STREAM_CHUNK_SIZE = get_int_env('MIKROTIK_STREAM_CHUNK_SIZE', 65536)
+    
+    # ========================================
+    # CIRCUIT BREAKER Y TIMEOUTS ADAPTATIVOS POR ROUTER
+    # ========================================
+    MIKROTIK_TIMEOUT_MIN = get_int_env('MIKROTIK_TIMEOUT_MIN', 2)
+    MIKROTIK_TIMEOUT_FACTOR = get_int_env('MIKROTIK_TIMEOUT_FACTOR', 4)  # timeout = factor x p95 de latencia
+    CIRCUIT_FAILURE_THRESHOLD = get_int_env('CIRCUIT_FAILURE_THRESHOLD', 3)
+    CIRCUIT_OPEN_SECONDS = get_int_env('CIRCUIT_OPEN_SECONDS', 15)
+    CIRCUIT_MAX_OPEN_SECONDS = get_int_env('CIRCUIT_MAX_OPEN_SECONDS', 300)
+    
+    # ========================================
+    # CONCURRENCIA Y PRIORIDADES POR ROUTER
+    # ========================================
+    ROUTER_MAX_CONCURRENT = get_int_env('ROUTER_MAX_CONCURRENT', 3)
+    # Lugares que pueden ocupar las sincronizaciones y el colector de sesiones
+    ROUTER_MAX_BACKGROUND = get_int_env('ROUTER_MAX_BACKGROUND', 1)
+    # Espera máxima en la cola de cada clase (segundos)
+    ROUTER_QUEUE_WAIT_WRITE = get_int_env('ROUTER_QUEUE_WAIT_WRITE', 10)
+    ROUTER_QUEUE_WAIT_READ = get_int_env('ROUTER_QUEUE_WAIT_READ', 5)
+    ROUTER_QUEUE_WAIT_BACKGROUND = get_int_env('ROUTER_QUEUE_WAIT_BACKGROUND', 120)
+    
+    # ========================================
+    # CACHÉ DE LECTURAS DE MIKROTIK
+    # ========================================
+    MIKROTIK_CACHE_ENABLED = get_bool_env('MIKROTIK_CACHE_ENABLED', True)
+    MIKROTIK_CACHE_SIZE = get_int_env('MIKROTIK_CACHE_SIZE', 1024)
+    MIKROTIK_CACHE_TTL_RESOURCES = get_int_env('MIKROTIK_CACHE_TTL_RESOURCES', 5)
+    MIKROTIK_CACHE_TTL_INTERFACES = get_int_env('MIKROTIK_CACHE_TTL_INTERFACES', 60)
+    MIKROTIK_CACHE_TTL_IDENTITY = get_int_env('MIKROTIK_CACHE_TTL_IDENTITY', 300)
+    
+    # ========================================
+    # CACHÉ DE CREDENCIALES DE ROUTERS
+    # ========================================
+    ROUTER_CREDENTIALS_CACHE_SIZE = get_int_env('ROUTER_CREDENTIALS_CACHE_SIZE', 1024)
+    ROUTER_CREDENTIALS_CACHE_TTL = get_int_env('ROUTER_CREDENTIALS_CACHE_TTL', 300)
+    
+    # ========================================
+    # LECTURAS IDÉNTICAS CONCURRENTES (SINGLE-FLIGHT)
+    # ========================================
+    SINGLEFLIGHT_ENABLED = get_bool_env('SINGLEFLIGHT_ENABLED', True)
+    # memory:// agrupa solo los hilos de un worker; redis://host:6379/0 los de todos
+    SINGLEFLIGHT_STORE_URL = os.environ.get('SINGLEFLIGHT_STORE_URL') or 'memory://'
+    SINGLEFLIGHT_RESULT_TTL = get_int_env('SINGLEFLIGHT_RESULT_TTL', 2)
+    
+    # ========================================
+    # CONSULTAS CONCURRENTES A VARIOS ROUTERS
+    # ========================================
+    FANOUT_MAX_WORKERS = get_int_env('FANOUT_MAX_WORKERS', 16)
+    FANOUT_DEADLINE_SECONDS = get_int_env('FANOUT_DEADLINE_SECONDS', 15)
+    
+    # ========================================
+    # SINCRONIZACIÓN
+    # ========================================
+    SYNC_BATCH_SIZE = get_int_env('SYNC_BATCH_SIZE', 1000)
+    SYNC_USE_COPY = get_bool_env('SYNC_USE_COPY', True)
+    SYNC_MAX_WORKERS = get_int_env('SYNC_MAX_WORKERS', 8)
+    SYNC_MAX_PER_BRANCH = get_int_env('SYNC_MAX_PER_BRANCH', 2)
+    SYNC_JOB_BACKEND = os.environ.get('SYNC_JOB_BACKEND') or 'thread'  # thread o celery
+    SYNC_JOB_WORKERS = get_int_env('SYNC_JOB_WORKERS', 2)
+    # Espera máxima de POST /api/firewall/rules/sync; los routers más lentos siguen en segundo plano
+    FIREWALL_SYNC_DEADLINE_SECONDS = get_int_env('FIREWALL_SYNC_DEADLINE_SECONDS', 60)
+    SYNC_JOB_HISTORY = get_int_env('SYNC_JOB_HISTORY', 200)
+    SYNC_JOB_TIMEOUT = get_int_env('SYNC_JOB_TIMEOUT', 3600)  # segundos sin terminar antes de darlo por fallido
+    SYNC_INTERVAL_SECONDS = get_int_env('SYNC_INTERVAL_SECONDS', 900)
+    PPPOE_FRESHNESS_SECONDS = get_int_env('PPPOE_FRESHNESS_SECONDS', 300)
+    PPPOE_FORCE_REFRESH_SECONDS = get_int_env('PPPOE_FORCE_REFRESH_SECONDS', 30)
+    
+    # ========================================
+    # SERVICIOS EN SEGUNDO PLANO
+    # ========================================
+    # Colector y listeners de sesiones e índice de búsqueda: activar solo en
+    # un proceso (no en los workers de gunicorn ni de Celery)
+    BACKGROUND_SERVICES_ENABLED = get_bool_env('BACKGROUND_SERVICES_ENABLED', False)
+    
+    # ========================================
+    # CAPTURA DE SESIONES PPPOE ACTIVAS
+    # ========================================
+    SESSION_COLLECTOR_ENABLED = get_bool_env('SESSION_COLLECTOR_ENABLED', True)
+    SESSION_COLLECT_INTERVAL = get_int_env('SESSION_COLLECT_INTERVAL', 30)
+    SESSION_STREAM_INTERVAL = get_int_env('SESSION_STREAM_INTERVAL', 5)
+    SESSION_STREAM_HEARTBEAT = get_int_env('SESSION_STREAM_HEARTBEAT', 15)
+    SESSION_STREAM_UPTIME_INTERVAL = get_int_env('SESSION_STREAM_UPTIME_INTERVAL', 60)
+    SESSION_STREAM_QUEUE_SIZE = get_int_env('SESSION_STREAM_QUEUE_SIZE', 100)
+    SESSION_LISTENER_ENABLED = get_bool_env('SESSION_LISTENER_ENABLED', True)
+    SESSION_LISTENER_RESCAN = get_int_env('SESSION_LISTENER_RESCAN', 30)
+    SESSION_LISTENER_LEASE = get_int_env('SESSION_LISTENER_LEASE', 90)
+    SESSION_LISTENER_IDLE_SECONDS = get_int_env('SESSION_LISTENER_IDLE_SECONDS', 120)
+    
+    # ========================================
+    # PAGINACIÓN
+    # ========================================
+    PAGINATION_COUNT_TTL = get_int_env('PAGINATION_COUNT_TTL', 30)
+    PAGINATION_COUNT_CACHE_SIZE = get_int_env('PAGINATION_COUNT_CACHE_SIZE', 256)
+    
+    # ========================================
+    # BÚSQUEDA DE CLIENTES
+    # ========================================
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND') or 'auto'  # auto, postgres, memory o like
+    SEARCH_INDEX_CHECK_SECONDS = get_int_env('SEARCH_INDEX_CHECK_SECONDS', 2)
+    SEARCH_MAX_IDS = get_int_env('SEARCH_MAX_IDS', 5000)
+    SEARCH_TYPEAHEAD_INDEX = get_bool_env('SEARCH_TYPEAHEAD_INDEX', False)  # índice en memoria también con PostgreSQL
+    SEARCH_INDEX_MAX_ENTRIES = get_int_env('SEARCH_INDEX_MAX_ENTRIES', 2000000)
+    
+    # ========================================
+    # POOLS DE DIRECCIONES IP
+    # ========================================
+    IP_POOL_MAX_ADDRESSES = get_int_env('IP_POOL_MAX_ADDRESSES', 1 << 20)  # bitmap de hasta 128 KiB
+    
     # ========================================
     # CONFIGURACIÓN DEL ENTORNO
     # ========================================
@@ -111,4 +234,15 @@ class Config:
         if app.config['FLASK_ENV'] == 'development':
             app.config['DEBUG'] = True
         else:
-            app.config['DEBUG'] = False
\ No newline at end of file
+            app.config['DEBUG'] = False
+
+
+def get_setting(name, default=None):
+    """Leer una opción de la configuración de Flask o, sin contexto, de ``Config``.
+
+    Los servicios también se ejecutan en hilos de trabajo y tareas de
+    Celery donde no hay contexto de aplicación disponible.
+    """
+    if has_app_context():
+        return current_app.config.get(name, default)
+    return getattr(Config, name, default)
\ No newline at end of file
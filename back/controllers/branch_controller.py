@@ -4,6 +4,8 @@ from models.router import Branch
 from models import db
 from utils.validation import validate_required_fields
 from utils.response import success_response, error_response
+from utils.exceptions import ValidationError
+from utils.pagination import keyset_paginate, wants_cursor
 
 class BranchController:
     
@@ -24,12 +26,26 @@ class BranchController:
             elif status == 'inactive':
                 query = query.filter_by(is_active=False)
 
-            branches = db.paginate(
-                query,
-                page=page,
-                per_page=per_page,
-                error_out=False
-            )
+            # Paginación por cursor (?cursor= / ?limit=) u offset (?page=)
+            if wants_cursor():
+                branches = keyset_paginate(query, {
+                    'id': (Branch.id,),
+                    'name': (Branch.name, Branch.id),
+                }, default_limit=per_page, max_limit=100)
+                pagination = branches.meta()
+            else:
+                branches = db.paginate(
+                    query,
+                    page=page,
+                    per_page=per_page,
+                    error_out=False
+                )
+                pagination = {
+                    'page': branches.page,
+                    'per_page': branches.per_page,
+                    'total': branches.total,
+                    'pages': branches.pages
+                }
             
             result = []
             for branch in branches.items:
@@ -46,14 +62,11 @@ class BranchController:
             
             return success_response({
                 'branches': result,
-                'pagination': {
-                    'page': branches.page,
-                    'per_page': branches.per_page,
-                    'total': branches.total,
-                    'pages': branches.pages
-                }
+                'pagination': pagination
             })
             
+        except ValidationError as e:
+            return error_response(e.message, 400)
         except Exception as e:
             return error_response(f"Error fetching branches: {str(e)}", 500)
     
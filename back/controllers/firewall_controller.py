@@ -1,13 +1,47 @@
-from flask import request, jsonify
+from flask import current_app, request, jsonify
 from datetime import datetime
+from functools import partial
+from config.config import get_setting
 from models import db, Router, RouterFirewall
+from services.fanout_service import FanOutService
 from services.mikrotik_service import MikroTikService
+from services.router_credentials import RouterCredentials
+from services.sync_job_service import SyncJobService
+from utils.exceptions import ValidationError
+from utils.ip_range import parse_ipv4, range_filter
+from utils.pagination import keyset_paginate, wants_cursor
 import secrets
 
 
 class FirewallController:
     """Controlador para gestión de reglas de firewall"""
 
+    @staticmethod
+    def _with_rule_id(temp_router, rule, operation):
+        """Ejecuta ``operation(rule_id)`` sobre la regla en MikroTik.
+
+        ``firewall_id`` guarda el ``.id`` de RouterOS; solo si el router lo
+        reporta como inexistente (o es un identificador antiguo generado
+        localmente) se busca la regla por ``src-address`` y se reintenta.
+        Devuelve ``(result, error, found)``.
+        """
+        if rule.firewall_id and rule.firewall_id.startswith('*'):
+            result, error = operation(rule.firewall_id)
+            if not MikroTikService.is_missing_item_error(error):
+                return result, error, True
+
+        mikrotik_rule, error = MikroTikService.find_firewall_rule(temp_router, rule.ip_address, ['.id'])
+        if error:
+            return None, error, True
+        if not mikrotik_rule:
+            return None, None, False
+
+        new_id = mikrotik_rule['.id']
+        if not RouterFirewall.query.get((rule.router_id, new_id)):
+            rule.firewall_id = new_id
+        result, error = operation(new_id)
+        return result, error, True
+
     @staticmethod
     def get_rules():
         """GET /api/firewall/rules - Listar reglas de firewall activas"""
@@ -17,21 +51,16 @@ class FirewallController:
             force_sync = request.args.get('sync', 'false').lower() == 'true'
             router_id = request.args.get('router_id', type=int)
             
-            # Si no hay datos en DB o se fuerza sync, intentar sincronizar
-            rules_count = RouterFirewall.query.filter_by(is_active=True).count()
-            
-            if rules_count == 0 or force_sync:
-                # Intentar sincronizar automáticamente
-                if router_id:
-                    routers = [Router.query.get(router_id)] if Router.query.get(router_id) else []
-                else:
-                    routers = Router.query.filter_by(is_active=True).all()
-                
-                if routers:
-                    from services.sync_service import SyncService
-                    for router in routers[:3]:  # Limitar a 3 routers para evitar timeouts
-                        if router:
-                            SyncService.sync_firewall_rules(router.id)
+            # Responder siempre desde la DB; si no hay reglas (o con sync=true)
+            # se sincronizan en segundo plano
+            scope = Router.query.filter_by(is_active=True)
+            if router_id:
+                scope = scope.filter(Router.id == router_id)
+            scope_ids = [r.id for r in scope.with_entities(Router.id).all()]
+            has_rules = RouterFirewall.query.filter(
+                RouterFirewall.is_active == True, RouterFirewall.router_id.in_(scope_ids)
+            ).first() is not None
+            refreshing = SyncJobService.refresh_firewall(scope_ids) if force_sync or not has_rules else []
             
             # Construir query base
             query = RouterFirewall.query.filter_by(is_active=True)
@@ -39,14 +68,41 @@ class FirewallController:
             # Filtrar por router si se especifica
             if router_id:
                 query = query.filter_by(router_id=router_id)
-            
-            # Paginar resultados
-            rules = db.paginate(
-                query,
-                page=page,
-                per_page=per_page,
-                error_out=False
-            )
+
+            # Reglas contenidas en un CIDR (?cidr=) o rango (?ip_from= / ?ip_to=)
+            ip_range = range_filter(request.args)
+            if ip_range:
+                low, high = ip_range
+                query = query.filter(RouterFirewall.ip_start.between(low, high),
+                                     RouterFirewall.ip_end <= high)
+
+            # Reglas que afectan a una IP (?ip=)
+            ip = request.args.get('ip')
+            if ip:
+                address = parse_ipv4(ip)
+                if address is None:
+                    raise ValidationError(f'IP inválida: {ip}')
+                query = query.filter(RouterFirewall.ip_start <= address,
+                                     RouterFirewall.ip_end >= address)
+            
+            # Paginar resultados: por cursor (?cursor= / ?limit=) u offset (?page=)
+            if wants_cursor():
+                rules = keyset_paginate(query, {
+                    'id': (RouterFirewall.router_id, RouterFirewall.firewall_id),
+                }, default_limit=per_page)
+                pagination = rules.meta()
+            else:
+                rules = db.paginate(
+                    query,
+                    page=page,
+                    per_page=per_page,
+                    error_out=False
+                )
+                pagination = {
+                    'total': rules.total,
+                    'pages': rules.pages,
+                    'current_page': page
+                }
             
             return jsonify({
                 'rules': [
@@ -66,11 +122,12 @@ class FirewallController:
                     }
                     for r in rules.items
                 ],
-                'total': rules.total,
-                'pages': rules.pages,
-                'current_page': page
+                **pagination,
+                'refreshing': refreshing
             }), 200
             
+        except ValidationError as e:
+            return jsonify({'error': e.message}), 400
         except Exception as e:
             return jsonify({'error': f'Error interno: {str(e)}'}), 500
 
@@ -109,7 +166,8 @@ class FirewallController:
             if port:
                 mikrotik_data['dst-port'] = str(port)
 
-            result, error = MikroTikService.add_firewall_rule(router, mikrotik_data)
+            temp_router = RouterCredentials.for_router(router)
+            result, error = MikroTikService.add_firewall_rule(temp_router, mikrotik_data)
             if error:
                 return jsonify({
                     'error': f'Error al crear regla en MikroTik: {error}'
@@ -118,7 +176,7 @@ class FirewallController:
             # 2. Si se creó exitosamente en MikroTik, guardarlo en DB
             rule = RouterFirewall(
                 router_id=router.id,
-                firewall_id=secrets.token_hex(8),
+                firewall_id=MikroTikService.created_id(result) or secrets.token_hex(8),
                 ip_address=ip_address,
                 comment=mikrotik_data['comment'],
                 creation_date=datetime.utcnow().isoformat(),
@@ -187,34 +245,19 @@ class FirewallController:
             if not router or not router.is_active:
                 return jsonify({'error': 'Router no encontrado o inactivo'}), 404
 
-            # 1. Buscar la regla en MikroTik para obtener su ID interno
-            mikrotik_rules, error = MikroTikService.get_firewall_rules(router)
+            # 1. Eliminar de MikroTik primero usando el .id guardado (si existe)
+            temp_router = RouterCredentials.for_router(router)
+            result, error, mikrotik_deleted = FirewallController._with_rule_id(
+                temp_router, rule,
+                lambda rule_id: MikroTikService.remove_firewall_rule(temp_router, rule_id)
+            )
             if error:
                 return jsonify({
-                    'error': f'Error al consultar MikroTik: {error}',
-                    'warning': 'Procediendo con eliminación solo en base de datos'
+                    'error': f'Error al eliminar regla de MikroTik: {error}',
+                    'warning': 'Regla existe en MikroTik pero no pudo ser eliminada'
                 }), 500
 
-            # Encontrar la regla en MikroTik
-            mikrotik_rule_id = None
-            if mikrotik_rules:
-                for fw_rule in mikrotik_rules:
-                    if fw_rule.get('src-address') == ip_address:
-                        mikrotik_rule_id = fw_rule.get('.id')
-                        break
-
-            # 2. Eliminar de MikroTik primero (si existe)
-            mikrotik_deleted = False
-            if mikrotik_rule_id:
-                result, error = MikroTikService.remove_firewall_rule(router, mikrotik_rule_id)
-                if error:
-                    return jsonify({
-                        'error': f'Error al eliminar regla de MikroTik: {error}',
-                        'warning': 'Regla existe en MikroTik pero no pudo ser eliminada'
-                    }), 500
-                mikrotik_deleted = True
-
-            # 3. Desactivar en la base de datos
+            # 2. Desactivar en la base de datos
             rule_data = {
                 'id': rule.firewall_id,
                 'ip_address': rule.ip_address,
@@ -255,15 +298,12 @@ class FirewallController:
             if not router:
                 return jsonify({'error': 'Router no encontrado'}), 404
 
-            # Buscar la regla en MikroTik para datos actualizados
-            mikrotik_rules, error = MikroTikService.get_firewall_rules(router)
-            mikrotik_rule = None
-            
-            if not error and mikrotik_rules:
-                for fw_rule in mikrotik_rules:
-                    if fw_rule.get('src-address') == rule.ip_address:
-                        mikrotik_rule = fw_rule
-                        break
+            # Verificar que la regla siga existiendo en MikroTik
+            temp_router = RouterCredentials.for_router(router)
+            mikrotik_rule, error, _ = FirewallController._with_rule_id(
+                temp_router, rule,
+                lambda rule_id: MikroTikService.get_firewall_rule_by_id(temp_router, rule_id)
+            )
 
             return jsonify({
                 'id': rule.firewall_id,
@@ -361,26 +401,6 @@ class FirewallController:
             if not router or not router.is_active:
                 return jsonify({'error': 'Router no encontrado o inactivo'}), 404
 
-            # Buscar la regla en MikroTik
-            mikrotik_rules, error = MikroTikService.get_firewall_rules(router)
-            if error:
-                return jsonify({
-                    'error': f'Error al consultar MikroTik: {error}'
-                }), 500
-
-            # Encontrar la regla en MikroTik
-            mikrotik_rule_id = None
-            if mikrotik_rules:
-                for fw_rule in mikrotik_rules:
-                    if fw_rule.get('src-address') == rule.ip_address:
-                        mikrotik_rule_id = fw_rule.get('.id')
-                        break
-
-            if not mikrotik_rule_id:
-                return jsonify({
-                    'error': 'Regla no encontrada en MikroTik'
-                }), 404
-
             # Preparar datos para actualizar en MikroTik
             mikrotik_update_data = {}
             
@@ -393,9 +413,18 @@ class FirewallController:
             if 'port' in data:
                 mikrotik_update_data['dst-port'] = str(data['port'])
 
-            # Actualizar en MikroTik primero
+            # Actualizar en MikroTik primero usando el .id guardado
+            result = None
             if mikrotik_update_data:
-                result, error = MikroTikService.update_firewall_rule(router, mikrotik_rule_id, mikrotik_update_data)
+                temp_router = RouterCredentials.for_router(router)
+                result, error, found = FirewallController._with_rule_id(
+                    temp_router, rule,
+                    lambda rule_id: MikroTikService.update_firewall_rule(temp_router, rule_id, mikrotik_update_data)
+                )
+                if not found:
+                    return jsonify({
+                        'error': 'Regla no encontrada en MikroTik'
+                    }), 404
                 if error:
                     return jsonify({
                         'error': f'Error al actualizar regla en MikroTik: {error}'
@@ -425,7 +454,7 @@ class FirewallController:
                 'creationDate': rule.creation_date,
                 'isActive': rule.is_active,
                 'message': 'Regla actualizada exitosamente en MikroTik y base de datos',
-                'mikrotik_result': result if mikrotik_update_data else None
+                'mikrotik_result': result
             }), 200
             
         except Exception as e:
@@ -446,33 +475,18 @@ class FirewallController:
             if not router or not router.is_active:
                 return jsonify({'error': 'Router no encontrado o inactivo'}), 404
 
-            # Buscar la regla en MikroTik
-            mikrotik_rules, error = MikroTikService.get_firewall_rules(router)
+            # Eliminar de MikroTik primero usando el .id guardado (si existe)
+            temp_router = RouterCredentials.for_router(router)
+            result, error, mikrotik_deleted = FirewallController._with_rule_id(
+                temp_router, rule,
+                lambda rule_id: MikroTikService.remove_firewall_rule(temp_router, rule_id)
+            )
             if error:
                 return jsonify({
-                    'error': f'Error al consultar MikroTik: {error}',
-                    'warning': 'Procediendo con eliminación solo en base de datos'
+                    'error': f'Error al eliminar regla de MikroTik: {error}',
+                    'warning': 'Regla existe en MikroTik pero no pudo ser eliminada'
                 }), 500
 
-            # Encontrar la regla en MikroTik
-            mikrotik_rule_id = None
-            if mikrotik_rules:
-                for fw_rule in mikrotik_rules:
-                    if fw_rule.get('src-address') == rule.ip_address:
-                        mikrotik_rule_id = fw_rule.get('.id')
-                        break
-
-            # Eliminar de MikroTik primero (si existe)
-            mikrotik_deleted = False
-            if mikrotik_rule_id:
-                result, error = MikroTikService.remove_firewall_rule(router, mikrotik_rule_id)
-                if error:
-                    return jsonify({
-                        'error': f'Error al eliminar regla de MikroTik: {error}',
-                        'warning': 'Regla existe en MikroTik pero no pudo ser eliminada'
-                    }), 500
-                mikrotik_deleted = True
-
             # Eliminar de la base de datos
             rule_data = {
                 'id': rule.firewall_id,
@@ -514,30 +528,33 @@ class FirewallController:
             if not routers:
                 return jsonify({'error': 'No hay routers disponibles'}), 404
 
+            # Cada router en su propio hilo y sesión de DB, con un tiempo límite común
             from services.sync_service import SyncService
+            app = current_app._get_current_object()
+            fanout = FanOutService.run({
+                router.id: partial(SyncService.run_firewall_sync, app, router.id)
+                for router in routers if router
+            }, deadline=get_setting('FIREWALL_SYNC_DEADLINE_SECONDS', 60))
+
             sync_results = []
-            
             for router in routers:
-                if router:
-                    try:
-                        result = SyncService.sync_firewall_rules(router.id)
-                        sync_results.append({
-                            'router_id': router.id,
-                            'router_name': router.name,
-                            'status': 'success',
-                            'result': result
-                        })
-                    except Exception as e:
-                        sync_results.append({
-                            'router_id': router.id,
-                            'router_name': router.name,
-                            'status': 'error',
-                            'error': str(e)
-                        })
+                if not router:
+                    continue
+                entry = {
+                    'router_id': router.id,
+                    'router_name': router.name,
+                    'elapsed_ms': fanout.timings.get(router.id)
+                }
+                if router.id in fanout.results:
+                    entry.update({'status': 'success', 'result': fanout.results[router.id]})
+                else:
+                    entry.update({'status': 'error', 'error': fanout.errors.get(router.id)})
+                sync_results.append(entry)
 
             return jsonify({
-                'message': 'Sincronización completada',
-                'results': sync_results
+                'message': 'Sincronización completada con errores' if fanout.partial else 'Sincronización completada',
+                'results': sync_results,
+                **fanout.to_dict()
             }), 200
             
         except Exception as e:
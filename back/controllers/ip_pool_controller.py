@@ -0,0 +1,105 @@
+from flask import request, jsonify
+from models import db, Router
+from models.ip_pool import IpPool
+from services.ip_pool_service import IpPoolService
+from utils.exceptions import ValidationError
+
+
+class IpPoolController:
+    """Controlador para los pools de direcciones IP de los clientes PPPoE"""
+
+    @staticmethod
+    def get_pools():
+        """GET /api/ip-pools - Listar pools con su ocupación"""
+        query = IpPool.query.filter_by(is_active=True)
+        router_id = request.args.get('router_id', type=int)
+        if router_id:
+            query = query.filter(IpPool.router_id == router_id)
+        pools = query.order_by(IpPool.first_address).all()
+        return jsonify({'pools': [pool.to_dict() for pool in pools]}), 200
+
+    @staticmethod
+    def create_pool():
+        """POST /api/ip-pools - Crear pool (``range`` en CIDR o ``desde-hasta``)"""
+        data = request.get_json() or {}
+        router_id = data.get('router_id')
+        if router_id:
+            router = Router.query.get(router_id)
+            if not router or not router.is_active:
+                return jsonify({'error': 'Router no encontrado o inactivo'}), 404
+        if not router_id and not data.get('profile'):
+            return jsonify({'error': 'Se requiere router_id o profile'}), 400
+
+        try:
+            pool = IpPoolService.create(data.get('name'), data.get('range'),
+                                        router_id=router_id, profile=data.get('profile'))
+        except ValidationError as e:
+            return jsonify({'error': e.message}), 400
+        db.session.commit()
+        return jsonify(pool.to_dict()), 201
+
+    @staticmethod
+    def get_pool(pool_id):
+        """GET /api/ip-pools/{id} - Obtener pool"""
+        pool = IpPool.query.get(pool_id)
+        if not pool or not pool.is_active:
+            return jsonify({'error': 'Pool no encontrado'}), 404
+        return jsonify(pool.to_dict()), 200
+
+    @staticmethod
+    def delete_pool(pool_id):
+        """DELETE /api/ip-pools/{id} - Desactivar pool"""
+        pool = IpPool.query.get(pool_id)
+        if not pool or not pool.is_active:
+            return jsonify({'error': 'Pool no encontrado'}), 404
+        pool.is_active = False
+        db.session.commit()
+        return jsonify({'message': 'Pool eliminado exitosamente'}), 200
+
+    @staticmethod
+    def allocate(pool_id):
+        """POST /api/ip-pools/{id}/allocate - Reservar la siguiente IP libre"""
+        pool = IpPool.query.get(pool_id)
+        if not pool or not pool.is_active:
+            return jsonify({'error': 'Pool no encontrado'}), 404
+        address, error = IpPoolService.allocate(pool_id)
+        if error:
+            return jsonify({'error': error}), 409
+        return jsonify({'pool_id': pool_id, 'ip': str(address)}), 201
+
+    @staticmethod
+    def release(pool_id):
+        """POST /api/ip-pools/{id}/release - Liberar una IP reservada y no usada"""
+        data = request.get_json() or {}
+        pool = IpPool.query.get(pool_id)
+        if not pool or not pool.is_active:
+            return jsonify({'error': 'Pool no encontrado'}), 404
+        if not data.get('ip'):
+            return jsonify({'error': 'Campo requerido: ip'}), 400
+        if IpPoolService.has_client(pool.router_id, data['ip']):
+            return jsonify({'error': 'La IP está asignada a un cliente'}), 409
+        released = IpPoolService.release(pool.router_id, data['ip'])
+        db.session.commit()
+        return jsonify({'ip': data['ip'], 'released': bool(released)}), 200
+
+    @staticmethod
+    def rebuild(pool_id):
+        """POST /api/ip-pools/{id}/rebuild - Recalcular ocupación desde los clientes
+
+        Con ``release_unused=true`` también libera las IPs reservadas sin
+        cliente (solo si no hay altas de clientes en curso).
+        """
+        pool = IpPool.query.get(pool_id)
+        if not pool or not pool.is_active:
+            return jsonify({'error': 'Pool no encontrado'}), 404
+        release_unused = request.args.get('release_unused', 'false').lower() == 'true'
+        pool, error = IpPoolService.rebuild(pool_id, release_unused)
+        if error:
+            return jsonify({'error': error}), 409
+        return jsonify(pool.to_dict()), 200
+
+    @staticmethod
+    def get_conflicts():
+        """GET /api/ip-pools/conflicts - IPs repetidas entre clientes y pools superpuestos"""
+        limit = min(request.args.get('limit', 500, type=int), 5000)
+        return jsonify(IpPoolService.conflicts(limit)), 200
@@ -1,25 +1,49 @@
-from flask import request, jsonify
-from sqlalchemy import or_
+from flask import request, jsonify, Response, current_app
 from datetime import datetime
 from models import db
 from models.router import Router, Secret
+from models.pppoe_session import ActiveSession, SessionEvent
+from models.ip_pool import IpPool
 from services.mikrotik_service import MikroTikService
-from services.encryption_service import EncryptionService
+from services.router_credentials import RouterCredentials
+from services.sync_job_service import SyncJobService
+from services.session_collector import SessionCollectorService
+from services.session_publisher import SessionPublisher
+from services.client_search import ClientSearchService
+from services.ip_pool_service import IpPoolService
+from config.config import get_setting
+from utils.exceptions import ValidationError
+from utils.ip_range import range_filter
+from utils.pagination import keyset_paginate, wants_cursor
+import json
+import queue
 import secrets
 import string
 
 class PPPoEController:
     @staticmethod
-    def _temp_router(router):
-        return type(
-            "RouterObj",
-            (object,),
-            {
-                "uri": router.uri,
-                "username": router.username,
-                "password": EncryptionService.decrypt_password(router.password),
-            },
-        )
+    def _with_secret_id(temp_router, client, operation):
+        """Ejecuta ``operation(secret_id)`` sobre el secret del cliente en MikroTik.
+
+        Usa el ``.id`` guardado en la base de datos; solo si el router lo
+        reporta como inexistente (o no se conoce) se vuelve a buscar por
+        nombre y se reintenta.  Devuelve ``(result, error, found)``.
+        """
+        if client.mikrotik_id:
+            result, error = operation(client.mikrotik_id)
+            if not MikroTikService.is_missing_item_error(error):
+                return result, error, True
+
+        mikrotik_secret, error = MikroTikService.find_pppoe_secret(temp_router, client.name, ['.id'])
+        if error:
+            return None, error, True
+        if not mikrotik_secret:
+            return None, None, False
+
+        client.mikrotik_id = mikrotik_secret['.id']
+        result, error = operation(client.mikrotik_id)
+        return result, error, True
+
     @staticmethod
     def get_all_clients():
         """GET /api/pppoe/clients - Listar todos los clientes"""
@@ -32,20 +56,13 @@ class PPPoEController:
         status = request.args.get('status')
         profile = request.args.get('profile')
         is_active_param = request.args.get('is_active')
-        # Si no hay datos en DB o se fuerza sync, intentar sincronizar
-        secrets_count = Secret.query.filter_by(is_active=True).count()
-        
-        if secrets_count == 0 or force_sync:
-            # Intentar sincronizar automáticamente
-            routers = Router.query.filter_by(is_active=True).all()
-            if routers:
-                from services.sync_service import SyncService
-                if router_id:
-                    if any(r.id == router_id for r in routers):
-                        SyncService.sync_router(router_id, 'auto')
-                else:
-                    for r in routers:
-                        SyncService.sync_router(r.id, 'auto')
+        # Responder siempre desde la DB; los routers con datos vencidos (o
+        # todos con sync=true) se refrescan en segundo plano
+        scope = Router.query.filter_by(is_active=True)
+        if router_id:
+            scope = scope.filter(Router.id == router_id)
+        scope_ids = [r.id for r in scope.with_entities(Router.id).all()]
+        refreshing = SyncJobService.refresh_stale(scope_ids, force=force_sync)
         
         # Construir consulta base
         query = Secret.query
@@ -56,16 +73,17 @@ class PPPoEController:
         else:
             query = query.filter(Secret.is_active == True)
 
-        # Filtrar por búsqueda
+        # Filtrar por búsqueda (índice de trigramas o n-gram en memoria)
         if search:
-            query = query.filter(
-                or_(
-                    Secret.name.ilike(f'%{search}%'),
-                    Secret.comment.ilike(f'%{search}%'),
-                    Secret.ip_address.ilike(f'%{search}%'),
-                    Secret.contract.ilike(f'%{search}%')
-                )
-            )
+            query = ClientSearchService.filter(query, search)
+
+        # Filtrar por CIDR (?cidr=10.20.0.0/16) o rango (?ip_from= / ?ip_to=)
+        try:
+            ip_range = range_filter(request.args)
+        except ValidationError as e:
+            return jsonify({'error': e.message}), 400
+        if ip_range:
+            query = query.filter(Secret.ip_value.between(*ip_range))
 
         # Filtrar por router
         if router_id:
@@ -82,35 +100,39 @@ class PPPoEController:
             elif status in ['suspended', 'blocked', 'disconnected']:
                 query = query.filter(Secret.is_active == False)
 
-        # Consultar datos actualizados
-        clients = db.paginate(
-            query,
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        # Paginación por cursor (?cursor= / ?limit=) u offset (?page=)
+        if wants_cursor():
+            try:
+                clients = keyset_paginate(query, {
+                    'id': (Secret.id,),
+                    'name': (Secret.name, Secret.id),
+                }, default_limit=per_page)
+            except ValidationError as e:
+                return jsonify({'error': e.message}), 400
+            pagination = clients.meta()
+        else:
+            clients = db.paginate(
+                query,
+                page=page,
+                per_page=per_page,
+                error_out=False
+            )
+            pagination = {
+                'total': clients.total,
+                'pages': clients.pages,
+                'current_page': page
+            }
 
-        # Mapear IPs activas desde los routers para clientes conectados
-        router_ids = {c.router_id for c in clients.items}
-        active_ips = {}
-        if router_ids:
-            routers = Router.query.filter(Router.id.in_(router_ids)).all()
-            for router in routers:
-                temp_router = PPPoEController._temp_router(router)
-                sessions, _ = MikroTikService.get_pppoe_active(temp_router)
-                if not sessions:
-                    continue
-                for s in sessions:
-                    name = s.get('name')
-                    address = s.get('address') or s.get('remote-address')
-                    if name and address:
-                        active_ips[name] = address
+        # Mapear IPs activas desde la captura de sesiones
+        active_ips = SessionCollectorService.active_addresses(
+            {c.router_id for c in clients.items}, {c.name for c in clients.items}
+        )
 
         return jsonify({
             'clients': [{
                 'id': c.id,
                 'name': c.name,
-                'ip': c.ip_address or active_ips.get(c.name, ''),
+                'ip': c.ip_address or active_ips.get((c.router_id, c.name), ''),
                 'profile': c.profile,
                 'comment': c.comment,
                 'contract': c.contract,
@@ -118,20 +140,22 @@ class PPPoEController:
                 'is_active': c.is_active,
                 'created_at': c.created_at.isoformat() if c.created_at else None
             } for c in clients.items],
-            'total': clients.total,
-            'pages': clients.pages,
-            'current_page': page
+            **pagination,
+            'data_age': SyncJobService.data_age(scope_ids),
+            'refreshing': refreshing
         }), 200
 
     
     @staticmethod
     def create_client():
         """POST /api/pppoe/clients - Crear nuevo cliente"""
+        # IP tomada del pool que aún no pertenece a un cliente guardado
+        pending_ip = None
         try:
             data = request.get_json()
             
-            # Validar datos requeridos
-            required_fields = ['router_id', 'name', 'password', 'ip']
+            # Validar datos requeridos (sin ip se asigna desde el pool)
+            required_fields = ['router_id', 'name', 'password']
             for field in required_fields:
                 if field not in data or not data[field]:
                     return jsonify({'error': f'Campo requerido: {field}'}), 400
@@ -141,6 +165,19 @@ class PPPoEController:
             if not router or not router.is_active:
                 return jsonify({'error': 'Router no encontrado o inactivo'}), 404
 
+            # Asignar la siguiente IP libre del pool del router/perfil
+            if data.get('ip') and IpPoolService.is_used(router.id, data['ip']):
+                return jsonify({'error': f"La IP {data['ip']} ya está asignada a otro cliente"}), 409
+            if not data.get('ip'):
+                pool = (IpPool.query.get(data['pool_id']) if data.get('pool_id')
+                        else IpPoolService.find(router.id, data.get('profile', 'default')))
+                if not pool or not pool.is_active:
+                    return jsonify({'error': 'Campo requerido: ip (no hay pool de IPs para el router)'}), 400
+                address, error = IpPoolService.allocate(pool.id)
+                if error:
+                    return jsonify({'error': error}), 409
+                data['ip'] = pending_ip = str(address)
+
             # 1. Crear cliente en MikroTik primero
             mikrotik_data = {
                 'name': data['name'],
@@ -154,9 +191,10 @@ class PPPoEController:
             if data.get('local_address'):
                 mikrotik_data['local-address'] = data['local_address']
             
-            temp_router = PPPoEController._temp_router(router)
+            temp_router = RouterCredentials.for_router(router)
             result, error = MikroTikService.create_pppoe_secret(temp_router, mikrotik_data)
             if error:
+                PPPoEController._release_pending_ip(router.id, pending_ip)
                 return jsonify({
                     'error': f'Error al crear cliente en MikroTik: {error}'
                 }), 500
@@ -164,6 +202,7 @@ class PPPoEController:
             # 2. Si se creó exitosamente en MikroTik, guardarlo en DB
             client = Secret(
                 router_id=data['router_id'],
+                mikrotik_id=MikroTikService.created_id(result),
                 ip_address=data['ip'],
                 name=data['name'],
                 password=data['password'],
@@ -175,7 +214,9 @@ class PPPoEController:
             )
             
             db.session.add(client)
+            IpPoolService.reserve(client.router_id, client.ip_address)
             db.session.commit()
+            pending_ip = None
             
             # 3. Enviar datos al frontend
             return jsonify({
@@ -194,7 +235,21 @@ class PPPoEController:
         except Exception as e:
             # Si hay error, intentar rollback en caso de que se haya guardado en DB
             db.session.rollback()
+            if pending_ip:
+                PPPoEController._release_pending_ip(data['router_id'], pending_ip)
             return jsonify({'error': f'Error interno: {str(e)}'}), 500
+
+    @staticmethod
+    def _release_pending_ip(router_id, address):
+        """Devuelve al pool una IP asignada a un cliente que no se llegó a crear"""
+        if not address:
+            return
+        try:
+            IpPoolService.release(router_id, address)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"No se pudo liberar la IP {address}: {e}")
     
     @staticmethod
     def get_clients_by_router(router_id):
@@ -221,15 +276,8 @@ class PPPoEController:
         if not query:
             return jsonify([]), 200
         
-        clients = Secret.query.filter(
-            or_(
-                Secret.name.ilike(f'%{query}%'),
-                Secret.comment.ilike(f'%{query}%'),
-                Secret.ip_address.ilike(f'%{query}%'),
-                Secret.contract.ilike(f'%{query}%')
-            ),
-            Secret.is_active == True
-        ).limit(20).all()
+        # Coincidencias ordenadas por relevancia (nombre exacto, prefijo, texto)
+        clients = ClientSearchService.search(query, limit=20)
         
         return jsonify([{
             'id': c.id,
@@ -240,6 +288,11 @@ class PPPoEController:
             'contract': c.contract
         } for c in clients]), 200
     
+    @staticmethod
+    def get_search_stats():
+        """GET /api/pppoe/clients/search/stats - Backend e índice en memoria (entradas, memoria)"""
+        return jsonify(ClientSearchService.stats()), 200
+    
     @staticmethod
     def get_client(client_id):
         """GET /api/pppoe/clients/{id} - Obtener cliente específico"""
@@ -272,20 +325,15 @@ class PPPoEController:
             if not router:
                 return jsonify({'error': 'Router no encontrado'}), 404
             
-            # Buscar el cliente en MikroTik
-            temp_router = PPPoEController._temp_router(router)
-            mikrotik_data, error = MikroTikService.get_pppoe_secrets(temp_router)
+            # Buscar el cliente en MikroTik (por .id o filtrado por nombre en el router)
+            temp_router = RouterCredentials.for_router(router)
+            mikrotik_client, error, _ = PPPoEController._with_secret_id(
+                temp_router, client,
+                lambda secret_id: MikroTikService.get_pppoe_secret_by_id(temp_router, secret_id)
+            )
             if error:
                 return jsonify({'error': f'Error al consultar MikroTik: {error}'}), 500
             
-            # Buscar el cliente específico en los datos de MikroTik
-            mikrotik_client = None
-            if mikrotik_data:
-                for secret in mikrotik_data:
-                    if secret.get('name') == client.name:
-                        mikrotik_client = secret
-                        break
-            
             if mikrotik_client:
                 # 3. Actualizar datos en DB con información de MikroTik
                 client.ip_address = mikrotik_client.get('remote-address', client.ip_address)
@@ -331,28 +379,12 @@ class PPPoEController:
             if not router or not router.is_active:
                 return jsonify({'error': 'Router no encontrado o inactivo'}), 404
 
-            # 2. Buscar el cliente en MikroTik para obtener su ID interno
-            temp_router = PPPoEController._temp_router(router)
-            mikrotik_secrets, error = MikroTikService.get_pppoe_secrets(temp_router)
-            if error:
-                return jsonify({
-                    'error': f'Error al consultar MikroTik: {error}'
-                }), 500
-            
-            # Encontrar el secret en MikroTik por nombre
-            mikrotik_secret_id = None
-            if mikrotik_secrets:
-                for secret in mikrotik_secrets:
-                    if secret.get('name') == client.name:
-                        mikrotik_secret_id = secret.get('.id')
-                        break
-            
-            if not mikrotik_secret_id:
-                return jsonify({
-                    'error': 'Cliente no encontrado en MikroTik'
-                }), 404
-            
-            # 3. Preparar datos para actualizar en MikroTik
+            # La nueva IP no puede estar en uso por otro cliente
+            new_ip = data.get('ip')
+            if new_ip and new_ip != client.ip_address and IpPoolService.is_used(client.router_id, new_ip):
+                return jsonify({'error': f"La IP {data['ip']} ya está asignada a otro cliente"}), 409
+
+            # 2. Preparar datos para actualizar en MikroTik
             mikrotik_update_data = {}
             
             if 'name' in data:
@@ -368,18 +400,29 @@ class PPPoEController:
             if 'local_address' in data:
                 mikrotik_update_data['local-address'] = data['local_address']
             
-            # 4. Actualizar en MikroTik primero
+            # 3. Actualizar en MikroTik primero usando el .id guardado
+            result = None
             if mikrotik_update_data:
-                result, error = MikroTikService.update_pppoe_secret(temp_router, mikrotik_secret_id, mikrotik_update_data)
+                temp_router = RouterCredentials.for_router(router)
+                result, error, found = PPPoEController._with_secret_id(
+                    temp_router, client,
+                    lambda secret_id: MikroTikService.update_pppoe_secret(temp_router, secret_id, mikrotik_update_data)
+                )
+                if not found:
+                    return jsonify({
+                        'error': 'Cliente no encontrado en MikroTik'
+                    }), 404
                 if error:
                     return jsonify({
                         'error': f'Error al actualizar cliente en MikroTik: {error}'
                     }), 500
             
-            # 5. Si se actualizó exitosamente en MikroTik, actualizar en DB
+            # 4. Si se actualizó exitosamente en MikroTik, actualizar en DB
             if 'name' in data:
                 client.name = data['name']
-            if 'ip' in data:
+            if 'ip' in data and data['ip'] != client.ip_address:
+                IpPoolService.release(client.router_id, client.ip_address)
+                IpPoolService.reserve(client.router_id, data['ip'])
                 client.ip_address = data['ip']
             if 'password' in data:
                 client.password = data['password']
@@ -393,7 +436,7 @@ class PPPoEController:
             client.created_at = datetime.utcnow()
             db.session.commit()
             
-            # 6. Enviar datos actualizados al frontend
+            # 5. Enviar datos actualizados al frontend
             return jsonify({
                 'id': client.id,
                 'name': client.name,
@@ -404,7 +447,7 @@ class PPPoEController:
                 'router_id': client.router_id,
                 'is_active': client.is_active,
                 'created_at': client.created_at.isoformat() if client.created_at else None,
-                'mikrotik_result': result if mikrotik_update_data else None,
+                'mikrotik_result': result,
                 'message': 'Cliente actualizado exitosamente en MikroTik y base de datos'
             }), 200
             
@@ -418,6 +461,12 @@ class PPPoEController:
         data = request.get_json()
         client = Secret.query.get_or_404(client_id)
         
+        if 'ip_address' in data and data['ip_address'] != client.ip_address:
+            if IpPoolService.is_used(client.router_id, data['ip_address']):
+                return jsonify({'error': f"La IP {data['ip_address']} ya está asignada a otro cliente"}), 409
+            IpPoolService.release(client.router_id, client.ip_address)
+            IpPoolService.reserve(client.router_id, data['ip_address'])
+
         for field in ['name', 'ip_address', 'password', 'comment', 'profile', 'contract']:
             if field in data:
                 setattr(client, field, data[field])
@@ -440,35 +489,20 @@ class PPPoEController:
             if not router or not router.is_active:
                 return jsonify({'error': 'Router no encontrado o inactivo'}), 404
 
-            # 2. Buscar el cliente en MikroTik para obtener su ID interno
-            temp_router = PPPoEController._temp_router(router)
-            mikrotik_secrets, error = MikroTikService.get_pppoe_secrets(temp_router)
+            # 2. Eliminar de MikroTik primero usando el .id guardado (si existe)
+            temp_router = RouterCredentials.for_router(router)
+            result, error, found = PPPoEController._with_secret_id(
+                temp_router, client,
+                lambda secret_id: MikroTikService.delete_pppoe_secret(temp_router, secret_id)
+            )
             if error:
                 return jsonify({
-                    'error': f'Error al consultar MikroTik: {error}',
-                    'warning': 'Procediendo con eliminación solo en base de datos'
+                    'error': f'Error al eliminar cliente de MikroTik: {error}',
+                    'warning': 'Cliente existe en MikroTik pero no pudo ser eliminado'
                 }), 500
+            mikrotik_deleted = found
             
-            # Encontrar el secret en MikroTik por nombre
-            mikrotik_secret_id = None
-            if mikrotik_secrets:
-                for secret in mikrotik_secrets:
-                    if secret.get('name') == client.name:
-                        mikrotik_secret_id = secret.get('.id')
-                        break
-            
-            # 3. Eliminar de MikroTik primero (si existe)
-            mikrotik_deleted = False
-            if mikrotik_secret_id:
-                result, error = MikroTikService.delete_pppoe_secret(temp_router, mikrotik_secret_id)
-                if error:
-                    return jsonify({
-                        'error': f'Error al eliminar cliente de MikroTik: {error}',
-                        'warning': 'Cliente existe en MikroTik pero no pudo ser eliminado'
-                    }), 500
-                mikrotik_deleted = True
-            
-            # 4. Eliminar de la base de datos
+            # 3. Eliminar de la base de datos
             client_data = {
                 'id': client.id,
                 'name': client.name,
@@ -477,9 +511,10 @@ class PPPoEController:
             }
             
             db.session.delete(client)
+            IpPoolService.release(client.router_id, client.ip_address)
             db.session.commit()
             
-            # 5. Enviar mensaje de éxito al frontend
+            # 4. Enviar mensaje de éxito al frontend
             return jsonify({
                 'message': 'Cliente eliminado exitosamente',
                 'deleted_client': client_data,
@@ -572,62 +607,70 @@ class PPPoEController:
         log_type = request.args.get('type', 'all')
         limit = request.args.get('limit', 50, type=int)
         
-        # Aquí iría la lógica para obtener logs del cliente
-        return jsonify({
+        # Historial registrado por el listener de sesiones o por la captura periódica
+        query = SessionEvent.query.filter_by(router_id=client.router_id, name=client.name)
+        if log_type in (SessionEvent.CONNECT, SessionEvent.DISCONNECT):
+            query = query.filter_by(event=log_type)
+        events = query.order_by(SessionEvent.occurred_at.desc()).limit(limit).all()
+
+        response = {
             'client_id': client_id,
-            'logs': [],
-            'message': 'No hay logs disponibles'
-        }), 200
+            'logs': [event.to_dict() for event in events]
+        }
+        if not events:
+            response['message'] = 'No hay logs disponibles'
+        return jsonify(response), 200
 
     @staticmethod
     def get_active_sessions():
-        """GET /api/pppoe/sessions/active - Sesiones PPPoE activas"""
-        routers = Router.query.filter_by(is_active=True).all()
-        sessions = []
-        for router in routers:
-            temp_router = PPPoEController._temp_router(router)
-            data, error = MikroTikService.get_pppoe_active(temp_router)
-            if error or not data:
-                continue
-
-            interfaces, _ = MikroTikService.get_interfaces(temp_router)
-
-            for s in data:
-                username = s.get('name', '')
-                iface = None
-
-                if interfaces:
-                    prefix = f"pppoe-{username}"
-                    for i in interfaces:
-                        name = (i.get('name') or '').strip('<>')
-                        if name.startswith(prefix):
-                            iface = i
-                            break
-
-                if iface:
-                    rx_bytes = int(iface.get('rx-byte') or iface.get('rx_bytes') or 0)
-                    tx_bytes = int(iface.get('tx-byte') or iface.get('tx_bytes') or 0)
-                    rx_packets = int(iface.get('rx-packet') or iface.get('rx_packets') or 0)
-                    tx_packets = int(iface.get('tx-packet') or iface.get('tx_packets') or 0)
-                    interface_found = True
-                else:
-                    rx_bytes = tx_bytes = rx_packets = tx_packets = 0
-                    interface_found = False
-
-                sessions.append({
-                    'id': s.get('.id') or s.get('id'),
-                    'clientName': username,
-                    'clientId': None,
-                    'address': s.get('address', ''),
-                    'uptime': s.get('uptime', ''),
-                    'rxBytes': rx_bytes,
-                    'txBytes': tx_bytes,
-                    'rxPackets': rx_packets,
-                    'txPackets': tx_packets,
-                    'routerId': str(router.id),
-                    'routerName': router.name,
-                    'callingStationId': s.get('caller-id'),
-                    'calledStationId': s.get('called-id'),
-                    'interfaceFound': interface_found,
-                })
+        """GET /api/pppoe/sessions/active - Sesiones PPPoE activas (desde la captura)"""
+        details = request.args.get('details', 'false').lower() == 'true'
+        routers = {r.id: r.name for r in Router.query.filter_by(is_active=True).all()}
+        # Sin recolector en marcha la captura nunca llegaría: consultar en vivo
+        SessionCollectorService.ensure_collected(routers)
+
+        rows = ActiveSession.query.filter(
+            ActiveSession.router_id.in_(list(routers))
+        ).order_by(ActiveSession.router_id, ActiveSession.name).all()
+        sessions = [row.to_session_dict(routers[row.router_id]) for row in rows]
+
+        if details:
+            data_age, errors = SessionCollectorService.collection_status(routers)
+            return jsonify({'sessions': sessions, 'errors': errors, 'data_age': data_age}), 200
         return jsonify(sessions), 200
+
+    @staticmethod
+    def _sse(event, data):
+        """Formatea un evento Server-Sent Events"""
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    @staticmethod
+    def stream_active_sessions():
+        """GET /api/pppoe/sessions/stream - Sesiones activas en vivo (Server-Sent Events)
+
+        Envía un evento ``snapshot`` con todas las sesiones y luego eventos
+        ``delta`` con las sesiones conectadas, desconectadas y los
+        contadores que cambiaron.  Todos los clientes comparten el mismo
+        publicador, por lo que abrir más streams no genera más consultas.
+        """
+        subscription, snapshot = SessionPublisher.subscribe(current_app._get_current_object())
+        heartbeat = get_setting('SESSION_STREAM_HEARTBEAT', 15)
+
+        def events():
+            try:
+                yield PPPoEController._sse('snapshot', {'type': 'snapshot', 'sessions': snapshot})
+                while not subscription.dropped:
+                    try:
+                        event = subscription.events.get(timeout=heartbeat)
+                    except queue.Empty:
+                        # Comentario SSE para mantener viva la conexión
+                        yield ': keepalive\n\n'
+                        continue
+                    yield PPPoEController._sse('delta', event)
+            finally:
+                SessionPublisher.unsubscribe(subscription)
+
+        return Response(events(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
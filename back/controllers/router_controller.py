@@ -5,7 +5,12 @@ from models import db
 from models.router import Router, Branch
 from models.user import User
 from services.mikrotik_service import MikroTikService
+from services.router_cache import RouterReadCache
+from services.router_health import RouterHealth
+from services.router_scheduler import RouterScheduler
+from services.single_flight import SingleFlight
 from services.encryption_service import EncryptionService
+from services.router_credentials import RouterCredentials
 
 class RouterController:
     @staticmethod
@@ -42,7 +47,9 @@ class RouterController:
             'username': r.username,
             'branch_id': r.branch_id,
             'branch': {'id': r.branch.id, 'name': r.branch.name} if r.branch else None,
+            'api_transport': r.api_transport,
             'status': getattr(r, 'status', None),
+            'circuit_state': RouterHealth.snapshot(r.uri)['state'],
             'created_at': r.created_at.isoformat() if r.created_at else None,
             'updated_at': r.updated_at.isoformat() if r.updated_at else None
         } for r in routers]), 200
@@ -58,6 +65,7 @@ class RouterController:
             'uri': router.uri,
             'username': router.username,
             'branch_id': router.branch_id,
+            'api_transport': router.api_transport,
             'is_active': router.is_active,
             'created_at': router.created_at.isoformat() if router.created_at else None
         }), 200
@@ -78,6 +86,10 @@ class RouterController:
         branch = Branch.query.get(data['branch_id'])
         if not branch:
             return jsonify({'error': 'Sucursal no encontrada'}), 404
+
+        api_transport = data.get('api_transport', 'rest')
+        if api_transport not in Router.TRANSPORTS:
+            return jsonify({'error': f"Transporte inválido: {api_transport}"}), 400
         
         # Encriptar contraseña
         encrypted_password = EncryptionService.encrypt_password(data['password'])
@@ -87,7 +99,8 @@ class RouterController:
             uri=data['uri'],
             username=data['username'],
             password=encrypted_password,
-            branch_id=data['branch_id']
+            branch_id=data['branch_id'],
+            api_transport=api_transport
         )
         
         db.session.add(router)
@@ -110,6 +123,12 @@ class RouterController:
         
         router = Router.query.get_or_404(router_id)
         data = request.get_json()
+
+        if 'api_transport' in data and data['api_transport'] not in Router.TRANSPORTS:
+            return jsonify({'error': f"Transporte inválido: {data['api_transport']}"}), 400
+
+        old_uri = router.uri
+        old_username = router.username
         
         router.name = data.get('name', router.name)
         router.uri = data.get('uri', router.uri)
@@ -119,8 +138,15 @@ class RouterController:
             router.password = EncryptionService.encrypt_password(data['password'])
         
         router.branch_id = data.get('branch_id', router.branch_id)
+        router.api_transport = data.get('api_transport', router.api_transport)
         
         db.session.commit()
+
+        # Cerrar las conexiones persistentes si cambió el destino o las credenciales
+        if router.uri != old_uri or router.username != old_username or 'password' in data:
+            MikroTikService.invalidate_sessions(old_uri)
+        RouterCredentials.invalidate(router.id)
+
         return jsonify({'message': 'Router actualizado'}), 200
     
     @staticmethod
@@ -136,6 +162,8 @@ class RouterController:
         router = Router.query.get_or_404(router_id)
         router.is_active = False
         db.session.commit()
+        MikroTikService.invalidate_sessions(router.uri)
+        RouterCredentials.invalidate(router.id)
         
         return jsonify({'message': 'Router eliminado'}), 200
     
@@ -146,12 +174,7 @@ class RouterController:
         router = Router.query.get_or_404(router_id)
         
         # Desencriptar contraseña para la conexión
-        decrypted_password = EncryptionService.decrypt_password(router.password)
-        test_router = type('obj', (object,), {
-            'uri': router.uri,
-            'username': router.username,
-            'password': decrypted_password
-        })
+        test_router = RouterCredentials.for_router(router)
         
         success, message = MikroTikService.test_connection(test_router)
 
@@ -171,19 +194,19 @@ class RouterController:
         router = Router.query.get_or_404(router_id)
         
         # Probar conexión para obtener estado actual
-        decrypted_password = EncryptionService.decrypt_password(router.password)
-        test_router = type('obj', (object,), {
-            'uri': router.uri,
-            'username': router.username,
-            'password': decrypted_password
-        })
+        test_router = RouterCredentials.for_router(router)
         
-        connected, _ = MikroTikService.test_connection(test_router)
-        status = 'online' if connected else 'offline'
+        # Lectura de recursos cacheada unos segundos en lugar de una prueba de conexión completa
+        resources, error = MikroTikService.get_router_resources(test_router)
+        status = 'online' if error is None else 'offline'
         
         return jsonify({
             'router_id': router.id,
             'status': status,
+            'uptime': (resources or {}).get('uptime'),
+            'error': error,
+            'circuit': RouterHealth.snapshot(router.uri),
+            'scheduler': RouterScheduler.snapshot(router.uri),
             'last_check': router.updated_at.isoformat() if router.updated_at else None
         }), 200
 
@@ -192,12 +215,7 @@ class RouterController:
     def get_interfaces(router_id):
         """GET /api/routers/{id}/interfaces - List router interfaces"""
         router = Router.query.get_or_404(router_id)
-        decrypted_password = EncryptionService.decrypt_password(router.password)
-        temp_router = type('obj', (object,), {
-            'uri': router.uri,
-            'username': router.username,
-            'password': decrypted_password
-        })
+        temp_router = RouterCredentials.for_router(router)
         data, error = MikroTikService.get_interfaces(temp_router)
         if error:
             return jsonify({'error': error}), 500
@@ -208,13 +226,18 @@ class RouterController:
     def get_resources(router_id):
         """GET /api/routers/{id}/resources - Router resource usage"""
         router = Router.query.get_or_404(router_id)
-        decrypted_password = EncryptionService.decrypt_password(router.password)
-        temp_router = type('obj', (object,), {
-            'uri': router.uri,
-            'username': router.username,
-            'password': decrypted_password
-        })
+        temp_router = RouterCredentials.for_router(router)
         data, error = MikroTikService.get_router_resources(temp_router)
         if error:
             return jsonify({'error': error}), 500
-        return jsonify(data), 200
\ No newline at end of file
+        return jsonify(data), 200
+
+    @staticmethod
+    @jwt_required()
+    def get_cache_stats():
+        """GET /api/routers/cache/stats - Aciertos y fallos de la caché de lecturas"""
+        stats = RouterReadCache.stats()
+        # Lecturas concurrentes resueltas con la petición de otro hilo o worker
+        stats['singleflight'] = SingleFlight.stats()
+        stats['credentials'] = RouterCredentials.stats()
+        return jsonify(stats), 200
\ No newline at end of file
@@ -1,10 +1,14 @@
 from flask import request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models.user import User
+from models import db
 from models.router import Router
+from models.sync_log import SyncLog
+from services.sync_job_service import SyncJobService
 from services.sync_service import SyncService
+from config.config import get_setting
 from utils.response import success_response, error_response
-from datetime import datetime
+from datetime import datetime, timedelta
 
 class SyncController:
     @staticmethod
@@ -17,12 +21,18 @@ class SyncController:
         if current_user.role not in ['admin', 'manager', 'operator']:
             return jsonify({'error': 'Acceso denegado'}), 403
         
-        success, message = SyncService.sync_router(router_id, 'manual')
+        router = Router.query.get(router_id)
+        if not router:
+            return jsonify({'error': 'Router no encontrado'}), 404
+
+        job = SyncJobService.submit('router', [[router_id]], 'manual')
         return jsonify({
-            'success': success,
-            'message': message,
-            'router_id': router_id
-        }), 200 if success else 400
+            'success': True,
+            'message': 'Sincronización en curso',
+            'router_id': router_id,
+            'job_id': job.id,
+            'status_url': f'/api/sync/jobs/{job.id}'
+        }), 202
     
     @staticmethod
     @jwt_required()
@@ -34,32 +44,72 @@ class SyncController:
         if current_user.role not in ['admin', 'manager']:
             return jsonify({'error': 'Acceso denegado'}), 403
         
-        results = SyncService.sync_all_routers()
-        successful = len([r for r in results if r['success']])
-        
+        routers = Router.query.filter_by(is_active=True).order_by(Router.id).all()
+        if not routers:
+            return jsonify({
+                'success': True,
+                'message': 'No hay routers activos para sincronizar',
+                'total': 0
+            }), 200
+
+        job = SyncJobService.submit('all', SyncService.plan_lanes(routers), 'bulk')
         return jsonify({
-            'results': results,
-            'total': len(results),
-            'successful': successful,
-            'failed': len(results) - successful
-        }), 200
+            'success': True,
+            'message': 'Sincronización en curso',
+            'total': len(routers),
+            'job_id': job.id,
+            'status_url': f'/api/sync/jobs/{job.id}'
+        }), 202
+
+    @staticmethod
+    @jwt_required()
+    def get_sync_job(job_id):
+        """GET /api/sync/jobs/{job_id} - Progreso de un trabajo de sincronización"""
+        job = SyncJobService.get_job(job_id)
+        if not job:
+            return error_response('Trabajo no encontrado', 404)
+        return success_response({'job': job})
     
     @staticmethod
     @jwt_required()
     def get_sync_status():
         """GET /api/sync/status - Estado de la sincronización"""
         try:
-            routers = Router.query.filter_by(is_active=True).all()
-            total_routers = len(routers)
-            
-            # Mock data for now - would be replaced with actual sync service data
+            router_ids = [r.id for r in Router.query.filter_by(is_active=True).all()]
+            total_routers = len(router_ids)
+
+            # Último log terminado de cada router activo
+            latest_ids = db.session.query(db.func.max(SyncLog.id)).filter(
+                SyncLog.router_id.in_(router_ids),
+                SyncLog.status != 'running'
+            ).group_by(SyncLog.router_id)
+            latest_logs = SyncLog.query.filter(SyncLog.id.in_(latest_ids)).all()
+
+            # Logs "running" muy antiguos provienen de procesos interrumpidos
+            running_since = datetime.utcnow() - timedelta(hours=1)
+            running_logs = SyncLog.query.filter(
+                SyncLog.status == 'running',
+                SyncLog.started_at >= running_since
+            ).count()
+            active_jobs = SyncJobService.active_jobs()
+
+            completed = [log.completed_at for log in latest_logs if log.completed_at]
+            last_scheduled = SyncLog.query.filter_by(sync_type='scheduled') \
+                .order_by(SyncLog.started_at.desc()).first()
+            next_sync = None
+            if last_scheduled:
+                next_sync = last_scheduled.started_at + timedelta(
+                    seconds=get_setting('SYNC_INTERVAL_SECONDS', 900)
+                )
+
             status = {
-                'is_running': False,
-                'last_sync': datetime.now().isoformat() if total_routers > 0 else None,
-                'next_sync': None,  # Would be calculated based on schedule
-                'success_count': total_routers,  # Mock: assume all successful
-                'error_count': 0,  # Mock: no errors
-                'total_routers': total_routers
+                'is_running': bool(active_jobs) or running_logs > 0,
+                'last_sync': max(completed).isoformat() if completed else None,
+                'next_sync': next_sync.isoformat() if next_sync else None,
+                'success_count': len([log for log in latest_logs if log.status == 'success']),
+                'error_count': len([log for log in latest_logs if log.status == 'error']),
+                'total_routers': total_routers,
+                'active_jobs': [job.id for job in active_jobs]
             }
             
             return success_response({'status': status})
@@ -74,20 +124,28 @@ class SyncController:
         try:
             router_id = request.args.get('router_id', type=int)
             limit = request.args.get('limit', 20, type=int)
-            
-            # Mock data for now - would be replaced with actual sync service data
+            job_id = request.args.get('job_id')
+
+            query = db.session.query(SyncLog, Router.name).outerjoin(
+                Router, SyncLog.router_id == Router.id
+            )
+            if router_id:
+                query = query.filter(SyncLog.router_id == router_id)
+            if job_id:
+                query = query.filter(SyncLog.job_id == job_id)
+
             logs = []
-            routers = Router.query.filter_by(is_active=True).limit(limit).all()
-            
-            for i, router in enumerate(routers):
+            for log, router_name in query.order_by(SyncLog.id.desc()).limit(limit).all():
                 logs.append({
-                    'id': i + 1,
-                    'router_id': router.id,
-                    'router_name': router.name,
-                    'status': 'success',  # Mock: assume successful
-                    'message': f'Sincronización exitosa para {router.name}',
-                    'duration': 1500,  # Mock: 1.5 seconds
-                    'timestamp': datetime.now().isoformat()
+                    'id': log.id,
+                    'router_id': log.router_id,
+                    'router_name': router_name,
+                    'job_id': log.job_id,
+                    'status': 'pending' if log.status == 'running' else log.status,
+                    'message': log.message,
+                    'duration': round((log.duration_seconds or 0) * 1000),
+                    'records_synced': log.records_synced,
+                    'timestamp': log.started_at.isoformat() if log.started_at else None
                 })
             
             return success_response({'logs': logs})
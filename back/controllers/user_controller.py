@@ -5,6 +5,8 @@ from models.user import User, SecurityEvent
 from utils.decorators import require_role, handle_errors
 from utils.validators import validate_email, validate_password, validate_required_fields
 from utils.response import success_response, error_response
+from utils.exceptions import ValidationError
+from utils.pagination import keyset_paginate, wants_cursor
 
 class UserController:
     @staticmethod
@@ -27,12 +29,29 @@ class UserController:
         elif status == 'inactive':
             query = query.filter_by(is_active=False)
 
-        users = db.paginate(
-            query,
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        # Paginación por cursor (?cursor= / ?limit=) u offset (?page=)
+        if wants_cursor():
+            try:
+                users = keyset_paginate(query, {
+                    'id': (User.id,),
+                    'username': (User.username,),
+                }, default_limit=per_page, max_limit=100)
+            except ValidationError as e:
+                return error_response(e.message, 400)
+            pagination = users.meta()
+        else:
+            users = db.paginate(
+                query,
+                page=page,
+                per_page=per_page,
+                error_out=False
+            )
+            pagination = {
+                'page': users.page,
+                'per_page': users.per_page,
+                'total': users.total,
+                'pages': users.pages
+            }
         
         result = []
         for user in users.items:
@@ -51,12 +70,7 @@ class UserController:
         
         return success_response({
             'users': result,
-            'pagination': {
-                'page': users.page,
-                'per_page': users.per_page,
-                'total': users.total,
-                'pages': users.pages
-            }
+            'pagination': pagination
         })
     
     @staticmethod
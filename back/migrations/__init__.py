@@ -1 +1,57 @@
-# Migrations package
\ No newline at end of file
+# Migrations package
+"""Migraciones incrementales del esquema.
+
+``db.create_all()`` solo crea las tablas que no existen, por lo que las
+columnas e índices añadidos a tablas existentes se aplican aquí.  Cada
+migración es un módulo con una función ``upgrade(connection)`` que debe
+ser idempotente, ya que se ejecutan todas en cada arranque.
+"""
+
+import importlib
+
+from sqlalchemy import inspect, text
+
+MIGRATIONS = [
+    'm0001_router_api_transport',
+    'm0002_secret_mikrotik_id',
+    'm0003_sync_log_counters',
+    'm0004_sync_log_job_id',
+    'm0005_router_sync_state_sessions',
+    'm0006_router_sync_state_listener',
+    'm0007_router_secrets_keyset_indexes',
+    'm0008_secret_search',
+    'm0009_native_ip_columns',
+    'm0010_router_sync_state_firewall',
+]
+
+
+def column_exists(connection, table, column):
+    """Indica si ``table`` ya tiene la columna ``column``"""
+    columns = inspect(connection).get_columns(table)
+    return any(c['name'] == column for c in columns)
+
+
+def add_column(connection, table, column, ddl):
+    """Agrega una columna si todavía no existe"""
+    if not column_exists(connection, table, column):
+        connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+
+
+def index_exists(connection, table, name):
+    """Indica si ``table`` ya tiene el índice ``name``"""
+    indexes = inspect(connection).get_indexes(table)
+    return any(index['name'] == name for index in indexes)
+
+
+def create_index(connection, table, name, columns):
+    """Crea un índice si todavía no existe"""
+    if not index_exists(connection, table, name):
+        connection.execute(text(f'CREATE INDEX {name} ON {table} ({", ".join(columns)})'))
+
+
+def run_migrations(engine):
+    """Aplica todas las migraciones en orden dentro de una transacción"""
+    with engine.begin() as connection:
+        for name in MIGRATIONS:
+            module = importlib.import_module(f'migrations.{name}')
+            module.upgrade(connection)
@@ -0,0 +1,7 @@
+"""Transporte de comunicación por router (REST o API binaria)"""
+
+from migrations import add_column
+
+
+def upgrade(connection):
+    add_column(connection, 'routers', 'api_transport', "VARCHAR(20) NOT NULL DEFAULT 'rest'")
@@ -0,0 +1,7 @@
+"""Identificador '.id' de RouterOS en los secrets sincronizados"""
+
+from migrations import add_column
+
+
+def upgrade(connection):
+    add_column(connection, 'router_secrets', 'mikrotik_id', 'VARCHAR(50)')
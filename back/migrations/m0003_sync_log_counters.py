@@ -0,0 +1,8 @@
+"""Contadores de inserciones, actualizaciones y eliminaciones por sincronización"""
+
+from migrations import add_column
+
+
+def upgrade(connection):
+    for column in ('records_inserted', 'records_updated', 'records_deleted'):
+        add_column(connection, 'sync_logs', column, 'INTEGER DEFAULT 0')
@@ -0,0 +1,8 @@
+"""Trabajo en segundo plano al que pertenece cada log de sincronización"""
+
+from migrations import add_column, create_index
+
+
+def upgrade(connection):
+    add_column(connection, 'sync_logs', 'job_id', 'VARCHAR(36)')
+    create_index(connection, 'sync_logs', 'ix_sync_logs_job_id', ['job_id'])
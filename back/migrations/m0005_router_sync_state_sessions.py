@@ -0,0 +1,9 @@
+"""Estado de la captura de sesiones PPPoE por router"""
+
+from migrations import add_column
+
+
+def upgrade(connection):
+    add_column(connection, 'router_sync_state', 'sessions_claimed_at', 'TIMESTAMP')
+    add_column(connection, 'router_sync_state', 'sessions_collected_at', 'TIMESTAMP')
+    add_column(connection, 'router_sync_state', 'sessions_error', 'TEXT')
@@ -0,0 +1,8 @@
+"""Proceso dueño del listener de sesiones de cada router"""
+
+from migrations import add_column
+
+
+def upgrade(connection):
+    add_column(connection, 'router_sync_state', 'listener_owner', 'VARCHAR(100)')
+    add_column(connection, 'router_sync_state', 'listener_heartbeat_at', 'TIMESTAMP')
@@ -0,0 +1,8 @@
+"""Índices para paginar los clientes PPPoE por cursor"""
+
+from migrations import create_index
+
+
+def upgrade(connection):
+    create_index(connection, 'router_secrets', 'ix_router_secrets_name_id', ['name', 'id'])
+    create_index(connection, 'router_secrets', 'ix_router_secrets_router_id_id', ['router_id', 'id'])
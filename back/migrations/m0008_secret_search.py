@@ -0,0 +1,40 @@
+"""Búsqueda indexada de clientes PPPoE.
+
+En PostgreSQL se agrega ``router_secrets.search_text`` (columna generada
+con los campos buscables en minúsculas) con un índice GIN de trigramas
+(``pg_trgm``).  En otros motores, o si no se puede crear la extensión,
+la búsqueda usa el índice n-gram en memoria de ``ClientSearchService``.
+"""
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from migrations import add_column
+
+SEARCH_TEXT = (
+    "lower(coalesce(name::text, '') || ' ' || coalesce(contract::text, '') || ' ' "
+    "|| coalesce(comment::text, '') || ' ' || coalesce(ip_address::text, ''))"
+)
+
+
+def upgrade(connection):
+    add_column(connection, 'router_sync_state', 'secrets_changed_at', 'TIMESTAMP')
+    if connection.dialect.name != 'postgresql':
+        return
+
+    try:
+        with connection.begin_nested():
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    except DBAPIError:
+        return
+
+    add_column(connection, 'router_secrets', 'search_text',
+               f'TEXT GENERATED ALWAYS AS ({SEARCH_TEXT}) STORED')
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_router_secrets_search_trgm '
+        'ON router_secrets USING gin (search_text gin_trgm_ops)'
+    ))
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_router_secrets_name_prefix '
+        'ON router_secrets (lower(name) text_pattern_ops)'
+    ))
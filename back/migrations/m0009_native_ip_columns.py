@@ -0,0 +1,77 @@
+"""Direcciones IP nativas para filtrar clientes y reglas por CIDR o rango.
+
+Agrega ``router_secrets.ip_value`` y ``router_firewall.ip_start`` /
+``ip_end`` (``INET`` en PostgreSQL, entero en otros motores, ver
+``IPv4Type``), las completa a partir de ``ip_address`` y crea los índices
+que usan los filtros ``BETWEEN``.  Las filas cuyo ``ip_address`` no es
+IPv4 quedan en nulo.
+
+El índice de cada tabla se crea después de completarla, en la misma
+transacción, y marca el relleno como hecho: en los arranques siguientes
+la tabla no se vuelve a recorrer (la aplicación ya guarda las columnas
+nativas al escribir).
+"""
+
+from sqlalchemy import bindparam, column, select, table, tuple_
+
+from migrations import add_column, create_index, index_exists
+from models.types import IPv4Type
+from utils.ip_range import address_range, parse_ipv4
+
+BATCH_SIZE = 5000
+
+
+def _ddl(connection):
+    return 'INET' if connection.dialect.name == 'postgresql' else 'BIGINT'
+
+
+def _backfill(connection, name, keys, targets, convert):
+    """Completa ``targets`` con ``convert(ip_address)`` en las filas que aún no los tienen.
+
+    Recorre la tabla por clave en lotes de ``BATCH_SIZE`` filas, así nunca
+    carga todas las pendientes a la vez y las que no son IPv4 (que siguen
+    en nulo) no se vuelven a leer.
+    """
+    rows = table(name, *(column(key) for key in keys), column('ip_address'),
+                 *(column(target, IPv4Type()) for target in targets))
+    key_columns = [rows.c[key] for key in keys]
+    pending = select(*key_columns, rows.c.ip_address).where(
+        rows.c[targets[0]].is_(None), rows.c.ip_address != ''
+    ).order_by(*key_columns).limit(BATCH_SIZE)
+    update = rows.update().where(
+        *(rows.c[key] == bindparam(f'_{key}') for key in keys)
+    ).values({target: bindparam(target) for target in targets})
+
+    last = None
+    while True:
+        query = pending if last is None else pending.where(tuple_(*key_columns) > tuple_(*last))
+        batch = connection.execute(query).all()
+        if not batch:
+            break
+        last = tuple(batch[-1]._mapping[key] for key in keys)
+
+        params = []
+        for row in batch:
+            values = convert(row.ip_address)
+            if values[0] is not None:
+                params.append({**{f'_{key}': row._mapping[key] for key in keys},
+                               **dict(zip(targets, values))})
+        if params:
+            connection.execute(update, params)
+
+
+def upgrade(connection):
+    ddl = _ddl(connection)
+    add_column(connection, 'router_secrets', 'ip_value', ddl)
+    add_column(connection, 'router_firewall', 'ip_start', ddl)
+    add_column(connection, 'router_firewall', 'ip_end', ddl)
+
+    if not index_exists(connection, 'router_secrets', 'ix_router_secrets_ip_value'):
+        _backfill(connection, 'router_secrets', ['id'], ['ip_value'],
+                  lambda value: (parse_ipv4(value),))
+        create_index(connection, 'router_secrets', 'ix_router_secrets_ip_value', ['ip_value'])
+
+    if not index_exists(connection, 'router_firewall', 'ix_router_firewall_ip_range'):
+        _backfill(connection, 'router_firewall', ['router_id', 'firewall_id'], ['ip_start', 'ip_end'],
+                  address_range)
+        create_index(connection, 'router_firewall', 'ix_router_firewall_ip_range', ['ip_start', 'ip_end'])
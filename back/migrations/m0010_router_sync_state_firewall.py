@@ -0,0 +1,7 @@
+"""Último refresco en segundo plano de las reglas de firewall de cada router"""
+
+from migrations import add_column
+
+
+def upgrade(connection):
+    add_column(connection, 'router_sync_state', 'firewall_claimed_at', 'TIMESTAMP')
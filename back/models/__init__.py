@@ -4,4 +4,6 @@ db = SQLAlchemy()
 
 # Importar todos los modelos para que SQLAlchemy los registre
 from .user import User, UserRouter, AuthLog, SecurityEvent
-from .router import Router, Branch, Secret, RouterFirewall, RouterSecretConfig, ActivityLog
+from .router import Router, Branch, Secret, RouterFirewall, RouterSecretConfig, ActivityLog, RouterSyncState
+from .pppoe_session import ActiveSession, SessionEvent
+from .ip_pool import IpPool
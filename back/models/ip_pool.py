@@ -0,0 +1,54 @@
+from models import db
+from .base import BaseModel
+from .types import IPv4Type
+
+
+class IpPool(BaseModel):
+    """Pool de direcciones para asignar a los clientes PPPoE.
+
+    Un pool pertenece a un router, a un perfil o a ambos.  Las direcciones
+    ocupadas se guardan en ``bitmap`` (un bit por dirección, desde
+    ``first_address``); ``next_index`` es la posición desde la que se
+    busca la siguiente libre y ``version`` permite actualizar el bitmap
+    con un ``UPDATE`` condicional sin bloquear la fila.
+    """
+    __tablename__ = 'ip_pools'
+    __table_args__ = (
+        db.Index('ix_ip_pools_scope', 'router_id', 'profile'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    router_id = db.Column(db.Integer, db.ForeignKey('routers.id'), nullable=True)  # nulo: todos los routers
+    profile = db.Column(db.String(255), nullable=True)  # nulo: todos los perfiles
+    first_address = db.Column(IPv4Type, nullable=False)
+    last_address = db.Column(IPv4Type, nullable=False)
+    bitmap = db.Column(db.LargeBinary, nullable=False)
+    allocated = db.Column(db.Integer, nullable=False, default=0)
+    next_index = db.Column(db.Integer, nullable=False, default=0)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    is_active = db.Column(db.Boolean, default=True)
+
+    # Relaciones
+    router = db.relationship('Router')
+
+    @property
+    def size(self):
+        return int(self.last_address) - int(self.first_address) + 1
+
+    def to_dict(self):
+        """Convierte a diccionario"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'router_id': self.router_id,
+            'profile': self.profile,
+            'first_address': str(self.first_address),
+            'last_address': str(self.last_address),
+            'size': self.size,
+            'allocated': self.allocated,
+            'free': self.size - self.allocated,
+            'is_active': self.is_active,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
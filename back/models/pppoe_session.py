@@ -0,0 +1,81 @@
+from datetime import datetime
+from models import db
+
+
+class ActiveSession(db.Model):
+    """Última captura de las sesiones PPPoE activas de cada router.
+
+    La llena ``SessionCollectorService`` en segundo plano; los endpoints
+    leen de aquí en lugar de consultar los routers en cada petición.
+    """
+    __tablename__ = 'pppoe_active_sessions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    router_id = db.Column(db.Integer, db.ForeignKey('routers.id'), nullable=False, index=True)
+    mikrotik_id = db.Column(db.String(50), nullable=True)  # '.id' de la sesión en RouterOS
+    name = db.Column(db.String(100), nullable=False, index=True)
+    address = db.Column(db.String(45), nullable=True)
+    uptime = db.Column(db.String(50), nullable=True)
+    caller_id = db.Column(db.String(100), nullable=True)
+    called_id = db.Column(db.String(100), nullable=True)
+    rx_bytes = db.Column(db.BigInteger, default=0)
+    tx_bytes = db.Column(db.BigInteger, default=0)
+    rx_packets = db.Column(db.BigInteger, default=0)
+    tx_packets = db.Column(db.BigInteger, default=0)
+    interface_found = db.Column(db.Boolean, default=False)
+    collected_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_session_dict(self, router_name=None):
+        """Formato que consume la página de sesiones"""
+        return {
+            'id': self.mikrotik_id,
+            'clientName': self.name,
+            'clientId': None,
+            'address': self.address or '',
+            'uptime': self.uptime or '',
+            'rxBytes': self.rx_bytes or 0,
+            'txBytes': self.tx_bytes or 0,
+            'rxPackets': self.rx_packets or 0,
+            'txPackets': self.tx_packets or 0,
+            'routerId': str(self.router_id),
+            'routerName': router_name,
+            'callingStationId': self.caller_id,
+            'calledStationId': self.called_id,
+            'interfaceFound': self.interface_found,
+        }
+
+
+class SessionEvent(db.Model):
+    """Historial de conexiones y desconexiones PPPoE"""
+    __tablename__ = 'pppoe_session_events'
+    __table_args__ = (
+        db.Index('ix_pppoe_session_events_client', 'router_id', 'name', 'occurred_at'),
+    )
+
+    CONNECT = 'connect'
+    DISCONNECT = 'disconnect'
+
+    id = db.Column(db.Integer, primary_key=True)
+    router_id = db.Column(db.Integer, db.ForeignKey('routers.id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    event = db.Column(db.String(20), nullable=False)  # connect, disconnect
+    mikrotik_id = db.Column(db.String(50), nullable=True)  # '.id' de la sesión en RouterOS
+    address = db.Column(db.String(45), nullable=True)
+    caller_id = db.Column(db.String(100), nullable=True)
+    uptime = db.Column(db.String(50), nullable=True)  # duración de la sesión al desconectarse
+    source = db.Column(db.String(20), nullable=False)  # listener, poll
+    occurred_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def to_dict(self):
+        """Convierte a diccionario"""
+        return {
+            'id': self.id,
+            'router_id': self.router_id,
+            'name': self.name,
+            'event': self.event,
+            'address': self.address,
+            'caller_id': self.caller_id,
+            'uptime': self.uptime,
+            'source': self.source,
+            'occurred_at': self.occurred_at.isoformat() if self.occurred_at else None
+        }
@@ -1,6 +1,12 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from itertools import chain
+from sqlalchemy import event, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, validates
 from models import db
+from utils.ip_range import address_range, parse_ipv4
 from .base import BaseModel
+from .types import IPv4Type
 
 
 class Branch(BaseModel):
@@ -19,6 +25,9 @@ class Branch(BaseModel):
 class Router(BaseModel):
     """Modelo Router basado en tabla 'routers'"""
     __tablename__ = 'routers'
+
+    # rest: API REST (HTTPS), api: API binaria (8728), api-ssl: API binaria con TLS (8729)
+    TRANSPORTS = ('rest', 'api', 'api-ssl')
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -27,6 +36,7 @@ class Router(BaseModel):
     password = db.Column(db.String(255), nullable=False)
     branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=False)
     is_active = db.Column(db.Boolean, default=True)
+    api_transport = db.Column(db.String(20), nullable=False, default='rest', server_default='rest')
     
     # Relaciones
     branch = db.relationship('Branch', back_populates='routers')
@@ -37,13 +47,119 @@ class Router(BaseModel):
     activity_logs = db.relationship('ActivityLog', back_populates='router', lazy='dynamic')
 
 
+class RouterSyncState(db.Model):
+    """Frescura de los datos sincronizados de cada router.
+
+    Se guarda aparte de ``routers`` para no modificar ``updated_at`` del
+    router en cada sincronización.
+    """
+    __tablename__ = 'router_sync_state'
+
+    router_id = db.Column(db.Integer, db.ForeignKey('routers.id'), primary_key=True)
+    last_synced_at = db.Column(db.DateTime, nullable=True)  # última sincronización exitosa
+    refresh_claimed_at = db.Column(db.DateTime, nullable=True)  # último refresco en segundo plano lanzado
+    firewall_claimed_at = db.Column(db.DateTime, nullable=True)  # último refresco de reglas de firewall lanzado
+    sessions_claimed_at = db.Column(db.DateTime, nullable=True)  # última captura de sesiones reclamada
+    sessions_collected_at = db.Column(db.DateTime, nullable=True)  # última captura de sesiones exitosa
+    sessions_error = db.Column(db.Text, nullable=True)  # error de la última captura de sesiones
+    listener_owner = db.Column(db.String(100), nullable=True)  # proceso que escucha /ppp/active
+    listener_heartbeat_at = db.Column(db.DateTime, nullable=True)  # último latido de ese proceso
+    secrets_changed_at = db.Column(db.DateTime, nullable=True)  # último cambio de sus secrets en la DB
+
+    @staticmethod
+    def ensure(router_ids):
+        """Crea las filas que falten sin fallar si otro proceso las crea a la vez"""
+        existing = {
+            row.router_id for row in
+            RouterSyncState.query.filter(RouterSyncState.router_id.in_(router_ids)).all()
+        }
+        for router_id in set(router_ids) - existing:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(RouterSyncState(router_id=router_id))
+            except IntegrityError:
+                pass
+
+    @staticmethod
+    def claim(router_ids, column, window, *conditions, values=None):
+        """Reclama los routers cuyo ``column`` es nulo o más antiguo que ``window`` segundos.
+
+        Cada reclamo es un ``UPDATE`` condicional: aunque varios procesos
+        lo intenten a la vez, solo uno gana cada router por ventana.
+        ``conditions`` restringe además qué filas pueden reclamarse y
+        ``values`` agrega columnas a escribir junto con el reclamo.
+        Confirma la transacción y devuelve los ids reclamados.
+        """
+        if not router_ids:
+            return []
+
+        now = datetime.utcnow()
+        claimed_at = getattr(RouterSyncState, column)
+        conditions = (
+            or_(claimed_at.is_(None), claimed_at < now - timedelta(seconds=window)),
+        ) + conditions
+
+        RouterSyncState.ensure(router_ids)
+        # Lectura previa: en el caso habitual no hay nada que reclamar
+        candidates = [
+            row.router_id for row in
+            db.session.query(RouterSyncState.router_id)
+            .filter(RouterSyncState.router_id.in_(router_ids), *conditions)
+            .all()
+        ]
+
+        claimed = []
+        for router_id in candidates:
+            result = db.session.execute(
+                db.update(RouterSyncState)
+                .where(RouterSyncState.router_id == router_id, *conditions)
+                .values({column: now, **(values or {})})
+            )
+            if result.rowcount:
+                claimed.append(router_id)
+        db.session.commit()
+        return claimed
+
+    @staticmethod
+    def touch_secrets(connection, router_ids, when=None):
+        """Marca ``secrets_changed_at`` de los routers usando ``connection``.
+
+        Se usa desde eventos de flush, donde no se puede usar la sesión;
+        las filas que falten se crean dentro de un savepoint.
+        """
+        table = RouterSyncState.__table__
+        when = when or datetime.utcnow()
+        for router_id in router_ids:
+            result = connection.execute(
+                table.update().where(table.c.router_id == router_id).values(secrets_changed_at=when)
+            )
+            if result.rowcount:
+                continue
+            try:
+                with connection.begin_nested():
+                    connection.execute(table.insert().values(router_id=router_id, secrets_changed_at=when))
+            except IntegrityError:
+                connection.execute(
+                    table.update().where(table.c.router_id == router_id).values(secrets_changed_at=when)
+                )
+
+
 class Secret(db.Model):
     """Modelo RouterSecret basado en tabla 'router_secrets'"""
     __tablename__ = 'router_secrets'
+    __table_args__ = (
+        # Paginación por cursor (ORDER BY name, id / filtro por router)
+        db.Index('ix_router_secrets_name_id', 'name', 'id'),
+        db.Index('ix_router_secrets_router_id_id', 'router_id', 'id'),
+        # Filtros por CIDR o rango de IPs
+        db.Index('ix_router_secrets_ip_value', 'ip_value'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     router_id = db.Column(db.Integer, db.ForeignKey('routers.id'), nullable=False)
+    mikrotik_id = db.Column(db.String(50), nullable=True)  # '.id' del secret en RouterOS
     ip_address = db.Column(db.String(20), nullable=False)
+    ip_value = db.Column(IPv4Type, nullable=True)  # ip_address como IP nativa (nula si no es IPv4)
     name = db.Column(db.String(100), nullable=False)
     password = db.Column(db.String(255), nullable=False)
     comment = db.Column(db.String(255), nullable=True)
@@ -55,14 +171,43 @@ class Secret(db.Model):
     # Relaciones
     router = db.relationship('Router', back_populates='secrets')
 
+    @validates('ip_address')
+    def _set_ip_value(self, key, value):
+        self.ip_value = parse_ipv4(value)
+        return value
+
+
+@event.listens_for(Session, 'after_flush')
+def _stamp_secret_changes(session, flush_context):
+    """Marca los routers cuyos secrets se modificaron a través del ORM.
+
+    Los índices de búsqueda en memoria (``ClientSearchService``) recargan
+    los routers con ``secrets_changed_at`` nuevo.  Las escrituras masivas
+    de la sincronización lo marcan explícitamente.
+    """
+    router_ids = {
+        obj.router_id for obj in chain(session.new, session.dirty, session.deleted)
+        if isinstance(obj, Secret) and obj.router_id is not None
+        and (obj not in session.dirty or session.is_modified(obj))
+    }
+    if router_ids:
+        RouterSyncState.touch_secrets(session.connection(), sorted(router_ids))
+        session.info.setdefault('secrets_changed', set()).update(router_ids)
+
 
 class RouterFirewall(db.Model):
     """Modelo RouterFirewall basado en tabla 'router_firewall'"""
     __tablename__ = 'router_firewall'
+    __table_args__ = (
+        # Reglas que contienen una IP o que caen dentro de un CIDR
+        db.Index('ix_router_firewall_ip_range', 'ip_start', 'ip_end'),
+    )
 
     router_id = db.Column(db.Integer, db.ForeignKey('routers.id'), primary_key=True)
-    firewall_id = db.Column(db.String(50), primary_key=True)
+    firewall_id = db.Column(db.String(50), primary_key=True)  # '.id' de la regla en RouterOS
     ip_address = db.Column(db.String(20), nullable=False)
+    ip_start = db.Column(IPv4Type, nullable=True)  # primera IP de ip_address (IP, CIDR o rango)
+    ip_end = db.Column(IPv4Type, nullable=True)  # última IP de ip_address
     comment = db.Column(db.String(255), nullable=True)
     creation_date = db.Column(db.String(100), nullable=True)
     protocol = db.Column(db.String(20), nullable=True)
@@ -75,6 +220,11 @@ class RouterFirewall(db.Model):
     # Relaciones
     router = db.relationship('Router', back_populates='firewall_rules')
 
+    @validates('ip_address')
+    def _set_ip_range(self, key, value):
+        self.ip_start, self.ip_end = address_range(value)
+        return value
+
 
 class RouterSecretConfig(db.Model):
     """Modelo RouterSecretConfig basado en tabla 'router_secret_configs'"""
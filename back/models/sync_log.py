@@ -6,10 +6,14 @@ class SyncLog(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     router_id = db.Column(db.Integer, db.ForeignKey('routers.id'), nullable=True)
+    job_id = db.Column(db.String(36), nullable=True, index=True)  # trabajo en segundo plano
     sync_type = db.Column(db.String(50), nullable=False)  # manual, automatic, scheduled
     status = db.Column(db.String(20), nullable=False)  # success, error, partial
     message = db.Column(db.Text, nullable=True)
     records_synced = db.Column(db.Integer, default=0)
+    records_inserted = db.Column(db.Integer, default=0)
+    records_updated = db.Column(db.Integer, default=0)
+    records_deleted = db.Column(db.Integer, default=0)
     duration_seconds = db.Column(db.Float, nullable=True)
     started_at = db.Column(db.DateTime, default=db.func.current_timestamp())
     completed_at = db.Column(db.DateTime, nullable=True)
@@ -19,10 +23,14 @@ class SyncLog(db.Model):
         return {
             'id': self.id,
             'router_id': self.router_id,
+            'job_id': self.job_id,
             'sync_type': self.sync_type,
             'status': self.status,
             'message': self.message,
             'records_synced': self.records_synced,
+            'records_inserted': self.records_inserted,
+            'records_updated': self.records_updated,
+            'records_deleted': self.records_deleted,
             'duration_seconds': self.duration_seconds,
             'started_at': self.started_at.isoformat() if self.started_at else None,
             'completed_at': self.completed_at.isoformat() if self.completed_at else None
@@ -0,0 +1,33 @@
+import ipaddress
+
+from sqlalchemy.dialects.postgresql import INET
+from sqlalchemy.types import BigInteger, TypeDecorator
+
+
+class IPv4Type(TypeDecorator):
+    """Dirección IPv4 nativa: ``INET`` en PostgreSQL y entero en otros motores.
+
+    En ambos casos el orden es numérico, por lo que un filtro CIDR o
+    desde-hasta es un ``BETWEEN`` que recorre un índice B-tree.  Acepta
+    ``str``, ``int`` o ``IPv4Address`` y devuelve ``IPv4Address``.
+    """
+    impl = BigInteger
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(INET())
+        return dialect.type_descriptor(BigInteger())
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        address = ipaddress.IPv4Address(value)
+        return str(address) if dialect.name == 'postgresql' else int(address)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            value = value.split('/')[0]
+        return ipaddress.IPv4Address(value)
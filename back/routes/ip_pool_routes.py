@@ -0,0 +1,62 @@
+from flask import Blueprint
+from controllers.ip_pool_controller import IpPoolController
+from middleware.auth_middleware import require_auth
+from utils.decorators import handle_errors
+
+ip_pool_bp = Blueprint('ip_pools', __name__, url_prefix='/api/ip-pools')
+
+@ip_pool_bp.route('', methods=['GET'])
+@require_auth
+@handle_errors
+def get_pools():
+    """GET /api/ip-pools - Lista de pools"""
+    return IpPoolController.get_pools()
+
+@ip_pool_bp.route('', methods=['POST'])
+@require_auth
+@handle_errors
+def create_pool():
+    """POST /api/ip-pools - Crear pool"""
+    return IpPoolController.create_pool()
+
+@ip_pool_bp.route('/conflicts', methods=['GET'])
+@require_auth
+@handle_errors
+def get_conflicts():
+    """GET /api/ip-pools/conflicts - Conflictos de direcciones"""
+    return IpPoolController.get_conflicts()
+
+@ip_pool_bp.route('/<int:pool_id>', methods=['GET'])
+@require_auth
+@handle_errors
+def get_pool(pool_id):
+    """GET /api/ip-pools/{id} - Obtener pool"""
+    return IpPoolController.get_pool(pool_id)
+
+@ip_pool_bp.route('/<int:pool_id>', methods=['DELETE'])
+@require_auth
+@handle_errors
+def delete_pool(pool_id):
+    """DELETE /api/ip-pools/{id} - Eliminar pool"""
+    return IpPoolController.delete_pool(pool_id)
+
+@ip_pool_bp.route('/<int:pool_id>/allocate', methods=['POST'])
+@require_auth
+@handle_errors
+def allocate(pool_id):
+    """POST /api/ip-pools/{id}/allocate - Reservar siguiente IP libre"""
+    return IpPoolController.allocate(pool_id)
+
+@ip_pool_bp.route('/<int:pool_id>/release', methods=['POST'])
+@require_auth
+@handle_errors
+def release(pool_id):
+    """POST /api/ip-pools/{id}/release - Liberar IP"""
+    return IpPoolController.release(pool_id)
+
+@ip_pool_bp.route('/<int:pool_id>/rebuild', methods=['POST'])
+@require_auth
+@handle_errors
+def rebuild(pool_id):
+    """POST /api/ip-pools/{id}/rebuild - Recalcular ocupación"""
+    return IpPoolController.rebuild(pool_id)
@@ -35,6 +35,13 @@ def search_clients():
     """GET /api/pppoe/clients/search?q={query} - Buscar clientes por nombre"""
     return PPPoEController.search_clients()
 
+@pppoe_bp.route('/clients/search/stats', methods=['GET'])
+@require_auth
+@handle_errors
+def get_search_stats():
+    """GET /api/pppoe/clients/search/stats - Estado del índice de búsqueda"""
+    return PPPoEController.get_search_stats()
+
 @pppoe_bp.route('/clients/<int:client_id>', methods=['GET'])
 @require_auth
 @handle_errors
@@ -112,6 +119,13 @@ def get_active_sessions():
     """GET /api/pppoe/sessions/active - Sesiones PPPoE activas"""
     return PPPoEController.get_active_sessions()
 
+@pppoe_bp.route('/sessions/stream', methods=['GET'])
+@require_auth
+@handle_errors
+def stream_active_sessions():
+    """GET /api/pppoe/sessions/stream - Sesiones PPPoE activas en vivo (SSE)"""
+    return PPPoEController.stream_active_sessions()
+
 @pppoe_bp.route('/test', methods=['GET'])
 def test_endpoint():
     """Endpoint de prueba sin autenticación"""
@@ -67,4 +67,11 @@ def get_interfaces(router_id: int):
 @handle_errors
 def get_resources(router_id: int):
     """GET /api/routers/{id}/resources - Get router resources"""
-    return RouterController.get_resources(router_id)
\ No newline at end of file
+    return RouterController.get_resources(router_id)
+
+@router_bp.route('/cache/stats', methods=['GET'])
+@require_auth
+@handle_errors
+def get_cache_stats():
+    """GET /api/routers/cache/stats - Router read cache counters"""
+    return RouterController.get_cache_stats()
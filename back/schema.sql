@@ -1,3 +1,5 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 CREATE TABLE users (
     id SERIAL PRIMARY KEY,
     username VARCHAR(80) NOT NULL UNIQUE,
@@ -41,16 +43,67 @@ CREATE TABLE routers (
     password VARCHAR(255) NOT NULL,
     branch_id INT NOT NULL,
     is_active BOOLEAN DEFAULT TRUE,
+    api_transport VARCHAR(20) NOT NULL DEFAULT 'rest',  -- rest, api, api-ssl
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     CONSTRAINT fk_routers_branches 
         FOREIGN KEY (branch_id) REFERENCES branches(id)
 );
 
+CREATE TABLE router_sync_state (
+    router_id INT PRIMARY KEY,
+    last_synced_at TIMESTAMP,      -- última sincronización exitosa
+    refresh_claimed_at TIMESTAMP,  -- último refresco en segundo plano lanzado
+    sessions_claimed_at TIMESTAMP,    -- última captura de sesiones reclamada
+    sessions_collected_at TIMESTAMP,  -- última captura de sesiones exitosa
+    sessions_error TEXT,              -- error de la última captura de sesiones
+    listener_owner VARCHAR(100),      -- proceso que escucha /ppp/active
+    listener_heartbeat_at TIMESTAMP,  -- último latido de ese proceso
+    secrets_changed_at TIMESTAMP,     -- último cambio de sus secrets en la DB
+    CONSTRAINT fk_router_sync_state_routers
+        FOREIGN KEY (router_id) REFERENCES routers(id)
+);
+
+CREATE TABLE pppoe_active_sessions (
+    id SERIAL PRIMARY KEY,
+    router_id INT NOT NULL,
+    mikrotik_id VARCHAR(50),  -- '.id' de la sesión en RouterOS
+    name VARCHAR(100) NOT NULL,
+    address VARCHAR(45),
+    uptime VARCHAR(50),
+    caller_id VARCHAR(100),
+    called_id VARCHAR(100),
+    rx_bytes BIGINT DEFAULT 0,
+    tx_bytes BIGINT DEFAULT 0,
+    rx_packets BIGINT DEFAULT 0,
+    tx_packets BIGINT DEFAULT 0,
+    interface_found BOOLEAN DEFAULT FALSE,
+    collected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT fk_pppoe_active_sessions_routers
+        FOREIGN KEY (router_id) REFERENCES routers(id)
+);
+
+CREATE TABLE pppoe_session_events (
+    id SERIAL PRIMARY KEY,
+    router_id INT NOT NULL,
+    name VARCHAR(100) NOT NULL,
+    event VARCHAR(20) NOT NULL,  -- connect, disconnect
+    mikrotik_id VARCHAR(50),     -- '.id' de la sesión en RouterOS
+    address VARCHAR(45),
+    caller_id VARCHAR(100),
+    uptime VARCHAR(50),          -- duración de la sesión al desconectarse
+    source VARCHAR(20) NOT NULL, -- listener, poll
+    occurred_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT fk_pppoe_session_events_routers
+        FOREIGN KEY (router_id) REFERENCES routers(id)
+);
+
 CREATE TABLE router_secrets (
     id SERIAL PRIMARY KEY,
     router_id INT NOT NULL,
+    mikrotik_id VARCHAR(50),  -- '.id' del secret en RouterOS
     ip_address VARCHAR(20) NOT NULL,
+    ip_value INET,  -- ip_address como IP nativa (nula si no es IPv4)
     name VARCHAR(100) NOT NULL,
     password VARCHAR(255) NOT NULL,
     comment VARCHAR(255),
@@ -58,6 +111,11 @@ CREATE TABLE router_secrets (
     contract VARCHAR(100),
     is_active BOOLEAN DEFAULT TRUE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Campos buscables en minúsculas (índice de trigramas)
+    search_text TEXT GENERATED ALWAYS AS (
+        lower(coalesce(name::text, '') || ' ' || coalesce(contract::text, '') || ' '
+              || coalesce(comment::text, '') || ' ' || coalesce(ip_address::text, ''))
+    ) STORED,
     CONSTRAINT fk_router_secrets_routers 
         FOREIGN KEY (router_id) REFERENCES routers(id)
 );
@@ -66,6 +124,8 @@ CREATE TABLE router_firewall (
     router_id INT NOT NULL,
     firewall_id VARCHAR(50) NOT NULL,
     ip_address VARCHAR(20) NOT NULL,
+    ip_start INET,  -- primera IP de ip_address (IP, CIDR o rango)
+    ip_end INET,  -- última IP de ip_address
     comment VARCHAR(255),
     creation_date VARCHAR(100),
     protocol VARCHAR(20),
@@ -79,6 +139,24 @@ CREATE TABLE router_firewall (
         FOREIGN KEY (router_id) REFERENCES routers(id)
 );
 
+CREATE TABLE ip_pools (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    router_id INT,            -- nulo: todos los routers
+    profile VARCHAR(255),     -- nulo: todos los perfiles
+    first_address INET NOT NULL,
+    last_address INET NOT NULL,
+    bitmap BYTEA NOT NULL,    -- un bit por dirección ocupada
+    allocated INT NOT NULL DEFAULT 0,
+    next_index INT NOT NULL DEFAULT 0,
+    version INT NOT NULL DEFAULT 0,
+    is_active BOOLEAN DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT fk_ip_pools_routers
+        FOREIGN KEY (router_id) REFERENCES routers(id)
+);
+
 CREATE TABLE router_secret_configs (
     router_id INT NOT NULL,
     secret_id VARCHAR(50) NOT NULL,
@@ -176,11 +254,21 @@ CREATE INDEX idx_routers_branch ON routers(branch_id);
 CREATE INDEX idx_routers_is_active ON routers(is_active);
 CREATE INDEX idx_router_secrets_router ON router_secrets(router_id);
 CREATE INDEX idx_router_secrets_ip ON router_secrets(ip_address);
+CREATE INDEX ix_router_secrets_name_id ON router_secrets(name, id);
+CREATE INDEX ix_router_secrets_router_id_id ON router_secrets(router_id, id);
+CREATE INDEX ix_router_secrets_search_trgm ON router_secrets USING gin (search_text gin_trgm_ops);
+CREATE INDEX ix_router_secrets_name_prefix ON router_secrets (lower(name) text_pattern_ops);
+CREATE INDEX ix_router_secrets_ip_value ON router_secrets(ip_value);
+CREATE INDEX ix_router_firewall_ip_range ON router_firewall(ip_start, ip_end);
 CREATE INDEX idx_user_routers_user ON user_routers(user_id);
 CREATE INDEX idx_user_routers_router ON user_routers(router_id);
 CREATE INDEX idx_activity_logs_router ON activity_logs(router_id);
 CREATE INDEX idx_activity_logs_user ON activity_logs(user_id);
 CREATE INDEX idx_activity_logs_created_at ON activity_logs(created_at);
+CREATE INDEX idx_pppoe_active_sessions_router ON pppoe_active_sessions(router_id);
+CREATE INDEX idx_pppoe_active_sessions_name ON pppoe_active_sessions(name);
+CREATE INDEX ix_pppoe_session_events_client ON pppoe_session_events(router_id, name, occurred_at);
+CREATE INDEX ix_ip_pools_scope ON ip_pools(router_id, profile);
 
 -- Índices para logs de seguridad
 CREATE INDEX idx_auth_logs_timestamp ON auth_logs(timestamp);
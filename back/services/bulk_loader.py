@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import io
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import update
+
+from config.config import get_setting
+from models import db
+
+
+class BulkLoader:
+    """Write many rows at once without the ORM unit of work.
+
+    Sync payloads can hold tens of thousands of secrets; adding them one
+    by one with ``db.session.add`` spends most of the time on ORM
+    bookkeeping.  The loader writes through the current session's
+    connection, so everything stays in the caller's transaction:
+
+    * on PostgreSQL (psycopg2) inserts are streamed with ``COPY ... FROM
+      STDIN`` unless ``SYNC_USE_COPY`` is disabled;
+    * on any other engine they are sent as Core ``executemany`` batches of
+      ``SYNC_BATCH_SIZE`` rows.
+    """
+
+    @staticmethod
+    def _batch_size(batch_size: Optional[int]) -> int:
+        return max(1, batch_size or get_setting('SYNC_BATCH_SIZE', 1000))
+
+    @staticmethod
+    def _batches(rows: Sequence[Dict[str, Any]], size: int) -> Iterable[Sequence[Dict[str, Any]]]:
+        for start in range(0, len(rows), size):
+            yield rows[start:start + size]
+
+    @staticmethod
+    def _with_defaults(table, rows: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Fill Python-side column defaults (``default=...``) missing in ``rows``.
+
+        Core ``executemany`` applies them by itself, but ``COPY`` bypasses
+        SQLAlchemy entirely.
+        """
+
+        defaults = {}
+        for column in table.columns:
+            default = column.default
+            if default is None or column.primary_key:
+                continue
+            if default.is_scalar:
+                defaults[column.name] = lambda arg=default.arg: arg
+            elif default.is_callable:
+                defaults[column.name] = lambda arg=default.arg: arg(None)
+
+        filled = []
+        for row in rows:
+            row = dict(row)
+            for name, factory in defaults.items():
+                if name not in row:
+                    row[name] = factory()
+            filled.append(row)
+        return filled
+
+    @staticmethod
+    def _copy_value(value: Any) -> str:
+        """Encode a value for the ``COPY`` text format."""
+
+        if value is None:
+            return '\\N'
+        if isinstance(value, bool):
+            return 't' if value else 'f'
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        return (
+            str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r')
+        )
+
+    @staticmethod
+    def _use_copy(connection) -> bool:
+        return (
+            get_setting('SYNC_USE_COPY', True)
+            and connection.dialect.name == 'postgresql'
+            and connection.dialect.driver == 'psycopg2'
+        )
+
+    @staticmethod
+    def _copy(connection, table, rows: Sequence[Dict[str, Any]], batch_size: int) -> None:
+        columns = list(rows[0].keys())
+        statement = (
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN"
+        )
+        cursor = connection.connection.cursor()
+        try:
+            for batch in BulkLoader._batches(rows, batch_size):
+                buffer = io.StringIO()
+                for row in batch:
+                    buffer.write('\t'.join(BulkLoader._copy_value(row.get(c)) for c in columns))
+                    buffer.write('\n')
+                buffer.seek(0)
+                cursor.copy_expert(statement, buffer)
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def insert(model, rows: Sequence[Dict[str, Any]], batch_size: Optional[int] = None) -> int:
+        """Insert ``rows`` (dicts of column values) into ``model``'s table.
+
+        Every row must have the same keys.  Does not commit.
+
+        Returns
+        -------
+        int
+            Number of rows written.
+        """
+
+        if not rows:
+            return 0
+
+        table = model.__table__
+        size = BulkLoader._batch_size(batch_size)
+        connection = db.session.connection()
+
+        if BulkLoader._use_copy(connection):
+            BulkLoader._copy(connection, table, BulkLoader._with_defaults(table, rows), size)
+        else:
+            for batch in BulkLoader._batches(rows, size):
+                connection.execute(table.insert(), list(batch))
+        return len(rows)
+
+    @staticmethod
+    def update(model, rows: Sequence[Dict[str, Any]], batch_size: Optional[int] = None) -> int:
+        """Update rows by primary key; each dict holds the key plus the changed values.
+
+        Uses the ORM bulk UPDATE by primary key, which groups rows with
+        the same set of columns into one ``executemany``.  Does not commit.
+        """
+
+        if not rows:
+            return 0
+
+        size = BulkLoader._batch_size(batch_size)
+        for batch in BulkLoader._batches(rows, size):
+            db.session.execute(update(model), list(batch))
+        return len(rows)
@@ -0,0 +1,643 @@
+from __future__ import annotations
+
+import heapq
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from heapq import merge
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from flask import current_app
+from sqlalchemy import case, event, func, inspect, literal_column, or_
+from sqlalchemy.orm import Session
+
+from config.config import get_setting
+from models import db
+from models.router import RouterSyncState, Secret
+
+# Searchable fields, in the order they are joined into the search text
+SEARCH_FIELDS = ('name', 'contract', 'comment', 'ip_address')
+
+# Shorter queries are answered by word prefix instead of substring
+MIN_NGRAM = 3
+
+# Marks a word-prefix gram (``'\x02ju'``) so it never collides with a trigram
+_PREFIX = '\x02'
+
+
+def search_text(values: Iterable[Optional[str]]) -> str:
+    """Lower-cased searchable text of a client (same shape as ``search_text`` in PostgreSQL)."""
+
+    return ' '.join((value or '').lower() for value in values)
+
+
+def _grams(text: str) -> Set[str]:
+    """Trigrams of ``text`` plus the 1 and 2 character prefixes of each word."""
+
+    grams = {text[i:i + 3] for i in range(len(text) - 2)}
+    for word in text.split():
+        grams.add(_PREFIX + word[:1])
+        grams.add(_PREFIX + word[:2])
+    return grams
+
+
+def _rank(query: str, name: str, text: str) -> int:
+    """Lower is better: exact name, name prefix, word prefix, substring."""
+
+    if name == query:
+        return 0
+    if name.startswith(query):
+        return 1
+    if text.startswith(query) or f' {query}' in text:
+        return 2
+    return 3
+
+
+# Slot flags
+_ALIVE = 1
+_ACTIVE = 2
+
+# Last possible code point: ``prefix + _MAX_CHAR`` bounds a prefix range
+_MAX_CHAR = '\U0010ffff'
+
+
+class NgramIndex:
+    """Compact in-process index over the searchable fields of the clients.
+
+    Every indexed version of a client takes a *slot* in parallel arrays
+    (id, router, flags, name, text).  Posting lists map each trigram and
+    word prefix (1-2 characters) to an ``array('I')`` of slots; slots only
+    grow, so the lists stay sorted and updates are appends.  Names are
+    also kept sorted (plus a small sorted overlay of recent additions),
+    so name prefix queries, the common type-ahead case, are a binary
+    search.
+
+    Updates add a new slot and mark the old one dead.  The overlay is
+    merged when it grows past 5% of the base, and dead slots are
+    compacted away when they pass 25% of all slots, both without going
+    back to the database.  Not thread safe: callers hold
+    :attr:`ClientSearchService._lock`.
+    """
+
+    def __init__(self):
+        self._clear()
+        self.built_at: Optional[float] = None
+        self.build_seconds: Optional[float] = None
+        self._memory: Tuple[int, int] = (-1, 0)
+
+    def _clear(self) -> None:
+        self.ids = array('q')
+        self.routers = array('q')
+        self.flags = bytearray()
+        self.names: List[str] = []
+        self.texts: List[str] = []
+        self.slots: Dict[int, int] = {}
+        self.by_router: Dict[int, Set[int]] = {}
+        self.postings: Dict[str, array] = {}
+        self.sorted_names: List[str] = []
+        self.sorted_slots = array('I')
+        self.recent: List[Tuple[str, int]] = []
+        self.dead = 0
+        self.generation = 0
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    # ------------------------------------------------------------------
+    # Building and updates
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _document(values: Sequence[Optional[str]]) -> Tuple[str, str]:
+        name = (values[0] or '').lower()
+        # The sync copies the comment into the contract: index it once
+        return name, search_text(dict.fromkeys(value for value in values if value))
+
+    def _append(self, secret_id: int, router_id: int, is_active: bool, name: str, text: str) -> int:
+        slot = len(self.ids)
+        self.ids.append(secret_id)
+        self.routers.append(router_id)
+        self.flags.append(_ALIVE | (_ACTIVE if is_active else 0))
+        self.names.append(name)
+        self.texts.append(text)
+        self.slots[secret_id] = slot
+        self.by_router.setdefault(router_id, set()).add(secret_id)
+        postings = self.postings
+        for gram in _grams(text):
+            slots = postings.get(gram)
+            if slots is None:
+                slots = postings[gram] = array('I')
+            slots.append(slot)
+        self.generation += 1
+        return slot
+
+    def _sort_names(self) -> None:
+        names = self.names
+        order = sorted((slot for slot in range(len(self.ids)) if self.flags[slot] & _ALIVE),
+                       key=names.__getitem__)
+        self.sorted_names = [names[slot] for slot in order]
+        self.sorted_slots = array('I', order)
+        self.recent = []
+
+    @classmethod
+    def build(cls, rows: Iterable[tuple]) -> 'NgramIndex':
+        """Index ``rows`` of ``(id, router_id, is_active, *SEARCH_FIELDS)``."""
+
+        start = time.monotonic()
+        index = cls()
+        for row in rows:
+            name, text = cls._document(row[3:])
+            index._append(row[0], row[1], row[2], name, text)
+        index._sort_names()
+        index.built_at = time.time()
+        index.build_seconds = round(time.monotonic() - start, 3)
+        return index
+
+    def add(self, secret_id: int, router_id: int, is_active: bool, values: Sequence[Optional[str]]) -> None:
+        if secret_id in self.slots:
+            self.remove(secret_id)
+        name, text = self._document(values)
+        slot = self._append(secret_id, router_id, is_active, name, text)
+        insort(self.recent, (name, slot))
+        if len(self.recent) > max(1024, len(self.sorted_names) // 20):
+            self._merge_recent()
+
+    def remove(self, secret_id: int) -> None:
+        slot = self.slots.pop(secret_id, None)
+        if slot is None:
+            return
+        self.flags[slot] &= ~_ALIVE
+        self.by_router.get(self.routers[slot], set()).discard(secret_id)
+        self.dead += 1
+        self.generation += 1
+        if self.dead > max(1024, len(self.ids) // 4):
+            self._compact()
+
+    def _merge_recent(self) -> None:
+        flags = self.flags
+        merged = [
+            (name, slot) for name, slot in
+            merge(zip(self.sorted_names, self.sorted_slots), self.recent)
+            if flags[slot] & _ALIVE
+        ]
+        self.sorted_names = [name for name, _ in merged]
+        self.sorted_slots = array('I', (slot for _, slot in merged))
+        self.recent = []
+
+    def _compact(self) -> None:
+        """Rebuild every structure from the live slots only."""
+
+        live = [
+            (self.ids[slot], self.routers[slot], bool(self.flags[slot] & _ACTIVE),
+             self.names[slot], self.texts[slot])
+            for slot in range(len(self.ids)) if self.flags[slot] & _ALIVE
+        ]
+        generation = self.generation
+        self._clear()
+        for entry in live:
+            self._append(*entry)
+        self._sort_names()
+        self.generation = generation + 1
+
+    def sync_router(self, router_id: int, rows: Iterable[tuple]) -> int:
+        """Bring the clients of ``router_id`` in line with ``rows``; returns how many changed.
+
+        Unchanged clients keep their slot, so a sync that touched a few
+        secrets costs a few updates, not a reload of the router.
+        """
+
+        current = {row[0]: row for row in rows}
+        changed = 0
+        for secret_id in list(self.by_router.get(router_id, ())):
+            if secret_id not in current:
+                self.remove(secret_id)
+                changed += 1
+        for secret_id, row in current.items():
+            slot = self.slots.get(secret_id)
+            if slot is not None:
+                name, text = self._document(row[3:])
+                if (self.routers[slot] == row[1] and self.texts[slot] == text and self.names[slot] == name
+                        and bool(self.flags[slot] & _ACTIVE) == bool(row[2])):
+                    continue
+            self.add(row[0], row[1], row[2], row[3:])
+            changed += 1
+        return changed
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def _name_prefix(self, query: str) -> Iterator[Tuple[str, int]]:
+        """``(name, slot)`` of every name starting with ``query``, in name order."""
+
+        names, upper = self.sorted_names, query + _MAX_CHAR
+        lo, hi = bisect_left(names, query), bisect_left(names, upper)
+        base = ((names[i], self.sorted_slots[i]) for i in range(lo, hi))
+        recent = self.recent[bisect_left(self.recent, (query,)):bisect_left(self.recent, (upper,))]
+        return merge(base, recent)
+
+    def _match_slots(self, query: str) -> Iterator[int]:
+        flags = self.flags
+        if len(query) < MIN_NGRAM:
+            return (slot for slot in self.postings.get(_PREFIX + query, ()) if flags[slot] & _ALIVE)
+
+        postings = []
+        for gram in _grams(query):
+            if gram.startswith(_PREFIX):
+                continue
+            slots = self.postings.get(gram)
+            if not slots:
+                return iter(())
+            postings.append(slots)
+        # Verify the candidates of the rarest trigram against the text
+        texts = self.texts
+        return (slot for slot in min(postings, key=len) if flags[slot] & _ALIVE and query in texts[slot])
+
+    def match(self, query: str) -> Set[int]:
+        """Ids whose text contains ``query`` (lower-cased) or, if short, has a word starting with it."""
+
+        ids = self.ids
+        return {ids[slot] for slot in self._match_slots(query)}
+
+    def search(self, query: str, limit: int, active_only: bool = True) -> List[int]:
+        """Best ``limit`` matches of ``query``.
+
+        Names starting with ``query`` come first, in name order (an exact
+        match is therefore first); only if they do not fill ``limit`` are
+        the other matches ranked with :func:`_rank`.
+        """
+
+        wanted = _ALIVE | (_ACTIVE if active_only else 0)
+        flags = self.flags
+        found: List[int] = []
+        for _, slot in self._name_prefix(query):
+            if flags[slot] & wanted == wanted:
+                found.append(slot)
+                if len(found) == limit:
+                    break
+
+        if len(found) < limit:
+            seen = set(found)
+            names, texts = self.names, self.texts
+            others = (slot for slot in self._match_slots(query)
+                      if slot not in seen and flags[slot] & wanted == wanted)
+            found.extend(heapq.nsmallest(
+                limit - len(found), others,
+                key=lambda slot: (_rank(query, names[slot], texts[slot]), len(names[slot]), slot),
+            ))
+        return [self.ids[slot] for slot in found]
+
+    # ------------------------------------------------------------------
+    # Reporting
+    # ------------------------------------------------------------------
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the index (recomputed only after changes)."""
+
+        generation, size = self._memory
+        if generation == self.generation:
+            return size
+
+        size = sum(sys.getsizeof(part) for part in (
+            self.ids, self.routers, self.flags, self.names, self.texts, self.slots,
+            self.by_router, self.postings, self.sorted_names, self.sorted_slots, self.recent,
+        ))
+        # Strings (names are also referenced from sorted_names) and posting lists
+        size += sum(map(sys.getsizeof, self.names)) + sum(map(sys.getsizeof, self.texts))
+        size += sum(sys.getsizeof(gram) + sys.getsizeof(slots) for gram, slots in self.postings.items())
+        size += sum(sys.getsizeof(ids) for ids in self.by_router.values())
+        size += sys.getsizeof(self.recent and self.recent[0]) * len(self.recent)
+        # Boxed ints of the id -> slot map
+        size += sum(sys.getsizeof(secret_id) + sys.getsizeof(slot) for secret_id, slot in self.slots.items())
+        self._memory = (self.generation, size)
+        return size
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'entries': len(self.slots),
+            'slots': len(self.ids),
+            'dead_slots': self.dead,
+            'grams': len(self.postings),
+            'memory_bytes': self.memory_bytes(),
+            'build_seconds': self.build_seconds,
+            'built_at': self.built_at,
+        }
+
+
+class ClientSearchService:
+    """Search PPPoE clients by name, contract, comment and IP.
+
+    Backends (``SEARCH_BACKEND``):
+
+    ``postgres``
+        ``router_secrets.search_text`` with a ``pg_trgm`` GIN index
+        (migration ``m0008_secret_search``); ranked by exact/prefix name
+        match and trigram similarity.
+    ``memory``
+        Per-process :class:`NgramIndex`, the fallback on SQLite or when
+        ``pg_trgm`` is not available.
+    ``like``
+        The previous ``ILIKE '%q%'`` scan.
+
+    ``auto`` (default) picks ``postgres`` when available, else ``memory``.
+    With ``SEARCH_TYPEAHEAD_INDEX`` the type-ahead endpoint also uses the
+    in-memory index on PostgreSQL.
+
+    The index is built once per process (in the background at start-up,
+    see :meth:`warm`) and every ``SEARCH_INDEX_CHECK_SECONDS`` re-reads
+    the routers whose ``RouterSyncState.secrets_changed_at`` moved, which
+    the sync service and ORM writes stamp, applying only the clients that
+    changed.  Above ``SEARCH_INDEX_MAX_ENTRIES`` clients it is not kept
+    and searches go to the database.
+    """
+
+    _index: Optional[NgramIndex] = None
+    _versions: Dict[int, object] = {}
+    _checked_at = 0.0
+    _over_cap_at: Optional[float] = None
+    _building = False
+    _refreshing = False
+    _lock = threading.RLock()
+    _pg_search: Optional[bool] = None
+
+    # Seconds before counting the clients again once over the entry cap
+    CAP_RETRY_SECONDS = 300
+
+    # ------------------------------------------------------------------
+    # Backend selection
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _has_pg_search() -> bool:
+        if ClientSearchService._pg_search is None:
+            columns = inspect(db.engine).get_columns(Secret.__tablename__)
+            ClientSearchService._pg_search = any(c['name'] == 'search_text' for c in columns)
+        return ClientSearchService._pg_search
+
+    @staticmethod
+    def backend() -> str:
+        configured = get_setting('SEARCH_BACKEND', 'auto')
+        if configured in ('memory', 'like'):
+            return configured
+        if db.engine.dialect.name == 'postgresql' and ClientSearchService._has_pg_search():
+            return 'postgres'
+        return 'memory'
+
+    @staticmethod
+    def uses_index() -> bool:
+        """Whether this process answers type-ahead searches from :class:`NgramIndex`."""
+
+        backend = ClientSearchService.backend()
+        return backend == 'memory' or (
+            backend == 'postgres' and get_setting('SEARCH_TYPEAHEAD_INDEX', False)
+        )
+
+    @staticmethod
+    def _like(query: str):
+        return or_(
+            Secret.name.ilike(f'%{query}%'),
+            Secret.comment.ilike(f'%{query}%'),
+            Secret.ip_address.ilike(f'%{query}%'),
+            Secret.contract.ilike(f'%{query}%')
+        )
+
+    # ------------------------------------------------------------------
+    # In-memory index
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _rows(router_ids: Optional[List[int]] = None):
+        query = db.session.query(
+            Secret.id, Secret.router_id, Secret.is_active,
+            *(getattr(Secret, field) for field in SEARCH_FIELDS)
+        )
+        if router_ids is not None:
+            query = query.filter(Secret.router_id.in_(router_ids))
+        return query.yield_per(5000)
+
+    @staticmethod
+    def _read_versions() -> Dict[int, object]:
+        return dict(db.session.query(RouterSyncState.router_id, RouterSyncState.secrets_changed_at).all())
+
+    @staticmethod
+    def _over_cap(max_entries: int) -> bool:
+        cls = ClientSearchService
+        now = time.monotonic()
+        if cls._over_cap_at is not None and now - cls._over_cap_at < cls.CAP_RETRY_SECONDS:
+            return True
+        if Secret.query.count() > max_entries:
+            cls._over_cap_at = now
+            return True
+        cls._over_cap_at = None
+        return False
+
+    @staticmethod
+    def _changes(known: Dict[int, object]) -> Tuple[Dict[int, object], Dict[int, list]]:
+        """Current versions and the clients of the routers whose version moved since ``known``."""
+
+        versions = ClientSearchService._read_versions()
+        changed = [router_id for router_id, version in versions.items() if known.get(router_id) != version]
+        rows_by_router: Dict[int, list] = {router_id: [] for router_id in changed}
+        if changed:
+            for row in ClientSearchService._rows(changed):
+                rows_by_router[row[1]].append(row)
+        return versions, rows_by_router
+
+    @staticmethod
+    def index() -> Optional[NgramIndex]:
+        """The up to date in-memory index of this process (needs an app context).
+
+        Returns ``None`` while it is being built for the first time (always
+        in a background thread, see :meth:`build`) or when the clients
+        exceed ``SEARCH_INDEX_MAX_ENTRIES``; callers then use the database,
+        including the one that started the build.  The database is read
+        without holding the lock: one
+        thread loads the changed routers while the others keep searching
+        the current index, and the lock is only taken to apply them.
+        """
+
+        cls = ClientSearchService
+        max_entries = get_setting('SEARCH_INDEX_MAX_ENTRIES', 2000000)
+        with cls._lock:
+            now = time.monotonic()
+            index = cls._index
+            if index is not None:
+                if cls._refreshing or now - cls._checked_at < get_setting('SEARCH_INDEX_CHECK_SECONDS', 2):
+                    return index
+                cls._refreshing, cls._checked_at = True, now
+                known = cls._versions
+            elif cls._building or cls._over_cap(max_entries):
+                return None
+            else:
+                cls._building = True
+
+        if index is not None:
+            try:
+                versions, rows_by_router = cls._changes(known)
+                with cls._lock:
+                    # Dropped by reset() meanwhile: the next search rebuilds it
+                    if cls._index is index:
+                        for router_id, rows in rows_by_router.items():
+                            index.sync_router(router_id, rows)
+                        cls._versions = versions
+                        if len(index) > max_entries:
+                            cls.reset()
+                            cls._over_cap_at = now
+                    return cls._index
+            finally:
+                with cls._lock:
+                    cls._refreshing = False
+
+        # Loading every client takes seconds: this search uses the database
+        cls._start_build(current_app._get_current_object())
+        return None
+
+    @staticmethod
+    def build() -> NgramIndex:
+        """Build the index in the calling thread and install it (needs an app context).
+
+        Built without the lock, so searches fall back to the database
+        meanwhile.
+        """
+
+        cls = ClientSearchService
+        with cls._lock:
+            cls._building = True
+        try:
+            # Versions first: changes made while loading are applied later
+            versions = cls._read_versions()
+            index = NgramIndex.build(cls._rows())
+            with cls._lock:
+                cls._index, cls._versions, cls._checked_at = index, versions, time.monotonic()
+        finally:
+            with cls._lock:
+                cls._building = False
+        return index
+
+    @staticmethod
+    def _start_build(app) -> None:
+        def run():
+            with app.app_context():
+                try:
+                    ClientSearchService.build()
+                except Exception:  # pragma: no cover - the next search retries
+                    app.logger.exception('Error construyendo el índice de búsqueda de clientes')
+                finally:
+                    db.session.remove()
+
+        threading.Thread(target=run, name='client-search-index', daemon=True).start()
+
+    @staticmethod
+    def notify_changed() -> None:
+        """Check for changed routers on the next search instead of waiting for the interval."""
+
+        ClientSearchService._checked_at = 0.0
+
+    @staticmethod
+    def reset() -> None:
+        """Drop the in-memory index; the next search rebuilds it."""
+
+        with ClientSearchService._lock:
+            ClientSearchService._index = None
+            ClientSearchService._versions = {}
+
+    @staticmethod
+    def warm(app) -> bool:
+        """Build the index in a background thread if this process will use it."""
+
+        with app.app_context():
+            if not ClientSearchService.uses_index():
+                return False
+            # Starts the build unless one is running or the clients exceed the cap
+            ClientSearchService.index()
+        return True
+
+    @staticmethod
+    def stats() -> Dict[str, object]:
+        """Backend and in-memory index figures (entries, slots, memory)."""
+
+        cls = ClientSearchService
+        with cls._lock:
+            index = cls._index
+            return {
+                'backend': cls.backend(),
+                'typeahead_index': cls.uses_index(),
+                'max_entries': get_setting('SEARCH_INDEX_MAX_ENTRIES', 2000000),
+                'over_cap': cls._over_cap_at is not None,
+                'index': index.stats() if index is not None else None,
+            }
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    @staticmethod
+    def filter(query, search: str):
+        """Restrict a ``Secret`` query to the clients matching ``search``.
+
+        Used by the listing, so short queries keep the substring semantics
+        of ``ILIKE``; the index only answers queries of at least
+        ``MIN_NGRAM`` characters.
+        """
+
+        text = search.strip().lower()
+        backend = ClientSearchService.backend()
+        if len(text) >= MIN_NGRAM:
+            if backend == 'postgres':
+                return query.filter(literal_column('router_secrets.search_text').contains(text, autoescape=True))
+            if backend == 'memory':
+                index = ClientSearchService.index()
+                ids = None
+                if index is not None:
+                    with ClientSearchService._lock:
+                        ids = index.match(text)
+                if ids is not None and len(ids) <= get_setting('SEARCH_MAX_IDS', 5000):
+                    return query.filter(Secret.id.in_(ids))
+        return query.filter(ClientSearchService._like(search))
+
+    @staticmethod
+    def search(search: str, limit: int = 20) -> List[Secret]:
+        """Active clients matching ``search``, best matches first (type-ahead)."""
+
+        text = search.strip().lower()
+        if not text:
+            return []
+
+        if ClientSearchService.uses_index():
+            index = ClientSearchService.index()
+            if index is not None:
+                with ClientSearchService._lock:
+                    ids = index.search(text, limit)
+                clients = {c.id: c for c in Secret.query.filter(Secret.id.in_(ids)).all()}
+                return [clients[secret_id] for secret_id in ids if secret_id in clients]
+
+        if ClientSearchService.backend() == 'postgres':
+            document = literal_column('router_secrets.search_text')
+            name = func.lower(Secret.name)
+            if len(text) < MIN_NGRAM:
+                condition = name.startswith(text, autoescape=True)
+            else:
+                condition = document.contains(text, autoescape=True)
+            score = case(
+                (name == text, 3.0),
+                (name.startswith(text, autoescape=True), 2.0),
+                else_=0.0,
+            ) + func.similarity(document, text)
+            return (
+                Secret.query.filter(condition, Secret.is_active == True)
+                .order_by(score.desc(), Secret.id)
+                .limit(limit)
+                .all()
+            )
+
+        return Secret.query.filter(
+            ClientSearchService._like(search), Secret.is_active == True
+        ).limit(limit).all()
+
+
+@event.listens_for(Session, 'after_commit')
+def _secrets_committed(session):
+    # ORM writes to Secret (see models.router._stamp_secret_changes)
+    if session.info.pop('secrets_changed', None):
+        ClientSearchService.notify_changed()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _secrets_rolled_back(session):
+    session.info.pop('secrets_changed', None)
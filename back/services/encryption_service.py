@@ -1,9 +1,12 @@
 import base64
 import os
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
 from flask import current_app
 
 class EncryptionService:
+    # (clave, MultiFernet) del proceso; se reconstruye solo si cambia la clave
+    _fernet = (None, None)
+
     @staticmethod
     def get_key():
         """Obtiene clave de encriptación persistente."""
@@ -19,13 +22,26 @@ class EncryptionService:
             key = key.encode()
 
         return key
+
+    @staticmethod
+    def get_fernet():
+        """Instancia ``MultiFernet`` compartida para la clave configurada.
+
+        ``ENCRYPTION_KEY`` acepta varias claves separadas por comas para
+        rotarlas: se encripta con la primera y se desencripta con cualquiera.
+        """
+        key = EncryptionService.get_key()
+        cached_key, fernet = EncryptionService._fernet
+        if fernet is None or cached_key != key:
+            fernet = MultiFernet([Fernet(part.strip()) for part in key.split(b',') if part.strip()])
+            EncryptionService._fernet = (key, fernet)
+        return fernet
     
     @staticmethod
     def encrypt_password(password):
         """Encripta contraseña de router"""
         try:
-            key = EncryptionService.get_key()
-            f = Fernet(key)
+            f = EncryptionService.get_fernet()
             encrypted = f.encrypt(password.encode())
             return encrypted.decode()
         except Exception as e:
@@ -36,8 +52,7 @@ class EncryptionService:
     def decrypt_password(encrypted_password):
         """Desencripta contraseña de router"""
         try:
-            key = EncryptionService.get_key()
-            f = Fernet(key)
+            f = EncryptionService.get_fernet()
             decrypted = f.decrypt(encrypted_password.encode())
             return decrypted.decode()
         except Exception as e:
@@ -49,8 +64,7 @@ class EncryptionService:
         """Desencripta contraseñas almacenadas con el formato antiguo."""
 
         try:
-            key = EncryptionService.get_key()
-            f = Fernet(key)
+            f = EncryptionService.get_fernet()
             encrypted_bytes = base64.urlsafe_b64decode(encrypted_password.encode())
             decrypted = f.decrypt(encrypted_bytes)
             return decrypted.decode()
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from config.config import get_setting
+
+
+class FanOutResult:
+    """Outcome of a :meth:`FanOutService.run` call.
+
+    ``results`` holds the data of every target that answered in time,
+    ``errors`` the error message of the ones that failed or missed the
+    deadline and ``timings`` the elapsed milliseconds of each target.
+    """
+
+    def __init__(self):
+        self.results: Dict[Hashable, Any] = {}
+        self.errors: Dict[Hashable, str] = {}
+        self.timings: Dict[Hashable, float] = {}
+
+    @property
+    def partial(self) -> bool:
+        return bool(self.errors)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'errors': {str(key): value for key, value in self.errors.items()},
+            'timings_ms': {str(key): value for key, value in self.timings.items()},
+        }
+
+
+class FanOutService:
+    """Run the same kind of router request against many routers in parallel.
+
+    Tasks share one bounded, process-wide thread pool, so concurrent HTTP
+    requests cannot open an unbounded number of router connections.  The
+    whole fan-out is limited by a global deadline: routers that have not
+    answered by then are reported as errors instead of delaying the
+    response.
+
+    Tasks must not touch the database session or ``current_app``; build
+    every router object before calling :meth:`run`.
+    """
+
+    _executor: Optional[ThreadPoolExecutor] = None
+    _executor_lock = threading.Lock()
+
+    @staticmethod
+    def _get_executor() -> ThreadPoolExecutor:
+        with FanOutService._executor_lock:
+            if FanOutService._executor is None:
+                FanOutService._executor = ThreadPoolExecutor(
+                    max_workers=get_setting('FANOUT_MAX_WORKERS', 16),
+                    thread_name_prefix='router-fanout',
+                )
+            return FanOutService._executor
+
+    @staticmethod
+    def _timed(task: Callable[[], Tuple[Any, Optional[str]]]) -> Tuple[Any, Optional[str], float]:
+        start = time.perf_counter()
+        try:
+            data, error = task()
+        except Exception as exc:  # pragma: no cover - defensive
+            data, error = None, str(exc)
+        return data, error, (time.perf_counter() - start) * 1000
+
+    @staticmethod
+    def run(tasks: Dict[Hashable, Callable[[], Tuple[Any, Optional[str]]]],
+            deadline: Optional[float] = None) -> FanOutResult:
+        """Execute ``tasks`` concurrently and collect their results.
+
+        Parameters
+        ----------
+        tasks: dict
+            Maps a key (usually the router id) to a callable returning the
+            usual ``(data, error)`` tuple of :class:`MikroTikService`.
+        deadline: float
+            Seconds to wait for all tasks.  Defaults to
+            ``FANOUT_DEADLINE_SECONDS``.
+        """
+
+        result = FanOutResult()
+        if not tasks:
+            return result
+
+        if deadline is None:
+            deadline = get_setting('FANOUT_DEADLINE_SECONDS', 15)
+
+        executor = FanOutService._get_executor()
+        futures = {executor.submit(FanOutService._timed, task): key for key, task in tasks.items()}
+        done, pending = wait(futures, timeout=deadline)
+
+        for future in done:
+            key = futures[future]
+            data, error, elapsed = future.result()
+            result.timings[key] = round(elapsed, 1)
+            if error:
+                result.errors[key] = error
+            else:
+                result.results[key] = data
+
+        for future in pending:
+            # Tasks still queued are dropped; running ones finish in the
+            # background and their result is discarded.
+            future.cancel()
+            key = futures[future]
+            result.timings[key] = round(deadline * 1000, 1)
+            result.errors[key] = f'Tiempo límite excedido ({deadline}s)'
+
+        return result
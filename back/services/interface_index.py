@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Interface fields needed to match sessions and read their counters
+INTERFACE_PROPLIST = ('name', 'rx-byte', 'tx-byte', 'rx-packet', 'tx-packet')
+
+# (output field, field names used by RouterOS / older payloads)
+COUNTER_FIELDS = (
+    ('rx_bytes', ('rx-byte', 'rx_bytes')),
+    ('tx_bytes', ('tx-byte', 'tx_bytes')),
+    ('rx_packets', ('rx-packet', 'rx_packets')),
+    ('tx_packets', ('tx-packet', 'tx_packets')),
+)
+
+Counters = Tuple[int, int, int, int]
+ZERO_COUNTERS: Counters = (0, 0, 0, 0)
+
+# Dynamic PPP server interfaces are named "<pppoe-user>" (also l2tp, pptp,
+# sstp, ovpn); a second session of the same user gets "<pppoe-user-1>".
+_PPP_NAME = re.compile(r'^<?(?:pppoe|l2tp|pptp|sstp|ovpn)-(?P<user>.+?)>?$')
+_DUPLICATE_SUFFIX = re.compile(r'^(?P<user>.+)-\d+$')
+
+
+def _to_int(value: Any) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_counters(interfaces: Sequence[Dict[str, Any]]) -> List[Counters]:
+    """Parse the rx/tx byte and packet counters of every interface.
+
+    Works column by column over the whole list, so the result can be
+    zipped with the interfaces (or fed to array/numpy code) directly.
+    """
+
+    columns = []
+    for _, names in COUNTER_FIELDS:
+        primary, fallback = names
+        columns.append([_to_int(i.get(primary) or i.get(fallback)) for i in interfaces])
+    return list(zip(*columns)) if interfaces else []
+
+
+def counters_dict(counters: Counters) -> Dict[str, int]:
+    """``{'rx_bytes': ..., 'tx_bytes': ..., ...}`` for a counters tuple."""
+
+    return {field: value for (field, _), value in zip(COUNTER_FIELDS, counters)}
+
+
+def normalize_interface_name(name: str) -> Optional[str]:
+    """User name of a dynamic PPP interface (``'<pppoe-juan>'`` -> ``'juan'``).
+
+    Returns ``None`` for interfaces that are not PPP server interfaces.
+    """
+
+    match = _PPP_NAME.match((name or '').strip())
+    return match.group('user') if match else None
+
+
+class InterfaceIndex:
+    """Map PPP user names to the counters of their interface in O(1).
+
+    Built once per fetched interface list.  Exact names win; interfaces
+    with a duplicate-session suffix (``<pppoe-juan-1>``) are also indexed
+    under the base user name when no exact interface exists.
+    """
+
+    __slots__ = ('_counters',)
+
+    def __init__(self, interfaces: Iterable[Dict[str, Any]]):
+        ppp = []
+        for interface in interfaces or ():
+            user = normalize_interface_name(interface.get('name'))
+            if user is not None:
+                ppp.append((user, interface))
+
+        counters = parse_counters([interface for _, interface in ppp])
+        exact: Dict[str, Counters] = {}
+        suffixed: Dict[str, Counters] = {}
+        for (user, _), values in zip(ppp, counters):
+            exact.setdefault(user, values)
+            match = _DUPLICATE_SUFFIX.match(user)
+            if match:
+                suffixed.setdefault(match.group('user'), values)
+
+        self._counters = {**suffixed, **exact}
+
+    def __len__(self) -> int:
+        return len(self._counters)
+
+    def lookup(self, username: str) -> Optional[Counters]:
+        """Counters of ``username``'s interface, or ``None`` if it has none."""
+
+        return self._counters.get(username)
@@ -0,0 +1,434 @@
+from __future__ import annotations
+
+import ipaddress
+import re
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, or_
+
+from config.config import get_setting
+from models import db
+from models.ip_pool import IpPool
+from models.router import Secret
+from utils.exceptions import ValidationError
+from utils.ip_range import host_range, parse_ipv4
+
+# First byte of a bitmap with at least one free (0) bit
+_FREE_BYTE = re.compile(b'[^\xff]')
+
+# Attempts of a conditional bitmap update before giving up
+MAX_RETRIES = 20
+
+
+def _next_free(bitmap: bytearray, start: int, size: int) -> Optional[int]:
+    """Index of the first free bit at or after ``start``, wrapping around once."""
+
+    for begin, stop in ((start, size), (0, start)):
+        position = begin
+        # Finish the partial first byte bit by bit
+        while position < stop and position % 8:
+            if not _is_set(bitmap, position):
+                return position
+            position += 1
+        if position >= stop:
+            continue
+        match = _FREE_BYTE.search(bitmap, position >> 3, (stop + 7) >> 3)
+        if match is not None:
+            byte = match.start()
+            # Highest zero bit of the byte (bit 0 is the most significant)
+            index = byte * 8 + 8 - (~bitmap[byte] & 0xFF).bit_length()
+            if index < stop:
+                return index
+    return None
+
+
+def _is_set(bitmap: bytearray, index: int) -> bool:
+    return bool(bitmap[index >> 3] & (0x80 >> (index & 7)))
+
+
+def _set(bitmap: bytearray, index: int, value: bool) -> None:
+    if value:
+        bitmap[index >> 3] |= 0x80 >> (index & 7)
+    else:
+        bitmap[index >> 3] &= ~(0x80 >> (index & 7)) & 0xFF
+
+
+class IpPoolService:
+    """Allocate client addresses from per-router / per-profile pools.
+
+    Each pool keeps one bit per address in ``ip_pools.bitmap``.  Allocation
+    scans from ``next_index`` for the first byte that is not ``0xFF`` (a C
+    level regex search), so handing out addresses in order costs O(1)
+    amortized; releases move ``next_index`` back so freed addresses are
+    reused first.  Writes are conditional on ``version`` (like
+    ``RouterSyncState.claim``), so concurrent requests in several processes
+    never hand out the same address.
+
+    Addresses assigned outside the pool (a synchronisation, a client
+    created with an explicit IP) are detected through the
+    ``router_secrets.ip_value`` index when the allocator reaches them.
+    """
+
+    # ------------------------------------------------------------------
+    # Pools
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _secrets_in(router_id: Optional[int], first, last):
+        query = db.session.query(Secret.ip_value).filter(Secret.ip_value.between(first, last))
+        if router_id is not None:
+            query = query.filter(Secret.router_id == router_id)
+        return query
+
+    @staticmethod
+    def _build_bitmap(router_id: Optional[int], first, last) -> Tuple[bytearray, int]:
+        """Bitmap of ``first..last`` with the addresses already used by clients."""
+
+        size = int(last) - int(first) + 1
+        bitmap = bytearray((size + 7) // 8)
+        # Padding bits of the last byte are never free
+        for index in range(size, len(bitmap) * 8):
+            _set(bitmap, index, True)
+        allocated = 0
+        for (address,) in IpPoolService._secrets_in(router_id, first, last):
+            index = int(address) - int(first)
+            if not _is_set(bitmap, index):
+                _set(bitmap, index, True)
+                allocated += 1
+        return bitmap, allocated
+
+    @staticmethod
+    def create(name: str, address_range: str, router_id: Optional[int] = None,
+               profile: Optional[str] = None) -> IpPool:
+        """Add a pool for ``address_range`` (CIDR or ``a-b``); the caller commits.
+
+        Raises
+        ------
+        ValidationError
+            If the range is not IPv4 or exceeds ``IP_POOL_MAX_ADDRESSES``.
+        """
+
+        if not name:
+            raise ValidationError('El nombre del pool es requerido')
+        first, last = host_range(address_range)
+        if first is None:
+            raise ValidationError(f'Rango de IPs inválido: {address_range}')
+        size = int(last) - int(first) + 1
+        max_size = get_setting('IP_POOL_MAX_ADDRESSES', 1 << 20)
+        if size > max_size:
+            raise ValidationError(f'El pool no puede tener más de {max_size} direcciones')
+
+        bitmap, allocated = IpPoolService._build_bitmap(router_id, first, last)
+        pool = IpPool(name=name, router_id=router_id, profile=profile or None,
+                      first_address=first, last_address=last,
+                      bitmap=bytes(bitmap), allocated=allocated, next_index=0, version=0)
+        db.session.add(pool)
+        db.session.flush()
+        return pool
+
+    @staticmethod
+    def find(router_id: int, profile: Optional[str] = None) -> Optional[IpPool]:
+        """Pool for a new client: router and profile, then router only, then profile only."""
+
+        candidates = IpPool.query.filter(
+            IpPool.is_active == True,
+            or_(IpPool.router_id == router_id, IpPool.router_id.is_(None)),
+            or_(IpPool.profile == profile, IpPool.profile.is_(None)),
+            or_(IpPool.router_id.isnot(None), IpPool.profile.isnot(None)),
+        ).order_by(IpPool.id).all()
+
+        def rank(pool):
+            return (pool.router_id is None, pool.profile is None)
+
+        return min(candidates, key=rank) if candidates else None
+
+    # ------------------------------------------------------------------
+    # Bitmap updates
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _load(pool_id: int):
+        return db.session.execute(
+            db.select(IpPool.router_id, IpPool.first_address, IpPool.last_address,
+                      IpPool.bitmap, IpPool.allocated, IpPool.next_index, IpPool.version)
+            .where(IpPool.id == pool_id, IpPool.is_active == True)
+        ).first()
+
+    @staticmethod
+    def _store(pool_id: int, version: int, bitmap: bytearray, allocated: int, next_index: int) -> bool:
+        result = db.session.execute(
+            db.update(IpPool)
+            .where(IpPool.id == pool_id, IpPool.version == version)
+            .values(bitmap=bytes(bitmap), allocated=allocated, next_index=next_index,
+                    version=version + 1)
+            .execution_options(synchronize_session=False)
+        )
+        return bool(result.rowcount)
+
+    @staticmethod
+    def allocate(pool_id: int) -> Tuple[Optional[ipaddress.IPv4Address], Optional[str]]:
+        """Reserve the next free address of a pool and commit.
+
+        Returns
+        -------
+        tuple
+            ``(address, error)``; ``error`` is set when the pool does not
+            exist or is exhausted.
+        """
+
+        for _ in range(MAX_RETRIES):
+            row = IpPoolService._load(pool_id)
+            if row is None:
+                return None, 'Pool no encontrado'
+            first = int(row.first_address)
+            size = int(row.last_address) - first + 1
+            bitmap = bytearray(row.bitmap)
+            allocated = row.allocated
+
+            index = _next_free(bitmap, row.next_index % size, size)
+            while index is not None:
+                address = ipaddress.IPv4Address(first + index)
+                _set(bitmap, index, True)
+                allocated += 1
+                # Used by a client the pool did not hand out: keep looking
+                if IpPoolService._secrets_in(row.router_id, address, address).first() is None:
+                    break
+                index = _next_free(bitmap, (index + 1) % size, size)
+
+            next_index = (index + 1) % size if index is not None else row.next_index
+            if IpPoolService._store(pool_id, row.version, bitmap, allocated, next_index):
+                db.session.commit()
+                if index is None:
+                    return None, 'No quedan direcciones libres en el pool'
+                return address, None
+            db.session.rollback()
+        return None, 'El pool está siendo modificado, intente nuevamente'
+
+    @staticmethod
+    def _containing(router_id: Optional[int], address) -> List[int]:
+        """Ids of the active pools of ``router_id`` (or global) that contain ``address``."""
+
+        return [
+            pool_id for (pool_id,) in db.session.query(IpPool.id).filter(
+                IpPool.is_active == True,
+                IpPool.first_address <= address,
+                IpPool.last_address >= address,
+                or_(IpPool.router_id == router_id, IpPool.router_id.is_(None)),
+            )
+        ]
+
+    @staticmethod
+    def _mark(router_id: Optional[int], address, used: bool) -> int:
+        """Set the bit of ``address`` in the pools that contain it; the caller commits."""
+
+        address = parse_ipv4(str(address)) if address is not None else None
+        if address is None:
+            return 0
+        changed = 0
+        for pool_id in IpPoolService._containing(router_id, address):
+            for _ in range(MAX_RETRIES):
+                row = IpPoolService._load(pool_id)
+                if row is None:
+                    break
+                index = int(address) - int(row.first_address)
+                bitmap = bytearray(row.bitmap)
+                if _is_set(bitmap, index) == used:
+                    break
+                _set(bitmap, index, used)
+                allocated = row.allocated + (1 if used else -1)
+                next_index = row.next_index if used else min(row.next_index, index)
+                if IpPoolService._store(pool_id, row.version, bitmap, allocated, next_index):
+                    changed += 1
+                    break
+        return changed
+
+    @staticmethod
+    def has_client(router_id: Optional[int], address) -> bool:
+        """Whether a client of ``router_id`` (any router if ``None``) has ``address``."""
+
+        address = parse_ipv4(str(address)) if address is not None else None
+        if address is None:
+            return False
+        return IpPoolService._secrets_in(router_id, address, address).first() is not None
+
+    @staticmethod
+    def is_used(router_id: int, address) -> bool:
+        """Whether ``address`` belongs to a client of the router or is reserved in one of its pools.
+
+        The pool bit covers addresses handed out by :meth:`allocate` whose
+        client is still being created on the router.
+        """
+
+        address = parse_ipv4(str(address)) if address is not None else None
+        if address is None:
+            return False
+        if IpPoolService.has_client(router_id, address):
+            return True
+        for pool_id in IpPoolService._containing(router_id, address):
+            row = IpPoolService._load(pool_id)
+            if row is not None and _is_set(bytearray(row.bitmap), int(address) - int(row.first_address)):
+                return True
+        return False
+
+    @staticmethod
+    def reserve(router_id: int, address) -> int:
+        """Mark an address chosen by the operator as used (the caller commits)."""
+
+        return IpPoolService._mark(router_id, address, True)
+
+    @staticmethod
+    def release(router_id: int, address) -> int:
+        """Return a client's address to its pools (the caller commits)."""
+
+        return IpPoolService._mark(router_id, address, False)
+
+    @staticmethod
+    def release_many(router_id: int, addresses) -> int:
+        """Return the addresses of clients removed in bulk to their pools (the caller commits).
+
+        Used by synchronisations, which delete and renumber clients without
+        going through :meth:`release`.  Each affected pool is read and
+        written once; addresses still used by another client keep their bit.
+        """
+
+        values = {int(address) for address in addresses if address is not None}
+        if not values:
+            return 0
+        low, high = ipaddress.IPv4Address(min(values)), ipaddress.IPv4Address(max(values))
+        pool_ids = [
+            pool_id for (pool_id,) in db.session.query(IpPool.id).filter(
+                IpPool.is_active == True,
+                IpPool.first_address <= high,
+                IpPool.last_address >= low,
+                or_(IpPool.router_id == router_id, IpPool.router_id.is_(None)),
+            )
+        ]
+
+        released = 0
+        for pool_id in pool_ids:
+            for _ in range(MAX_RETRIES):
+                row = IpPoolService._load(pool_id)
+                if row is None:
+                    break
+                first, last = int(row.first_address), int(row.last_address)
+                inside = {value for value in values if first <= value <= last}
+                if inside:
+                    in_use = IpPoolService._secrets_in(
+                        row.router_id, ipaddress.IPv4Address(min(inside)), ipaddress.IPv4Address(max(inside)))
+                    inside -= {int(address) for (address,) in in_use}
+                bitmap = bytearray(row.bitmap)
+                freed = [value - first for value in inside if _is_set(bitmap, value - first)]
+                if not freed:
+                    break
+                for index in freed:
+                    _set(bitmap, index, False)
+                next_index = min(row.next_index, *freed)
+                if IpPoolService._store(pool_id, row.version, bitmap, row.allocated - len(freed), next_index):
+                    released += len(freed)
+                    break
+        return released
+
+    @staticmethod
+    def rebuild(pool_id: int, release_unused: bool = False) -> Tuple[Optional[IpPool], Optional[str]]:
+        """Recompute a pool's occupancy from the clients in the DB and commit.
+
+        Marks the addresses of clients the pool missed (e.g. added directly
+        to the database) and recounts ``allocated``.  Addresses reserved
+        without a client are kept, since they may belong to a client still
+        being created (see :meth:`allocate`); ``release_unused`` frees them
+        too, for pools that drifted after clients were removed directly
+        from the database.  Written with the usual ``version`` check, so a
+        concurrent allocation is never overwritten.
+
+        Returns
+        -------
+        tuple
+            ``(pool, error)``; ``error`` is set when the pool does not
+            exist or keeps changing under the rebuild.
+        """
+
+        for _ in range(MAX_RETRIES):
+            row = IpPoolService._load(pool_id)
+            if row is None:
+                return None, 'Pool no encontrado'
+            size = int(row.last_address) - int(row.first_address) + 1
+            bitmap, _ = IpPoolService._build_bitmap(row.router_id, row.first_address, row.last_address)
+            current = bytearray(row.bitmap)
+
+            next_index = row.next_index
+            if release_unused:
+                # Freed addresses are reused first, as with release()
+                freed = next((position for position, (old, new) in enumerate(zip(current, bitmap))
+                              if old & ~new), None)
+                if freed is not None:
+                    next_index = min(next_index, freed * 8)
+            else:
+                bitmap = bytearray(old | new for old, new in zip(current, bitmap))
+
+            allocated = bin(int.from_bytes(bitmap, 'big')).count('1') - (len(bitmap) * 8 - size)
+            if IpPoolService._store(pool_id, row.version, bitmap, allocated, next_index):
+                db.session.commit()
+                return IpPool.query.get(pool_id), None
+            db.session.rollback()
+        return None, 'El pool está siendo modificado, intente nuevamente'
+
+    # ------------------------------------------------------------------
+    # Conflicts
+    # ------------------------------------------------------------------
+    @staticmethod
+    def conflicts(limit: int = 500) -> Dict[str, List[Dict[str, Any]]]:
+        """Addresses assigned to more than one client and overlapping pools.
+
+        Duplicates come from a ``GROUP BY`` over the ``ip_value`` index;
+        pool overlaps from a sweep over the pools sorted by first address.
+        """
+
+        duplicated = (
+            db.session.query(Secret.ip_value)
+            .filter(Secret.ip_value.isnot(None))
+            .group_by(Secret.ip_value)
+            .having(func.count() > 1)
+            .order_by(Secret.ip_value)
+            .limit(limit)
+            .subquery()
+        )
+        clients = (
+            Secret.query.filter(Secret.ip_value.in_(db.select(duplicated.c.ip_value)))
+            .order_by(Secret.ip_value, Secret.router_id, Secret.id)
+            .all()
+        )
+        by_address = defaultdict(list)
+        for client in clients:
+            by_address[str(client.ip_value)].append({
+                'id': client.id,
+                'name': client.name,
+                'router_id': client.router_id,
+                'profile': client.profile,
+            })
+
+        addresses = [
+            {
+                'ip': ip,
+                'clients': entries,
+                'routers': sorted({entry['router_id'] for entry in entries}),
+                'cross_router': len({entry['router_id'] for entry in entries}) > 1,
+            }
+            for ip, entries in by_address.items()
+        ]
+        return {'addresses': addresses, 'pools': IpPoolService._pool_overlaps()}
+
+    @staticmethod
+    def _pool_overlaps() -> List[Dict[str, Any]]:
+        pools = IpPool.query.filter_by(is_active=True).order_by(IpPool.first_address).all()
+        overlaps, open_pools = [], []
+        for pool in pools:
+            open_pools = [other for other in open_pools if other.last_address >= pool.first_address]
+            for other in open_pools:
+                shared_router = None in (pool.router_id, other.router_id) or pool.router_id == other.router_id
+                if shared_router:
+                    overlaps.append({
+                        'pools': [other.id, pool.id],
+                        'first_address': str(pool.first_address),
+                        'last_address': str(min(pool.last_address, other.last_address)),
+                    })
+            open_pools.append(pool)
+        return overlaps
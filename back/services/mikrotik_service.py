@@ -1,12 +1,25 @@
 from __future__ import annotations
 
+import hashlib
+import ssl
+import threading
+import time
 import urllib3
-from typing import Any, Dict, Tuple, Optional
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Sequence, Tuple, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
+from config.config import get_setting as _setting
 from models.router import Router
+from services.router_cache import RouterReadCache
+from services.router_health import RouterHealth
+from services.router_scheduler import RouterScheduler
+from services.routeros_api_transport import RouterOSApiTransport
+from services.single_flight import SingleFlight
+from utils.streaming import iter_json_array
 
 # The routers usually use self signed certificates.  We disable the
 # warnings so the logs stay clean.  In a real project you should install
@@ -14,11 +27,160 @@ from models.router import Router
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 
+class _RouterHTTPAdapter(HTTPAdapter):
+    """HTTP adapter sharing a single TLS context between connections.
+
+    Building an ``SSLContext`` is surprisingly expensive, and sharing it
+    also lets OpenSSL reuse TLS sessions when a pooled connection has to
+    be re-established.
+    """
+
+    _ssl_context: Optional[ssl.SSLContext] = None
+    _ssl_context_lock = threading.Lock()
+
+    @classmethod
+    def _get_ssl_context(cls) -> ssl.SSLContext:
+        with cls._ssl_context_lock:
+            if cls._ssl_context is None:
+                context = ssl.create_default_context()
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+                cls._ssl_context = context
+            return cls._ssl_context
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["ssl_context"] = self._get_ssl_context()
+        return super().init_poolmanager(*args, **kwargs)
+
+
+class _PooledSession:
+    """HTTP session of the registry, with its use counters (guarded by the registry lock)."""
+
+    __slots__ = ('session', 'last_used', 'in_use')
+
+    def __init__(self, session: requests.Session, last_used: float) -> None:
+        self.session = session
+        self.last_used = last_used
+        self.in_use = 0
+
+
 class MikroTikService:
-    """Utility methods for talking to the RouterOS REST API."""
+    """Utility methods for talking to RouterOS.
+
+    Requests go over the REST API by default.  Routers whose
+    ``api_transport`` is ``'api'`` or ``'api-ssl'`` are served by
+    :class:`RouterOSApiTransport` over the binary API instead.
+    """
+
+    # Registry of pooled, keep-alive HTTP sessions.  Keys are built from
+    # the router URI and its credentials so a change of any of them ends
+    # up in a different pool.
+    _sessions: Dict[Tuple[str, str, str], _PooledSession] = {}
+    _sessions_lock = threading.Lock()
+
+    @staticmethod
+    def _session_key(router: Router) -> Tuple[str, str, str]:
+        # RouterCredentials computes it once
+        key = getattr(router, "session_key", None)
+        if key is not None:
+            return key
+        password_hash = hashlib.sha256((router.password or "").encode()).hexdigest()
+        return (router.uri, router.username, password_hash)
+
+    @staticmethod
+    def _build_session(router: Router) -> requests.Session:
+        """Create a new HTTP session with its own connection pool."""
+
+        pool_size = _setting("MIKROTIK_POOL_SIZE", 4)
+        adapter = _RouterHTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=_setting("MIKROTIK_POOL_BLOCK", False),
+        )
+
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.auth = HTTPBasicAuth(router.username, router.password)
+        if not _setting("MIKROTIK_KEEPALIVE", True):
+            session.headers["Connection"] = "close"
+        return session
 
     @staticmethod
-    def _request(router: Router, endpoint: str) -> Tuple[Optional[Any], Optional[str]]:
+    @contextmanager
+    def _checkout_session(router: Router) -> Iterator[requests.Session]:
+        """Use the pooled session for ``router``, creating it if needed.
+
+        Sessions idle for longer than ``MIKROTIK_SESSION_IDLE_SECONDS`` are
+        closed and rebuilt, since the router will have dropped the
+        underlying keep-alive connections by then anyway.  A session is
+        marked as checked out (under the registry lock) for the whole
+        block, so it is never closed as idle while a request is using it;
+        it counts as used when the block exits.
+        """
+
+        key = MikroTikService._session_key(router)
+        idle_timeout = _setting("MIKROTIK_SESSION_IDLE_SECONDS", 300)
+        now = time.monotonic()
+
+        with MikroTikService._sessions_lock:
+            entry = MikroTikService._sessions.get(key)
+            if entry is not None and not entry.in_use and now - entry.last_used > idle_timeout:
+                entry.session.close()
+                entry = None
+            if entry is None:
+                entry = MikroTikService._sessions[key] = _PooledSession(MikroTikService._build_session(router), now)
+            entry.in_use += 1
+
+        try:
+            yield entry.session
+        finally:
+            with MikroTikService._sessions_lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+
+    @staticmethod
+    def invalidate_sessions(uri: str) -> int:
+        """Close every pooled session or API connection that points to ``uri``.
+
+        Must be called whenever the URI or the credentials of a router
+        change.  Returns the number of pools closed.
+        """
+
+        with MikroTikService._sessions_lock:
+            keys = [key for key in MikroTikService._sessions if key[0] == uri]
+            for key in keys:
+                MikroTikService._sessions.pop(key).session.close()
+        RouterReadCache.invalidate(uri)
+        RouterHealth.reset(uri)
+        return len(keys) + RouterOSApiTransport.invalidate(uri)
+
+    @staticmethod
+    def _uses_api(router: Router) -> bool:
+        """Whether ``router`` is configured for the binary API transport."""
+
+        return getattr(router, "api_transport", "rest") in RouterOSApiTransport.TRANSPORTS
+
+    @staticmethod
+    def close_all_sessions() -> None:
+        """Close every pooled session (e.g. on worker shutdown)."""
+
+        with MikroTikService._sessions_lock:
+            for entry in MikroTikService._sessions.values():
+                entry.session.close()
+            MikroTikService._sessions.clear()
+
+    @staticmethod
+    def _query_params(query: Optional[Dict[str, str]], proplist: Optional[Sequence[str]]) -> Dict[str, str]:
+        """Build the REST query string for server-side filtering."""
+
+        params = dict(query or {})
+        if proplist:
+            params[".proplist"] = ",".join(proplist)
+        return params
+
+    @staticmethod
+    def _request(router: Router, endpoint: str, query: Optional[Dict[str, str]] = None,
+                 proplist: Optional[Sequence[str]] = None) -> Tuple[Optional[Any], Optional[str]]:
         """Perform a GET request against a RouterOS REST endpoint.
 
         Parameters
@@ -27,29 +189,197 @@ class MikroTikService:
             Router database model containing connection data.
         endpoint: str
             Endpoint to query, e.g. ``'ppp/secret'``.
+        query: dict
+            Exact-match filters evaluated by the router, e.g.
+            ``{'name': 'client1'}``.  Only matching rows are transferred.
+        proplist: Sequence[str]
+            Fields to return (``.proplist``), e.g. ``['.id', 'name']``.
 
         Returns
         -------
         Tuple[Optional[Any], Optional[str]]
             Returns a tuple with the data as the first element and an
             error message as the second element.  Only one of the two will
-            be non-``None``.
+            be non-``None``.  Identical concurrent requests share one
+            result (see :class:`SingleFlight`) unless a write to the
+            router lands in between.
         """
 
-        url = f"https://{router.uri}/rest/{endpoint.lstrip('/')}"
+        key = (
+            MikroTikService._session_key(router), endpoint,
+            tuple(sorted((query or {}).items())), tuple(proplist or ()),
+        )
+        return SingleFlight.do(
+            key, lambda: MikroTikService._dispatch(router, endpoint, 'GET', query=query, proplist=proplist),
+            generation=lambda: RouterReadCache.generation(router.uri),
+        )
+
+    @staticmethod
+    def _dispatch(router: Router, endpoint: str, method: str, data: Optional[dict] = None,
+                  query: Optional[Dict[str, str]] = None,
+                  proplist: Optional[Sequence[str]] = None) -> Tuple[Optional[Any], Optional[str]]:
+        """Send one request through the router's circuit breaker and scheduler.
+
+        Waits for a slot of the router in the request's priority class
+        (:class:`RouterScheduler`) and only then asks the circuit
+        (:class:`RouterHealth`), so a half-open probe is never taken by a
+        request that ends up rejected by the queue.
+        """
 
+        priority = RouterScheduler.priority(method)
+        error = RouterScheduler.acquire(router.uri, priority)
+        if error:
+            return None, error
+        error = RouterHealth.admit(router.uri)
+        if error:
+            RouterScheduler.release(router.uri, priority)
+            return None, error
+        start = time.monotonic()
         try:
-            response = requests.get(
-                url,
-                auth=HTTPBasicAuth(router.username, router.password),
-                timeout=10,
-                verify=False,
+            return MikroTikService._send(router, endpoint, method, data, query, proplist)
+        finally:
+            RouterScheduler.release(router.uri, priority, time.monotonic() - start)
+
+    @staticmethod
+    def _send(router: Router, endpoint: str, method: str, data: Optional[dict],
+              query: Optional[Dict[str, str]],
+              proplist: Optional[Sequence[str]]) -> Tuple[Optional[Any], Optional[str]]:
+        """Send one request with the adaptive timeout of the endpoint and report the outcome.
+
+        Only connection errors and timeouts count as failures, HTTP errors
+        mean the router answered.
+        """
+
+        timeout = RouterHealth.timeout(router.uri, endpoint)
+
+        if MikroTikService._uses_api(router):
+            return RouterOSApiTransport.request(
+                router, endpoint, method, data, _setting, query=query, proplist=proplist, timeout=timeout
             )
+
+        url = f"https://{router.uri}/rest/{endpoint.lstrip('/')}"
+        start = time.monotonic()
+        try:
+            with MikroTikService._checkout_session(router) as session:
+                response = session.request(
+                    method,
+                    url,
+                    params=MikroTikService._query_params(query, proplist) if method == 'GET' else None,
+                    json=data if method in ('POST', 'PUT') else None,
+                    timeout=timeout,
+                    verify=False,
+                )
+        except Exception as exc:  # pragma: no cover - network failures
+            # Any failure before a response counts, or a half-open probe would never report
+            RouterHealth.record(router.uri, endpoint, False, error=str(exc))
+            return None, str(exc)
+        RouterHealth.record(router.uri, endpoint, True, time.monotonic() - start)
+
+        try:
             response.raise_for_status()
+
+            # Para DELETE, puede que no haya contenido en la respuesta
+            if method != 'GET' and (response.status_code == 204 or not response.content):
+                return {"success": True}, None
+
             return response.json(), None
         except Exception as exc:  # pragma: no cover - network failures
             return None, str(exc)
 
+    @staticmethod
+    def _cached_request(router: Router, endpoint: str, proplist: Optional[Sequence[str]] = None,
+                        max_age: Optional[float] = None) -> Tuple[Optional[Any], Optional[str]]:
+        """GET through :class:`RouterReadCache` (see :data:`ENDPOINT_TTLS`).
+
+        ``max_age`` overrides the endpoint TTL; ``0`` always asks the router.
+        """
+
+        key = (MikroTikService._session_key(router), endpoint, tuple(proplist or ()))
+        return RouterReadCache.get(
+            key, endpoint,
+            lambda: MikroTikService._request(router, endpoint, proplist=proplist),
+            max_age,
+        )
+
+    @staticmethod
+    @contextmanager
+    def stream(router: Router, endpoint: str,
+               proplist: Optional[Sequence[str]] = None) -> Iterator[Tuple[Optional[Iterator[Dict[str, Any]]], Optional[str]]]:
+        """GET a whole table as a generator of records instead of a list.
+
+        Yields ``(records, error)``.  The body is read in
+        ``MIKROTIK_STREAM_CHUNK_SIZE`` byte chunks and decoded one record
+        at a time (:func:`~utils.streaming.iter_json_array`), so memory does
+        not grow with the size of the table.  The connection and the
+        router slot (:class:`RouterScheduler`) are held until the block
+        exits::
+
+            with MikroTikService.stream(router, 'ppp/secret') as (records, error):
+                for record in records or ():
+                    ...
+
+        Errors found while reading the body (a dropped connection, invalid
+        JSON, an API trap) are raised by the generator.  Results bypass the
+        read cache and single-flight.
+        """
+
+        priority = RouterScheduler.priority('GET')
+        error = RouterScheduler.acquire(router.uri, priority)
+        if error:
+            yield None, error
+            return
+        error = RouterHealth.admit(router.uri)
+        if error:
+            RouterScheduler.release(router.uri, priority)
+            yield None, error
+            return
+
+        start = time.monotonic()
+        timeout = RouterHealth.timeout(router.uri, endpoint)
+        try:
+            if MikroTikService._uses_api(router):
+                stream = RouterOSApiTransport.stream(router, endpoint, _setting, proplist, timeout)
+            else:
+                stream = MikroTikService._stream_rest(router, endpoint, proplist, timeout)
+            with stream as result:
+                yield result
+        finally:
+            RouterScheduler.release(router.uri, priority, time.monotonic() - start)
+
+    @staticmethod
+    @contextmanager
+    def _stream_rest(router: Router, endpoint: str, proplist: Optional[Sequence[str]],
+                     timeout: float) -> Iterator[Tuple[Optional[Iterator[Dict[str, Any]]], Optional[str]]]:
+        url = f"https://{router.uri}/rest/{endpoint.lstrip('/')}"
+        start = time.monotonic()
+        # The session stays checked out until the body is read
+        with MikroTikService._checkout_session(router) as session:
+            try:
+                response = session.get(
+                    url,
+                    params=MikroTikService._query_params(None, proplist),
+                    timeout=timeout,
+                    verify=False,
+                    stream=True,
+                )
+            except Exception as exc:  # pragma: no cover - network failures
+                RouterHealth.record(router.uri, endpoint, False, error=str(exc))
+                yield None, str(exc)
+                return
+            RouterHealth.record(router.uri, endpoint, True, time.monotonic() - start)
+
+            try:
+                try:
+                    response.raise_for_status()
+                except requests.exceptions.HTTPError as exc:
+                    yield None, str(exc)
+                    return
+                chunks = response.iter_content(_setting("MIKROTIK_STREAM_CHUNK_SIZE", 65536))
+                yield iter_json_array(chunks), None
+            finally:
+                # A partially read body discards the connection instead of reusing it
+                response.close()
+
     # ------------------------------------------------------------------
     # High level helpers used by the sync service
     # ------------------------------------------------------------------
@@ -64,10 +394,31 @@ class MikroTikService:
         return (error is None, "Conexión exitosa" if error is None else error)
 
     @staticmethod
-    def get_pppoe_secrets(router: Router) -> Tuple[Optional[Any], Optional[str]]:
-        """Return the configured PPPoE secrets of the router."""
+    def get_pppoe_secrets(router: Router, query: Optional[Dict[str, str]] = None,
+                          proplist: Optional[Sequence[str]] = None) -> Tuple[Optional[Any], Optional[str]]:
+        """Return the configured PPPoE secrets of the router.
+
+        ``query`` and ``proplist`` restrict the rows and fields returned,
+        see :meth:`_request`.
+        """
+
+        return MikroTikService._request(router, "ppp/secret", query, proplist)
+
+    @staticmethod
+    def stream_pppoe_secrets(router: Router):
+        """Context manager yielding ``(secrets, error)`` with the secrets as a generator, see :meth:`stream`."""
+
+        return MikroTikService.stream(router, "ppp/secret")
+
+    @staticmethod
+    def find_pppoe_secret(router: Router, name: str,
+                          proplist: Optional[Sequence[str]] = None) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Return the PPPoE secret called ``name`` or ``None`` if it does not exist."""
 
-        return MikroTikService._request(router, "ppp/secret")
+        data, error = MikroTikService.get_pppoe_secrets(router, {"name": name}, proplist)
+        if error:
+            return None, error
+        return (data[0] if data else None), None
 
     @staticmethod
     def get_pppoe_active(router: Router) -> Tuple[Optional[Any], Optional[str]]:
@@ -76,22 +427,41 @@ class MikroTikService:
         return MikroTikService._request(router, "ppp/active")
     
     @staticmethod
-    def get_interfaces(router: Router) -> Tuple[Optional[Any], Optional[str]]:
-        """Return network interfaces of the router."""
+    def get_interfaces(router: Router, proplist: Optional[Sequence[str]] = None,
+                       max_age: Optional[float] = None) -> Tuple[Optional[Any], Optional[str]]:
+        """Return network interfaces of the router (only ``proplist`` fields if given).
+
+        Served from the read cache for up to ``max_age`` seconds (the
+        configured interface TTL by default, ``0`` to bypass it).
+        """
 
-        return MikroTikService._request(router, "interface")
+        return MikroTikService._cached_request(router, "interface", proplist, max_age)
 
     @staticmethod
-    def get_router_resources(router: Router) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
-        """Return resource information (CPU, memory, etc.) of the router."""
+    def get_router_resources(router: Router, max_age: Optional[float] = None) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Return resource information (CPU, memory, etc.) of the router (cached)."""
 
-        return MikroTikService._request(router, "system/resource")
+        return MikroTikService._cached_request(router, "system/resource", max_age=max_age)
 
     @staticmethod
     def get_router_info(router: Router) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
-        """Return general information of the router."""
+        """Return general information of the router: identity, version and board.
 
-        return MikroTikService._request(router, "system/resource")
+        Both requests go through the read cache, so it costs nothing extra
+        right after :meth:`get_router_resources`.
+        """
+
+        resources, error = MikroTikService.get_router_resources(router)
+        if error:
+            return None, error
+        identity, _ = MikroTikService._cached_request(router, "system/identity")
+        return {
+            "identity": (identity or {}).get("name"),
+            "version": resources.get("version"),
+            "board-name": resources.get("board-name"),
+            "architecture-name": resources.get("architecture-name"),
+            "uptime": resources.get("uptime"),
+        }, None
 
     # ------------------------------------------------------------------
     # CRUD operations for PPPoE secrets
@@ -118,53 +488,36 @@ class MikroTikService:
             error message as the second element.  Only one of the two will
             be non-``None``.
         """
-    
-        url = f"https://{router.uri}/rest/{endpoint.lstrip('/')}"
+        if method not in ('GET', 'POST', 'PUT', 'DELETE'):
+            return None, f"Unsupported HTTP method: {method}"
 
         try:
-            if method == 'GET':
-                response = requests.get(
-                    url,
-                    auth=HTTPBasicAuth(router.username, router.password),
-                    timeout=10,
-                    verify=False,
-                )
-            elif method == 'POST':
-                response = requests.post(
-                    url,
-                    json=data,
-                    auth=HTTPBasicAuth(router.username, router.password),
-                    timeout=10,
-                    verify=False,
-                )
-            elif method == 'PUT':
-                response = requests.put(
-                    url,
-                    json=data,
-                    auth=HTTPBasicAuth(router.username, router.password),
-                    timeout=10,
-                    verify=False,
-                )
-            elif method == 'DELETE':
-                response = requests.delete(
-                    url,
-                    auth=HTTPBasicAuth(router.username, router.password),
-                    timeout=10,
-                    verify=False,
-                )
-            else:
-                return None, f"Unsupported HTTP method: {method}"
-                
-            response.raise_for_status()
-            
-            # Para DELETE, puede que no haya contenido en la respuesta
-            if response.status_code == 204 or not response.content:
-                return {"success": True}, None
-                
-            return response.json(), None
-            
-        except Exception as exc:  # pragma: no cover - network failures
-            return None, str(exc)
+            return MikroTikService._dispatch(router, endpoint, method, data)
+        finally:
+            if method != 'GET':
+                # Drop cached reads once the write has been applied (or failed)
+                RouterReadCache.invalidate(router.uri)
+
+    @staticmethod
+    def created_id(result: Any) -> Optional[str]:
+        """Extract the ``.id`` of a newly created item from a create response.
+
+        RouterOS returns either the whole object (``.id``) or the result
+        of the ``add`` command (``ret``) depending on the API used.
+        """
+
+        if isinstance(result, dict):
+            return result.get(".id") or result.get("ret")
+        return None
+
+    @staticmethod
+    def is_missing_item_error(error: Optional[str]) -> bool:
+        """Whether ``error`` means the referenced ``.id`` no longer exists."""
+
+        if not error:
+            return False
+        error = error.lower()
+        return "404" in error or "no such item" in error
 
     @staticmethod
     def get_pppoe_secret_by_id(router: Router, secret_id: str) -> Tuple[Optional[Any], Optional[str]]:
@@ -222,9 +575,34 @@ class MikroTikService:
     # Firewall operations
     # ------------------------------------------------------------------
     @staticmethod
-    def get_firewall_rules(router: Router) -> Tuple[Optional[Any], Optional[str]]:
-        """Return the configured firewall rules of the router."""
-        return MikroTikService._request(router, "ip/firewall/filter")
+    def get_firewall_rules(router: Router, query: Optional[Dict[str, str]] = None,
+                           proplist: Optional[Sequence[str]] = None) -> Tuple[Optional[Any], Optional[str]]:
+        """Return the configured firewall rules of the router.
+
+        ``query`` and ``proplist`` restrict the rows and fields returned,
+        see :meth:`_request`.
+        """
+        return MikroTikService._request(router, "ip/firewall/filter", query, proplist)
+
+    @staticmethod
+    def stream_firewall_rules(router: Router):
+        """Context manager yielding ``(rules, error)`` with the rules as a generator, see :meth:`stream`."""
+        return MikroTikService.stream(router, "ip/firewall/filter")
+
+    @staticmethod
+    def find_firewall_rule(router: Router, src_address: str,
+                           proplist: Optional[Sequence[str]] = None) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Return the first firewall rule matching ``src_address`` or ``None``."""
+
+        data, error = MikroTikService.get_firewall_rules(router, {"src-address": src_address}, proplist)
+        if error:
+            return None, error
+        return (data[0] if data else None), None
+
+    @staticmethod
+    def get_firewall_rule_by_id(router: Router, rule_id: str) -> Tuple[Optional[Any], Optional[str]]:
+        """Return a specific firewall rule by ID."""
+        return MikroTikService._request_with_method(router, f"ip/firewall/filter/{rule_id}", 'GET')
 
     @staticmethod
     def add_firewall_rule(router: Router, rule_data: dict) -> Tuple[Optional[Any], Optional[str]]:
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from config.config import get_setting as _setting
+
+# Default freshness of each cached RouterOS endpoint, in seconds.  Each
+# one can be overridden with ``MIKROTIK_CACHE_TTL_<NAME>``.
+ENDPOINT_TTLS = {
+    'system/resource': ('MIKROTIK_CACHE_TTL_RESOURCES', 5),
+    'system/identity': ('MIKROTIK_CACHE_TTL_IDENTITY', 300),
+    'interface': ('MIKROTIK_CACHE_TTL_INTERFACES', 60),
+}
+
+
+class RouterReadCache:
+    """Process-wide read-through cache for RouterOS GET requests.
+
+    Entries are keyed by the router connection key (URI and credentials),
+    the endpoint and the query, expire after the endpoint TTL and are
+    evicted least-recently-used once ``MIKROTIK_CACHE_SIZE`` entries are
+    stored.  Any write to a router drops all of its entries and bumps the
+    router generation, so a read that was already in flight when the write
+    landed is returned to its caller but not stored.  Errors are never
+    cached.
+
+    Cached values are shared between callers and must be treated as
+    read-only.
+    """
+
+    _entries: 'OrderedDict[Tuple[Hashable, ...], Tuple[float, Any]]' = OrderedDict()
+    _lock = threading.Lock()
+    _counters: Dict[str, Dict[str, int]] = defaultdict(lambda: {'hits': 0, 'misses': 0})
+    _evictions = 0
+    _invalidations = 0
+    _generations: Dict[str, int] = defaultdict(int)
+
+    @staticmethod
+    def ttl(endpoint: str) -> float:
+        """Configured TTL of ``endpoint`` (0 means not cached)."""
+
+        setting = ENDPOINT_TTLS.get(endpoint.strip('/'))
+        if setting is None or not _setting('MIKROTIK_CACHE_ENABLED', True):
+            return 0
+        return _setting(*setting)
+
+    @staticmethod
+    def generation(uri: str) -> int:
+        """Number of invalidations of the router at ``uri`` so far."""
+
+        with RouterReadCache._lock:
+            return RouterReadCache._generations[uri]
+
+    @staticmethod
+    def get(key: Tuple[Hashable, ...], endpoint: str,
+            loader: Callable[[], Tuple[Optional[Any], Optional[str]]],
+            max_age: Optional[float] = None) -> Tuple[Optional[Any], Optional[str]]:
+        """Return the cached ``(data, error)`` for ``key`` or call ``loader``.
+
+        ``max_age`` overrides the endpoint TTL; ``0`` bypasses the cache
+        (the fresh result still replaces the stored one).
+        """
+
+        ttl = RouterReadCache.ttl(endpoint) if max_age is None else max_age
+        now = time.monotonic()
+        cache = RouterReadCache
+
+        if ttl > 0:
+            with cache._lock:
+                entry = cache._entries.get(key)
+                if entry is not None and now - entry[0] <= ttl:
+                    cache._entries.move_to_end(key)
+                    cache._counters[endpoint]['hits'] += 1
+                    return entry[1], None
+                cache._counters[endpoint]['misses'] += 1
+
+        uri = key[0][0]
+        generation = RouterReadCache.generation(uri)
+        data, error = loader()
+        if error is None and RouterReadCache.ttl(endpoint) > 0:
+            with cache._lock:
+                if cache._generations[uri] != generation:
+                    # A write invalidated the router while we were reading
+                    return data, error
+                cache._entries[key] = (time.monotonic(), data)
+                cache._entries.move_to_end(key)
+                while len(cache._entries) > _setting('MIKROTIK_CACHE_SIZE', 1024):
+                    cache._entries.popitem(last=False)
+                    cache._evictions += 1
+        return data, error
+
+    @staticmethod
+    def invalidate(uri: str) -> int:
+        """Drop every entry of the router at ``uri``; returns how many were removed."""
+
+        cache = RouterReadCache
+        with cache._lock:
+            cache._generations[uri] += 1
+            keys = [key for key in cache._entries if key[0][0] == uri]
+            for key in keys:
+                del cache._entries[key]
+            if keys:
+                cache._invalidations += 1
+        return len(keys)
+
+    @staticmethod
+    def clear() -> None:
+        cache = RouterReadCache
+        with cache._lock:
+            cache._entries.clear()
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        """Hit/miss counters per endpoint plus size, evictions and invalidations."""
+
+        cache = RouterReadCache
+        with cache._lock:
+            endpoints = {endpoint: dict(counts) for endpoint, counts in cache._counters.items()}
+            hits = sum(counts['hits'] for counts in endpoints.values())
+            misses = sum(counts['misses'] for counts in endpoints.values())
+            return {
+                'enabled': bool(_setting('MIKROTIK_CACHE_ENABLED', True)),
+                'size': len(cache._entries),
+                'max_size': _setting('MIKROTIK_CACHE_SIZE', 1024),
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+                'evictions': cache._evictions,
+                'invalidations': cache._invalidations,
+                'ttls': {endpoint: RouterReadCache.ttl(endpoint) for endpoint in ENDPOINT_TTLS},
+                'endpoints': endpoints,
+            }
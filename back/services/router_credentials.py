@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config.config import get_setting as _setting
+from services.encryption_service import EncryptionService
+
+
+class RouterCredentials:
+    """Connection data of a router with its password decrypted.
+
+    This is what ``MikroTikService`` and the RouterOS transports receive
+    instead of the ``Router`` model.  ``session_key`` (URI, user and a
+    hash of the password) identifies the HTTP session, read cache and
+    single-flight entries of the credentials; it is computed once here
+    instead of on every request.
+    """
+
+    __slots__ = ('id', 'uri', 'username', 'password', 'api_transport', 'session_key')
+
+    def __init__(self, uri: str, username: str, password: str, api_transport: str = 'rest',
+                 id: Optional[int] = None) -> None:
+        self.id = id
+        self.uri = uri
+        self.username = username
+        self.password = password
+        self.api_transport = api_transport or 'rest'
+        self.session_key = (uri, username, hashlib.sha256((password or '').encode()).hexdigest())
+
+    def __repr__(self) -> str:
+        return f"RouterCredentials(id={self.id!r}, uri={self.uri!r}, username={self.username!r})"
+
+    # ------------------------------------------------------------------
+    # Decrypted credentials cache
+    # ------------------------------------------------------------------
+    _entries: 'OrderedDict[Tuple[Any, Any], Tuple[float, Tuple[Any, ...], RouterCredentials]]' = OrderedDict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def for_router(router) -> RouterCredentials:
+        """Credentials of a ``Router`` row, decrypting its password at most once per TTL.
+
+        Entries are keyed by router id and ``updated_at``, kept for
+        ``ROUTER_CREDENTIALS_CACHE_TTL`` seconds and evicted
+        least-recently-used beyond ``ROUTER_CREDENTIALS_CACHE_SIZE``.  An
+        entry is only reused while the stored URI, user, encrypted password
+        and transport are unchanged.
+        """
+
+        source = (router.uri, router.username, router.password, router.api_transport)
+        ttl = _setting('ROUTER_CREDENTIALS_CACHE_TTL', 300)
+        if router.id is None or ttl <= 0:
+            return RouterCredentials._decrypt(router)
+
+        key = (router.id, router.updated_at)
+        now = time.monotonic()
+        cache = RouterCredentials
+        with cache._lock:
+            entry = cache._entries.get(key)
+            if entry is not None and entry[0] > now and entry[1] == source:
+                cache._entries.move_to_end(key)
+                return entry[2]
+
+        credentials = RouterCredentials._decrypt(router)
+        with cache._lock:
+            cache._entries[key] = (now + ttl, source, credentials)
+            cache._entries.move_to_end(key)
+            while len(cache._entries) > _setting('ROUTER_CREDENTIALS_CACHE_SIZE', 1024):
+                cache._entries.popitem(last=False)
+        return credentials
+
+    @staticmethod
+    def _decrypt(router) -> RouterCredentials:
+        return RouterCredentials(
+            router.uri,
+            router.username,
+            EncryptionService.decrypt_password(router.password),
+            router.api_transport,
+            router.id,
+        )
+
+    @staticmethod
+    def invalidate(router_id: Optional[int] = None) -> int:
+        """Forget the credentials of ``router_id`` (or of every router)."""
+
+        cache = RouterCredentials
+        with cache._lock:
+            keys = [key for key in cache._entries if router_id is None or key[0] == router_id]
+            for key in keys:
+                del cache._entries[key]
+        return len(keys)
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        with RouterCredentials._lock:
+            return {
+                'size': len(RouterCredentials._entries),
+                'max_size': _setting('ROUTER_CREDENTIALS_CACHE_SIZE', 1024),
+                'ttl': _setting('ROUTER_CREDENTIALS_CACHE_TTL', 300),
+            }
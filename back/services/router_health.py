@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from config.config import get_setting as _setting
+
+# Latency samples kept per router and endpoint
+LATENCY_SAMPLES = 50
+# Samples needed before the timeout adapts to the observed latency
+MIN_LATENCY_SAMPLES = 5
+
+
+def _endpoint_key(endpoint: str) -> str:
+    """Group ``ppp/secret/*1A`` with ``ppp/secret`` for latency statistics."""
+
+    return endpoint.strip('/').split('/*')[0]
+
+
+def _percentile(samples, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class _Circuit:
+    __slots__ = ('state', 'failures', 'opened_at', 'open_seconds', 'probe_started',
+                 'latencies', 'last_error', 'last_failure_at', 'last_success_at')
+
+    def __init__(self) -> None:
+        self.state = RouterHealth.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.open_seconds = 0.0
+        self.probe_started: Optional[float] = None
+        self.latencies: Dict[str, Deque[float]] = {}
+        self.last_error: Optional[str] = None
+        self.last_failure_at: Optional[float] = None
+        self.last_success_at: Optional[float] = None
+
+
+class RouterHealth:
+    """Per-router circuit breaker with latency-based timeouts.
+
+    Every request to a router goes through :meth:`admit` and reports its
+    outcome with :meth:`record` (or :meth:`abandon` if it was never sent).  After ``CIRCUIT_FAILURE_THRESHOLD``
+    consecutive network failures (connection refused, timeouts) the
+    circuit *opens* and callers fail immediately instead of waiting for
+    the timeout.  Once ``CIRCUIT_OPEN_SECONDS`` elapse the circuit is
+    *half-open*: a single probe request is let through; success closes it,
+    failure opens it again for twice as long (up to
+    ``CIRCUIT_MAX_OPEN_SECONDS``).
+
+    Errors reported by a reachable router (HTTP 4xx, API traps) are not
+    failures.  Timeouts follow the observed p95 latency of each endpoint
+    (see :meth:`timeout`).  State lives in the process and is shared by
+    all threads; circuits are keyed by router URI.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    _circuits: Dict[str, _Circuit] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _circuit(uri: str) -> _Circuit:
+        circuit = RouterHealth._circuits.get(uri)
+        if circuit is None:
+            circuit = RouterHealth._circuits[uri] = _Circuit()
+        return circuit
+
+    @staticmethod
+    def admit(uri: str) -> Optional[str]:
+        """Return ``None`` if a request to ``uri`` may proceed, else the error to report."""
+
+        now = time.monotonic()
+        with RouterHealth._lock:
+            circuit = RouterHealth._circuit(uri)
+            if circuit.state == RouterHealth.CLOSED:
+                return None
+
+            if circuit.state == RouterHealth.OPEN:
+                retry_in = circuit.opened_at + circuit.open_seconds - now
+                if retry_in > 0:
+                    return f"Router no disponible (circuito abierto, reintento en {retry_in:.0f}s): {circuit.last_error}"
+                circuit.state = RouterHealth.HALF_OPEN
+                circuit.probe_started = None
+
+            # Half-open: a single probe at a time; a probe that never
+            # reported back is replaced once its timeout has passed
+            probe_started = circuit.probe_started
+            if probe_started is not None and now - probe_started < _setting('MIKROTIK_TIMEOUT', 10) * 2:
+                return f"Router no disponible (verificando conexión): {circuit.last_error}"
+            circuit.probe_started = now
+            return None
+
+    @staticmethod
+    def record(uri: str, endpoint: str, ok: bool, latency: Optional[float] = None,
+               error: Optional[str] = None) -> None:
+        """Report the outcome of a request; ``ok`` is false only for network failures."""
+
+        now = time.monotonic()
+        with RouterHealth._lock:
+            circuit = RouterHealth._circuit(uri)
+            if ok:
+                circuit.state = RouterHealth.CLOSED
+                circuit.failures = 0
+                circuit.open_seconds = 0.0
+                circuit.probe_started = None
+                circuit.last_success_at = now
+                if latency is not None:
+                    key = _endpoint_key(endpoint)
+                    samples = circuit.latencies.get(key)
+                    if samples is None:
+                        samples = circuit.latencies[key] = deque(maxlen=LATENCY_SAMPLES)
+                    samples.append(latency)
+                return
+
+            circuit.failures += 1
+            circuit.last_error = error
+            circuit.last_failure_at = now
+            if circuit.state == RouterHealth.HALF_OPEN:
+                circuit.open_seconds = min(
+                    max(circuit.open_seconds, _setting('CIRCUIT_OPEN_SECONDS', 15)) * 2,
+                    _setting('CIRCUIT_MAX_OPEN_SECONDS', 300),
+                )
+            elif circuit.state == RouterHealth.CLOSED and circuit.failures >= _setting('CIRCUIT_FAILURE_THRESHOLD', 3):
+                circuit.open_seconds = _setting('CIRCUIT_OPEN_SECONDS', 15)
+            else:
+                return
+            circuit.state = RouterHealth.OPEN
+            circuit.opened_at = now
+            circuit.probe_started = None
+
+    @staticmethod
+    def abandon(uri: str) -> None:
+        """Give back the half-open probe of a request that never reached the router."""
+
+        with RouterHealth._lock:
+            circuit = RouterHealth._circuits.get(uri)
+            if circuit is not None and circuit.state == RouterHealth.HALF_OPEN:
+                circuit.probe_started = None
+
+    @staticmethod
+    def timeout(uri: str, endpoint: str) -> float:
+        """Timeout for a request: ``MIKROTIK_TIMEOUT_FACTOR`` x the endpoint's p95 latency.
+
+        Clamped between ``MIKROTIK_TIMEOUT_MIN`` and ``MIKROTIK_TIMEOUT``;
+        until enough samples exist (and while probing a half-open
+        circuit) the full ``MIKROTIK_TIMEOUT`` is used.
+        """
+
+        maximum = _setting('MIKROTIK_TIMEOUT', 10)
+        with RouterHealth._lock:
+            circuit = RouterHealth._circuits.get(uri)
+            if circuit is None or circuit.state != RouterHealth.CLOSED:
+                return maximum
+            samples = circuit.latencies.get(_endpoint_key(endpoint))
+            if not samples or len(samples) < MIN_LATENCY_SAMPLES:
+                return maximum
+            p95 = _percentile(samples, 0.95)
+        adaptive = p95 * _setting('MIKROTIK_TIMEOUT_FACTOR', 4)
+        return min(maximum, max(_setting('MIKROTIK_TIMEOUT_MIN', 2), adaptive))
+
+    @staticmethod
+    def is_open(uri: str) -> bool:
+        """Whether requests to ``uri`` are currently being rejected."""
+
+        with RouterHealth._lock:
+            circuit = RouterHealth._circuits.get(uri)
+            return bool(circuit and circuit.state == RouterHealth.OPEN
+                        and time.monotonic() < circuit.opened_at + circuit.open_seconds)
+
+    @staticmethod
+    def snapshot(uri: str) -> Dict[str, Any]:
+        """Circuit state, failure count and latency percentiles of ``uri``."""
+
+        now = time.monotonic()
+        with RouterHealth._lock:
+            circuit = RouterHealth._circuits.get(uri)
+            if circuit is None:
+                return {'state': RouterHealth.CLOSED, 'failures': 0, 'retry_in': None,
+                        'last_error': None, 'latency_ms': {}}
+            retry_in = None
+            if circuit.state == RouterHealth.OPEN:
+                retry_in = round(max(0.0, circuit.opened_at + circuit.open_seconds - now), 1)
+            latency = {
+                endpoint: {
+                    'p50': round(_percentile(samples, 0.5) * 1000, 1),
+                    'p95': round(_percentile(samples, 0.95) * 1000, 1),
+                    'samples': len(samples),
+                }
+                for endpoint, samples in circuit.latencies.items() if samples
+            }
+            return {
+                'state': circuit.state,
+                'failures': circuit.failures,
+                'retry_in': retry_in,
+                'last_error': circuit.last_error,
+                'last_failure_seconds_ago': (
+                    round(now - circuit.last_failure_at, 1) if circuit.last_failure_at else None
+                ),
+                'latency_ms': latency,
+            }
+
+    @staticmethod
+    def reset(uri: Optional[str] = None) -> None:
+        """Forget the state of ``uri`` (or of every router), e.g. after editing it."""
+
+        with RouterHealth._lock:
+            if uri is None:
+                RouterHealth._circuits.clear()
+            else:
+                RouterHealth._circuits.pop(uri, None)
@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from config.config import get_setting as _setting
+
+# Priority classes, most urgent first
+WRITE = 0
+READ = 1
+BACKGROUND = 2
+
+PRIORITY_NAMES = {WRITE: 'write', READ: 'read', BACKGROUND: 'background'}
+
+# Longest wait in the queue of each class, in seconds
+QUEUE_WAIT = {
+    WRITE: ('ROUTER_QUEUE_WAIT_WRITE', 10),
+    READ: ('ROUTER_QUEUE_WAIT_READ', 5),
+    BACKGROUND: ('ROUTER_QUEUE_WAIT_BACKGROUND', 120),
+}
+
+# Weight of the last request in the service time average
+SERVICE_TIME_WEIGHT = 0.2
+
+
+class _Waiter:
+    __slots__ = ('deadline', 'granted', 'cancelled', 'event')
+
+    def __init__(self, deadline: float) -> None:
+        self.deadline = deadline
+        self.granted = False
+        self.cancelled = False
+        self.event = threading.Event()
+
+
+class _RouterQueue:
+    __slots__ = ('running', 'background', 'waiters', 'service_time', 'admitted', 'rejected')
+
+    def __init__(self) -> None:
+        self.running = 0
+        self.background = 0
+        # (priority, arrival, waiter): FIFO within a class
+        self.waiters: List[Any] = []
+        self.service_time = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self.admitted = {priority: 0 for priority in PRIORITY_NAMES}
+        self.rejected = {priority: 0 for priority in PRIORITY_NAMES}
+
+
+class RouterScheduler:
+    """Per-router concurrency limit with priority queueing.
+
+    RouterOS only serves a few concurrent REST/API sessions, so at most
+    ``ROUTER_MAX_CONCURRENT`` requests run against a router at once and
+    background work (synchronisations, the session collector) may hold
+    only ``ROUTER_MAX_BACKGROUND`` of those slots: an operator's request
+    never waits behind a long ``/ppp/secret`` download.  Waiting requests
+    are served writes first, then interactive reads, then background
+    reads, FIFO within a class.
+
+    Each class may wait at most ``ROUTER_QUEUE_WAIT_<CLASS>`` seconds.  A
+    request whose estimated wait (the requests queued ahead of it times
+    the average service time of its class) already exceeds that deadline
+    is rejected on arrival instead of timing out in the queue.
+
+    Requests are interactive unless issued inside :meth:`background`.
+    State lives in the process; queues are keyed by router URI.
+    """
+
+    _queues: Dict[str, _RouterQueue] = {}
+    _lock = threading.Lock()
+    _arrivals = itertools.count()
+    _local = threading.local()
+
+    @staticmethod
+    @contextmanager
+    def background() -> Iterator[None]:
+        """Run the router requests of the current thread as background work."""
+
+        previous = getattr(RouterScheduler._local, 'priority', READ)
+        RouterScheduler._local.priority = BACKGROUND
+        try:
+            yield
+        finally:
+            RouterScheduler._local.priority = previous
+
+    @staticmethod
+    def priority(method: str) -> int:
+        """Class of a request of the current thread."""
+
+        if method != 'GET':
+            return WRITE
+        return getattr(RouterScheduler._local, 'priority', READ)
+
+    @staticmethod
+    def _queue(uri: str) -> _RouterQueue:
+        queue = RouterScheduler._queues.get(uri)
+        if queue is None:
+            queue = RouterScheduler._queues[uri] = _RouterQueue()
+        return queue
+
+    @staticmethod
+    def _can_run(queue: _RouterQueue, priority: int) -> bool:
+        if queue.running >= _setting('ROUTER_MAX_CONCURRENT', 3):
+            return False
+        return priority != BACKGROUND or queue.background < _setting('ROUTER_MAX_BACKGROUND', 1)
+
+    @staticmethod
+    def _start(queue: _RouterQueue, priority: int) -> None:
+        queue.running += 1
+        if priority == BACKGROUND:
+            queue.background += 1
+        queue.admitted[priority] += 1
+
+    @staticmethod
+    def _estimated_wait(queue: _RouterQueue, priority: int) -> float:
+        ahead = sum(1 for waiter_priority, _, waiter in queue.waiters
+                    if waiter_priority <= priority and not waiter.cancelled)
+        slots = _setting('ROUTER_MAX_CONCURRENT', 3)
+        if priority == BACKGROUND:
+            slots = min(slots, _setting('ROUTER_MAX_BACKGROUND', 1))
+        return (ahead // max(slots, 1) + 1) * queue.service_time[priority]
+
+    @staticmethod
+    def acquire(uri: str, priority: int) -> Optional[str]:
+        """Wait for a slot on ``uri``; returns ``None`` once admitted, else the error to report.
+
+        Every admitted request must call :meth:`release`.
+        """
+
+        now = time.monotonic()
+        wait = _setting(*QUEUE_WAIT[priority])
+        with RouterScheduler._lock:
+            queue = RouterScheduler._queue(uri)
+            ahead = any(waiter_priority <= priority and not waiter.cancelled
+                        for waiter_priority, _, waiter in queue.waiters)
+            if not ahead and RouterScheduler._can_run(queue, priority):
+                RouterScheduler._start(queue, priority)
+                return None
+
+            estimate = RouterScheduler._estimated_wait(queue, priority)
+            if estimate > wait:
+                queue.rejected[priority] += 1
+                return f"Router ocupado: espera estimada de {estimate:.1f}s (máximo {wait}s)"
+
+            waiter = _Waiter(now + wait)
+            heapq.heappush(queue.waiters, (priority, next(RouterScheduler._arrivals), waiter))
+            RouterScheduler._wake(queue)
+            if waiter.granted:
+                return None
+
+        if waiter.event.wait(wait):
+            return None
+
+        with RouterScheduler._lock:
+            if waiter.granted:
+                # Admitted right as the wait expired
+                return None
+            waiter.cancelled = True
+            queue.rejected[priority] += 1
+            RouterScheduler._wake(queue)
+        return f"Router ocupado: sin turno tras esperar {wait}s"
+
+    @staticmethod
+    def release(uri: str, priority: int, elapsed: Optional[float] = None) -> None:
+        """Free the slot of a finished request and admit the next waiters.
+
+        ``elapsed`` is ``None`` for a request that was never sent (e.g.
+        rejected by the circuit breaker); it does not count towards the
+        service time.
+        """
+
+        with RouterScheduler._lock:
+            queue = RouterScheduler._queue(uri)
+            queue.running -= 1
+            if priority == BACKGROUND:
+                queue.background -= 1
+            if elapsed is not None:
+                average = queue.service_time[priority]
+                queue.service_time[priority] = (
+                    elapsed if not average else average + SERVICE_TIME_WEIGHT * (elapsed - average)
+                )
+            RouterScheduler._wake(queue)
+
+    @staticmethod
+    def _wake(queue: _RouterQueue) -> None:
+        """Admit waiters in priority order while slots are free (lock held)."""
+
+        now = time.monotonic()
+        while queue.waiters:
+            priority, _, waiter = queue.waiters[0]
+            if waiter.cancelled or waiter.deadline < now:
+                # Gave up (or is about to): its own wait reports the error
+                heapq.heappop(queue.waiters)
+                continue
+            if not RouterScheduler._can_run(queue, priority):
+                # No slot for the most urgent waiter; the rest rank below it
+                break
+            heapq.heappop(queue.waiters)
+            RouterScheduler._start(queue, priority)
+            waiter.granted = True
+            waiter.event.set()
+
+    @staticmethod
+    def snapshot(uri: str) -> Dict[str, Any]:
+        """Running and queued requests, service times and counters of ``uri``."""
+
+        with RouterScheduler._lock:
+            queue = RouterScheduler._queues.get(uri) or _RouterQueue()
+            queued = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _, waiter in queue.waiters:
+                if not waiter.cancelled:
+                    queued[PRIORITY_NAMES[priority]] += 1
+            return {
+                'running': queue.running,
+                'running_background': queue.background,
+                'max_concurrent': _setting('ROUTER_MAX_CONCURRENT', 3),
+                'max_background': _setting('ROUTER_MAX_BACKGROUND', 1),
+                'queued': queued,
+                'service_time_ms': {
+                    name: round(queue.service_time[priority] * 1000, 1)
+                    for priority, name in PRIORITY_NAMES.items()
+                },
+                'admitted': {name: queue.admitted[priority] for priority, name in PRIORITY_NAMES.items()},
+                'rejected': {name: queue.rejected[priority] for priority, name in PRIORITY_NAMES.items()},
+            }
@@ -0,0 +1,388 @@
+from __future__ import annotations
+
+import hashlib
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import librouteros
+from librouteros.api import Api
+from librouteros.exceptions import MultiTrapError, TrapError
+from librouteros.query import Key
+
+from services.router_health import RouterHealth
+
+
+class PoolExhausted(TimeoutError):
+    """Every pooled connection of the router stayed busy for the whole timeout"""
+
+
+class _ApiPool:
+    """Small pool of authenticated RouterOS API connections.
+
+    The binary API protocol is strictly request/response, so a single
+    connection can only run one command at a time.  The pool keeps up to
+    ``size`` long-lived connections per router and hands them out to one
+    thread at a time.
+    """
+
+    def __init__(self, connect, size: int):
+        self._connect = connect
+        self._idle: List[Any] = []
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self, timeout: float) -> Tuple[Any, bool]:
+        """Return ``(api, reused)``, opening a new connection if needed."""
+
+        if not self._slots.acquire(timeout=timeout):
+            raise PoolExhausted("No hay conexiones API disponibles para el router")
+
+        with self._lock:
+            api = self._idle.pop() if self._idle else None
+        if api is not None:
+            return api, True
+
+        try:
+            return self._connect(), False
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, api: Any, broken: bool = False) -> None:
+        with self._lock:
+            keep = not broken and not self._closed
+            if keep:
+                self._idle.append(api)
+        if not keep:
+            _close_quietly(api)
+        self._slots.release()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for api in idle:
+            _close_quietly(api)
+
+
+def _close_quietly(api: Any) -> None:
+    try:
+        api.close()
+    except Exception:  # pragma: no cover - socket already gone
+        pass
+
+
+def _split_word(word: str) -> Tuple[str, str]:
+    """Split an attribute word (``'=name=00123'``) into key and raw value."""
+
+    _, key, value = word.split("=", 2)
+    return key, value
+
+
+class _RawApi(Api):
+    """``Api`` that keeps attribute values as the strings sent by the router.
+
+    librouteros casts values with ``int()`` and maps ``yes``/``no``, which
+    turns ``'00123'`` into ``123`` and ``'yes'`` into ``True`` in names,
+    passwords and comments.  The REST API always returns the raw strings,
+    so reading them unchanged keeps both transports identical.
+    """
+
+    def readSentence(self) -> Tuple[str, Dict[str, Any]]:
+        reply_word, words = self.protocol.readSentence()
+        attributes: Dict[str, Any] = dict(_split_word(word) for word in words)
+        if reply_word == "!trap" and str(attributes.get("category", "")).isdigit():
+            # TrapError documents the category as an integer
+            attributes["category"] = int(attributes["category"])
+        return reply_word, attributes
+
+
+class RouterOSApiTransport:
+    """RouterOS binary API (ports 8728/8729) backend for ``MikroTikService``.
+
+    Requests are expressed with the same endpoint/method vocabulary used by
+    the REST transport (``'ppp/secret'``, ``'ppp/secret/*1A'``, ``'POST'``...)
+    and translated to API commands, so every ``MikroTikService`` helper
+    works unchanged on either transport.
+    """
+
+    TRANSPORTS = ("api", "api-ssl")
+
+    _pools: Dict[Tuple[str, int, str, str], _ApiPool] = {}
+    _pools_lock = threading.Lock()
+    _ssl_context: Optional[ssl.SSLContext] = None
+    # Own lock: _get_pool builds the context while holding _pools_lock
+    _ssl_lock = threading.Lock()
+
+    @staticmethod
+    def _host(uri: str) -> str:
+        """Host part of a router URI: ``host``, ``host:port`` or ``[v6]:port``."""
+
+        host = uri.split("/")[0]
+        if host.startswith("["):
+            return host[1:host.index("]")]
+        if host.count(":") == 1:
+            return host.split(":")[0]
+        return host
+
+    @staticmethod
+    def _address(router: Any, settings) -> Tuple[str, int]:
+        """Extract host and API port from the router URI.
+
+        The URI stores the REST address (optionally ``host:port``), so the
+        port is replaced by the API port of the selected transport.
+        """
+
+        host = RouterOSApiTransport._host(router.uri)
+        if router.api_transport == "api-ssl":
+            return host, settings("MIKROTIK_API_SSL_PORT", 8729)
+        return host, settings("MIKROTIK_API_PORT", 8728)
+
+    @staticmethod
+    def _get_ssl_context() -> ssl.SSLContext:
+        with RouterOSApiTransport._ssl_lock:
+            if RouterOSApiTransport._ssl_context is None:
+                context = ssl.create_default_context()
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+                RouterOSApiTransport._ssl_context = context
+            return RouterOSApiTransport._ssl_context
+
+    @staticmethod
+    def _connect_kwargs(router: Any, settings, host: str, port: int,
+                        timeout: Optional[float] = None) -> Dict[str, Any]:
+        kwargs = {
+            "port": port,
+            "timeout": timeout if timeout is not None else settings("MIKROTIK_TIMEOUT", 10),
+            "encoding": settings("MIKROTIK_API_ENCODING", "utf-8"),
+            "subclass": _RawApi,
+        }
+        if router.api_transport == "api-ssl":
+            context = RouterOSApiTransport._get_ssl_context()
+            kwargs["ssl_wrapper"] = lambda sock: context.wrap_socket(sock, server_hostname=host)
+        return kwargs
+
+    @staticmethod
+    def connect(router: Any, settings, timeout: Optional[float] = None) -> Any:
+        """Open a dedicated (unpooled) API connection to ``router``.
+
+        Meant for long-running commands such as ``listen`` that would
+        otherwise hold a pooled connection forever.
+        """
+
+        host, port = RouterOSApiTransport._address(router, settings)
+        kwargs = RouterOSApiTransport._connect_kwargs(router, settings, host, port, timeout)
+        return librouteros.connect(host, router.username, router.password, **kwargs)
+
+    @staticmethod
+    def _get_pool(router: Any, settings) -> _ApiPool:
+        host, port = RouterOSApiTransport._address(router, settings)
+        password_hash = hashlib.sha256((router.password or "").encode()).hexdigest()
+        key = (host, port, router.username, password_hash)
+
+        with RouterOSApiTransport._pools_lock:
+            pool = RouterOSApiTransport._pools.get(key)
+            if pool is None:
+                kwargs = RouterOSApiTransport._connect_kwargs(router, settings, host, port)
+                username, password = router.username, router.password
+                pool = _ApiPool(
+                    lambda: librouteros.connect(host, username, password, **kwargs),
+                    settings("MIKROTIK_POOL_SIZE", 4),
+                )
+                RouterOSApiTransport._pools[key] = pool
+            return pool
+
+    @staticmethod
+    def invalidate(uri: str) -> int:
+        """Close every pooled API connection of the router at ``uri``."""
+
+        host = RouterOSApiTransport._host(uri)
+        with RouterOSApiTransport._pools_lock:
+            keys = [key for key in RouterOSApiTransport._pools if key[0] == host]
+            pools = [RouterOSApiTransport._pools.pop(key) for key in keys]
+        for pool in pools:
+            pool.close()
+        return len(pools)
+
+    @staticmethod
+    def _split_endpoint(endpoint: str) -> Tuple[List[str], Optional[str]]:
+        """Split ``'ppp/secret/*1A'`` into ``(['ppp', 'secret'], '*1A')``."""
+
+        parts = [part for part in endpoint.strip("/").split("/") if part]
+        if parts and parts[-1].startswith("*"):
+            return parts[:-1], parts[-1]
+        return parts, None
+
+    @staticmethod
+    def _execute(api: Any, endpoint: str, method: str, data: Optional[dict],
+                 query: Optional[Dict[str, str]] = None, proplist: Optional[Sequence[str]] = None) -> Any:
+        parts, item_id = RouterOSApiTransport._split_endpoint(endpoint)
+        path = api.path(*parts)
+
+        if method == "GET":
+            if item_id is None:
+                if query or proplist:
+                    # Conditions left on the query stack are ANDed by RouterOS
+                    rows = path.select(*(Key(name) for name in proplist or ())).where(
+                        *(Key(name) == value for name, value in (query or {}).items())
+                    )
+                else:
+                    rows = path
+                rows = list(rows)
+                # Singleton menus (e.g. system/resource) return one object
+                if parts in (["system", "resource"], ["system", "identity"]):
+                    return rows[0] if rows else {}
+                return rows
+            rows = list(path.select().where(Key(".id") == item_id))
+            if not rows:
+                raise TrapError(message="no such item")
+            return rows[0]
+
+        if method == "POST":
+            new_id = path.add(**(data or {}))
+            return {"ret": new_id}
+
+        if method == "PUT":
+            path.update(**{".id": item_id, **(data or {})})
+            return {".id": item_id, **(data or {})}
+
+        if method == "DELETE":
+            path.remove(item_id)
+            return {"success": True}
+
+        raise ValueError(f"Unsupported HTTP method: {method}")
+
+    @staticmethod
+    def _set_timeout(api: Any, timeout: Optional[float]) -> None:
+        """Apply ``timeout`` to the socket of a pooled connection."""
+
+        sock = getattr(getattr(getattr(api, "protocol", None), "transport", None), "sock", None)
+        if timeout is not None and sock is not None:
+            sock.settimeout(timeout)
+
+    @staticmethod
+    def request(router: Any, endpoint: str, method: str, data: Optional[dict], settings,
+                query: Optional[Dict[str, str]] = None,
+                proplist: Optional[Sequence[str]] = None,
+                timeout: Optional[float] = None) -> Tuple[Optional[Any], Optional[str]]:
+        """Run a request over the binary API.
+
+        ``settings`` is the configuration reader of ``MikroTikService``;
+        ``query`` and ``proplist`` are translated to API query words and
+        ``timeout`` overrides ``MIKROTIK_TIMEOUT`` for this request.
+        Returns the same ``(data, error)`` tuple as the REST transport.  A
+        read that fails on a reused (possibly stale) connection is retried
+        once on a fresh one; writes are never retried.  Outcomes are
+        reported to :class:`RouterHealth`.
+        """
+
+        pool = RouterOSApiTransport._get_pool(router, settings)
+        attempts = 2 if method == "GET" else 1
+        if timeout is None:
+            timeout = settings("MIKROTIK_TIMEOUT", 10)
+
+        for attempt in range(attempts):
+            try:
+                api, reused = pool.acquire(settings("MIKROTIK_TIMEOUT", 10))
+            except PoolExhausted as exc:
+                # Local contention, not a router failure
+                RouterHealth.abandon(router.uri)
+                return None, str(exc)
+            except Exception as exc:  # pragma: no cover - network failures
+                RouterHealth.record(router.uri, endpoint, False, error=str(exc))
+                return None, str(exc)
+
+            start = time.monotonic()
+            try:
+                RouterOSApiTransport._set_timeout(api, timeout)
+                result = RouterOSApiTransport._execute(api, endpoint, method, data, query, proplist)
+            except (TrapError, MultiTrapError) as exc:
+                # The router answered: the connection is still usable
+                pool.release(api)
+                RouterHealth.record(router.uri, endpoint, True)
+                return None, str(exc)
+            except Exception as exc:  # pragma: no cover - network failures
+                pool.release(api, broken=True)
+                if reused and attempt + 1 < attempts:
+                    continue
+                RouterHealth.record(router.uri, endpoint, False, error=str(exc))
+                return None, str(exc)
+
+            pool.release(api)
+            RouterHealth.record(router.uri, endpoint, True, time.monotonic() - start)
+            return result, None
+
+        return None, "No se pudo completar la solicitud"  # pragma: no cover
+
+    @staticmethod
+    @contextmanager
+    def stream(router: Any, endpoint: str, settings, proplist: Optional[Sequence[str]] = None,
+               timeout: Optional[float] = None) -> Iterator[Tuple[Optional[Iterator[Dict[str, Any]]], Optional[str]]]:
+        """Print a whole menu yielding ``(records, error)``, ``records`` being a generator.
+
+        ``librouteros`` reads every reply before returning the first one,
+        so the sentences are read here one at a time.  The connection stays
+        borrowed until the block exits; one left with unread replies is
+        closed instead of going back to the pool.  A trap or a network
+        error while reading is raised from the generator.
+        """
+
+        pool = RouterOSApiTransport._get_pool(router, settings)
+        try:
+            api, _ = pool.acquire(settings("MIKROTIK_TIMEOUT", 10))
+        except PoolExhausted as exc:
+            RouterHealth.abandon(router.uri)
+            yield None, str(exc)
+            return
+        except Exception as exc:  # pragma: no cover - network failures
+            RouterHealth.record(router.uri, endpoint, False, error=str(exc))
+            yield None, str(exc)
+            return
+
+        parts, _ = RouterOSApiTransport._split_endpoint(endpoint)
+        words = [f"=.proplist={','.join(proplist)}"] if proplist else []
+        finished = False
+        start = time.monotonic()
+
+        def records() -> Iterator[Dict[str, Any]]:
+            nonlocal finished
+            traps = []
+            first = True
+            while True:
+                try:
+                    reply, attributes = api.readSentence()
+                except Exception as exc:
+                    RouterHealth.record(router.uri, endpoint, False, error=str(exc))
+                    raise
+                if first:
+                    RouterHealth.record(router.uri, endpoint, True, time.monotonic() - start)
+                    first = False
+                if reply == "!re":
+                    yield attributes
+                elif reply == "!trap":
+                    traps.append(TrapError(**attributes))
+                elif reply == "!done":
+                    break
+            finished = True
+            if len(traps) > 1:
+                raise MultiTrapError(*traps)
+            if traps:
+                raise traps[0]
+
+        try:
+            RouterOSApiTransport._set_timeout(api, timeout or settings("MIKROTIK_TIMEOUT", 10))
+            api.protocol.writeSentence(f"/{'/'.join(parts)}/print", *words)
+        except Exception as exc:  # pragma: no cover - network failures
+            pool.release(api, broken=True)
+            RouterHealth.record(router.uri, endpoint, False, error=str(exc))
+            yield None, str(exc)
+            return
+
+        try:
+            yield records(), None
+        finally:
+            pool.release(api, broken=not finished)
@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime
+from functools import partial
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from flask import current_app
+
+from config.config import get_setting
+from models import db
+from models.pppoe_session import ActiveSession, SessionEvent
+from models.router import Router, RouterSyncState
+from services.bulk_loader import BulkLoader
+from services.fanout_service import FanOutService, FanOutResult
+from services.interface_index import INTERFACE_PROPLIST, ZERO_COUNTERS, InterfaceIndex
+from services.mikrotik_service import MikroTikService
+from services.router_credentials import RouterCredentials
+from services.router_scheduler import RouterScheduler
+from services.session_listener import SessionListenerService
+
+
+class SessionCollectorService:
+    """Snapshot PPPoE active sessions and interface counters into the DB.
+
+    A background thread (or the ``collect_sessions_task`` Celery task)
+    polls every active router once per ``SESSION_COLLECT_INTERVAL``
+    seconds and replaces that router's rows in ``pppoe_active_sessions``.
+    Endpoints read the snapshot, so router load does not depend on how
+    many operators are watching.  Comparing consecutive snapshots also
+    records connect/disconnect events for routers that have no
+    :class:`SessionListenerService` listener.  Routers are claimed through
+    ``RouterSyncState.claim``, so several app processes still poll each
+    router only once per interval.
+    """
+
+    _thread: Optional[threading.Thread] = None
+    _thread_lock = threading.Lock()
+
+    @staticmethod
+    def fetch_sessions(temp_router, sessions: Optional[list] = None) -> Tuple[Optional[Tuple[list, list]], Optional[str]]:
+        """Active sessions and interfaces of one router (runs in the fan-out pool).
+
+        ``sessions`` skips the ``/ppp/active`` request when they are
+        already known (see :class:`SessionListenerService`).
+        """
+
+        with RouterScheduler.background():
+            if sessions is not None:
+                data, error = sessions, None
+            else:
+                data, error = MikroTikService.get_pppoe_active(temp_router)
+            if error:
+                return None, error
+            if not data:
+                return ([], []), None
+
+            # Live counters: the telemetry cache would return traffic totals up to a minute old
+            interfaces, _ = MikroTikService.get_interfaces(temp_router, INTERFACE_PROPLIST, max_age=0)
+        return (data, interfaces or []), None
+
+    @staticmethod
+    def build_rows(router_id: int, sessions: List[Dict[str, Any]], interfaces: List[Dict[str, Any]],
+                   collected_at: datetime) -> List[Dict[str, Any]]:
+        """Join sessions with their interface counters into ``ActiveSession`` rows."""
+
+        index = InterfaceIndex(interfaces)
+        rows = []
+        for s in sessions:
+            username = s.get('name', '')
+            counters = index.lookup(username)
+            rx_bytes, tx_bytes, rx_packets, tx_packets = counters or ZERO_COUNTERS
+
+            rows.append({
+                'router_id': router_id,
+                'mikrotik_id': s.get('.id') or s.get('id'),
+                'name': username,
+                'address': s.get('address', ''),
+                'uptime': s.get('uptime', ''),
+                'caller_id': s.get('caller-id'),
+                'called_id': s.get('called-id'),
+                'rx_bytes': rx_bytes,
+                'tx_bytes': tx_bytes,
+                'rx_packets': rx_packets,
+                'tx_packets': tx_packets,
+                'interface_found': counters is not None,
+                'collected_at': collected_at,
+            })
+        return rows
+
+    @staticmethod
+    def _poll_events(router_id: int, rows: List[Dict[str, Any]], now: datetime) -> List[SessionEvent]:
+        """Connect/disconnect events between the stored snapshot and ``rows``."""
+
+        def key(mikrotik_id, name):
+            return mikrotik_id or name
+
+        previous = {
+            key(row.mikrotik_id, row.name): row
+            for row in ActiveSession.query.filter_by(router_id=router_id).all()
+        }
+        current = {key(row['mikrotik_id'], row['name']): row for row in rows}
+
+        events = [
+            SessionEvent(router_id=router_id, name=row['name'], event=SessionEvent.CONNECT,
+                         mikrotik_id=row['mikrotik_id'], address=row['address'],
+                         caller_id=row['caller_id'], uptime=row['uptime'],
+                         source='poll', occurred_at=now)
+            for session_key, row in current.items() if session_key not in previous
+        ]
+        events.extend(
+            SessionEvent(router_id=router_id, name=row.name, event=SessionEvent.DISCONNECT,
+                         mikrotik_id=row.mikrotik_id, address=row.address,
+                         caller_id=row.caller_id, uptime=row.uptime,
+                         source='poll', occurred_at=now)
+            for session_key, row in previous.items() if session_key not in current
+        )
+        return events
+
+    @staticmethod
+    def collect(force: bool = False, router_ids: Optional[Iterable[int]] = None) -> FanOutResult:
+        """Run one collection cycle over the active routers (needs an app context).
+
+        Routers polled by another process during the current interval are
+        skipped unless ``force`` is set.  ``router_ids`` limits the cycle to
+        those routers.  On error the previous snapshot of the router is
+        kept and the error is recorded in its sync state.
+        """
+
+        interval = get_setting('SESSION_COLLECT_INTERVAL', 30)
+        query = Router.query.filter_by(is_active=True)
+        if router_ids is not None:
+            query = query.filter(Router.id.in_(list(router_ids)))
+        routers = query.all()
+        # Some slack so a cycle that wakes up slightly early still claims
+        window = 0 if force else interval * 0.8
+        claimed = set(RouterSyncState.claim([r.id for r in routers], 'sessions_claimed_at', window))
+        targets = [r for r in routers if r.id in claimed]
+
+        fanout = FanOutService.run({
+            router.id: partial(SessionCollectorService.fetch_sessions,
+                               RouterCredentials.for_router(router),
+                               SessionListenerService.sessions(router.id))
+            for router in targets
+        })
+
+        # Los routers con listener ya registran sus eventos de conexión
+        listened = SessionListenerService.is_listened(claimed)
+        states = {
+            state.router_id: state for state in
+            RouterSyncState.query.filter(RouterSyncState.router_id.in_(list(claimed))).all()
+        }
+
+        now = datetime.utcnow()
+        for router in targets:
+            state = RouterSyncState.query.filter_by(router_id=router.id)
+            if router.id in fanout.results:
+                sessions, interfaces = fanout.results[router.id]
+                rows = SessionCollectorService.build_rows(router.id, sessions, interfaces, now)
+                previous = states.get(router.id)
+                if router.id not in listened and previous and previous.sessions_collected_at:
+                    db.session.add_all(SessionCollectorService._poll_events(router.id, rows, now))
+                ActiveSession.query.filter_by(router_id=router.id).delete()
+                BulkLoader.insert(ActiveSession, rows)
+                state.update({'sessions_collected_at': now, 'sessions_error': None},
+                             synchronize_session=False)
+            else:
+                state.update({'sessions_error': fanout.errors.get(router.id)},
+                             synchronize_session=False)
+            db.session.commit()
+        return fanout
+
+    @staticmethod
+    def _loop(app) -> None:
+        while True:
+            with app.app_context():
+                try:
+                    SessionCollectorService.collect()
+                except Exception:  # pragma: no cover - keep the collector alive
+                    db.session.rollback()
+                    app.logger.exception('Error capturando sesiones PPPoE')
+                finally:
+                    db.session.remove()
+                interval = get_setting('SESSION_COLLECT_INTERVAL', 30)
+            time.sleep(interval)
+
+    @staticmethod
+    def start(app) -> bool:
+        """Start the in-process collector thread once per process.
+
+        Disabled with ``SESSION_COLLECTOR_ENABLED=false`` (e.g. when the
+        Celery beat task does the collection).
+        """
+
+        if not app.config.get('SESSION_COLLECTOR_ENABLED', True):
+            return False
+        with SessionCollectorService._thread_lock:
+            thread = SessionCollectorService._thread
+            if thread is not None and thread.is_alive():
+                return False
+            thread = threading.Thread(
+                target=SessionCollectorService._loop, args=(app,),
+                name='pppoe-session-collector', daemon=True,
+            )
+            thread.start()
+            SessionCollectorService._thread = thread
+        return True
+
+    @staticmethod
+    def ensure_collected(router_ids: Iterable[int]) -> List[int]:
+        """Collect now the routers of ``router_ids`` that were never collected.
+
+        Covers processes where no collector runs (background services off
+        and no Celery beat): the first read polls the router instead of
+        serving an empty snapshot forever.  Claims still apply, so a router
+        that keeps failing is polled at most once per interval.  Returns
+        the ids that had no snapshot.
+        """
+
+        router_ids = list(router_ids)
+        collected = {
+            router_id for router_id, in db.session.query(RouterSyncState.router_id).filter(
+                RouterSyncState.router_id.in_(router_ids),
+                RouterSyncState.sessions_collected_at.isnot(None),
+            )
+        }
+        missing = [router_id for router_id in router_ids if router_id not in collected]
+        if missing:
+            fanout = SessionCollectorService.collect(router_ids=missing)
+            polled = sorted(set(fanout.results) | set(fanout.errors))
+            if polled:
+                current_app.logger.warning(
+                    'Sin captura de sesiones para los routers %s; consultados en vivo. '
+                    '¿Está activo el recolector (BACKGROUND_SERVICES_ENABLED o Celery beat)?', polled)
+        return missing
+
+    @staticmethod
+    def collection_status(router_ids: Iterable[int]) -> Tuple[Dict[str, Optional[float]], Dict[str, str]]:
+        """Return ``(data_age, errors)`` of the snapshots of ``router_ids``.
+
+        ``data_age`` is the seconds since the last successful collection
+        (``None`` if never) and ``errors`` the last error of each router
+        that failed.
+        """
+
+        router_ids = list(router_ids)
+        now = datetime.utcnow()
+        states = {
+            state.router_id: state for state in
+            RouterSyncState.query.filter(RouterSyncState.router_id.in_(router_ids)).all()
+        }
+        data_age, errors = {}, {}
+        for router_id in router_ids:
+            state = states.get(router_id)
+            collected_at = state.sessions_collected_at if state else None
+            data_age[str(router_id)] = (
+                round((now - collected_at).total_seconds(), 1) if collected_at else None
+            )
+            if state and state.sessions_error:
+                errors[str(router_id)] = state.sessions_error
+        return data_age, errors
+
+    @staticmethod
+    def active_addresses(router_ids: Iterable[int], names: Iterable[str]) -> Dict[Tuple[int, str], str]:
+        """Map ``(router_id, name)`` to the address of each connected session."""
+
+        rows = db.session.query(ActiveSession.router_id, ActiveSession.name, ActiveSession.address).filter(
+            ActiveSession.router_id.in_(list(router_ids)),
+            ActiveSession.name.in_(list(names)),
+        ).all()
+        return {(router_id, name): address for router_id, name, address in rows if address}
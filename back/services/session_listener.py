@@ -0,0 +1,361 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from config.config import get_setting
+from models import db
+from models.pppoe_session import ActiveSession, SessionEvent
+from models.router import Router, RouterSyncState
+from services.router_credentials import RouterCredentials
+from services.routeros_api_transport import RouterOSApiTransport, _close_quietly
+
+
+def _format_uptime(seconds: float) -> str:
+    """RouterOS style duration (``'1d2h3m4s'``)."""
+
+    seconds = int(seconds)
+    parts = []
+    for unit, size in (('w', 604800), ('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= size:
+            parts.append(f"{seconds // size}{unit}")
+            seconds %= size
+    parts.append(f"{seconds}s")
+    return ''.join(parts)
+
+
+class _RouterListener(threading.Thread):
+    """Follow ``/ppp/active/listen`` on one router until stopped.
+
+    Every (re)connection first prints the full table and reconciles it
+    with the known sessions, so events missed while disconnected are
+    still recorded.  The socket times out after
+    ``SESSION_LISTENER_IDLE_SECONDS`` without traffic, which also forces a
+    reconnection and resync.
+    """
+
+    def __init__(self, app, router_id: int, credentials, fingerprint: str):
+        super().__init__(name=f'pppoe-listener-{router_id}', daemon=True)
+        self.app = app
+        self.router_id = router_id
+        self.credentials = credentials
+        self.fingerprint = fingerprint
+        self.stopped = threading.Event()
+        self._api = None
+
+    def stop(self) -> None:
+        self.stopped.set()
+        api = self._api
+        if api is not None:
+            # Unblocks a pending read
+            _close_quietly(api)
+
+    def run(self) -> None:
+        backoff = 1
+        while not self.stopped.is_set():
+            try:
+                self._listen()
+                backoff = 1
+            except (socket.timeout, TimeoutError):
+                backoff = 1
+            except Exception as exc:
+                if self.stopped.is_set():
+                    break
+                self.app.logger.warning(f"Listener de sesiones del router {self.router_id}: {exc}")
+                backoff = min(backoff * 2, 60)
+            finally:
+                if self._api is not None:
+                    _close_quietly(self._api)
+                    self._api = None
+            self.stopped.wait(backoff)
+
+    def _listen(self) -> None:
+        idle = get_setting('SESSION_LISTENER_IDLE_SECONDS', 120)
+        self._api = api = RouterOSApiTransport.connect(self.credentials, get_setting, timeout=idle)
+
+        rows = list(api.path('ppp', 'active'))
+        SessionListenerService.reconcile(self.app, self.router_id, rows)
+
+        api.protocol.writeSentence('/ppp/active/listen')
+        while not self.stopped.is_set():
+            reply, words = api.readSentence()
+            if reply == '!re' and words:
+                SessionListenerService.apply_change(self.app, self.router_id, words)
+            elif reply == '!trap':
+                raise RuntimeError(words.get('message', 'listen trap'))
+            elif reply == '!done':
+                return
+
+
+class SessionListenerService:
+    """Event-driven PPPoE session tracking over the RouterOS API ``listen`` command.
+
+    Routers on the ``api``/``api-ssl`` transports get a dedicated
+    connection following ``/ppp/active/listen``.  The service keeps a
+    per-router map of the active sessions up to date and writes every
+    connect/disconnect to ``pppoe_session_events``.
+
+    Only one process listens to each router: a supervisor thread leases
+    routers through ``RouterSyncState.claim`` (``listener_owner`` /
+    ``listener_heartbeat_at``) and renews its leases every
+    ``SESSION_LISTENER_RESCAN`` seconds.  A lease not renewed for
+    ``SESSION_LISTENER_LEASE`` seconds is taken over by another process.
+    """
+
+    OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    # router_id -> {session .id -> session record (REST field names)}
+    _sessions: Dict[int, Dict[str, Dict[str, Any]]] = {}
+    _connected_at: Dict[tuple, float] = {}
+    _lock = threading.Lock()
+    _listeners: Dict[int, _RouterListener] = {}
+    _supervisor: Optional[threading.Thread] = None
+
+    # ------------------------------------------------------------------
+    # Session map
+    # ------------------------------------------------------------------
+    @staticmethod
+    def sessions(router_id: int) -> Optional[List[Dict[str, Any]]]:
+        """Active sessions of ``router_id`` or ``None`` if it is not being listened to here."""
+
+        with SessionListenerService._lock:
+            listener = SessionListenerService._listeners.get(router_id)
+            current = SessionListenerService._sessions.get(router_id)
+            if listener is None or current is None:
+                return None
+            return list(current.values())
+
+    @staticmethod
+    def _event(router_id: int, kind: str, session: Dict[str, Any], source: str,
+               uptime: Optional[str] = None) -> SessionEvent:
+        return SessionEvent(
+            router_id=router_id,
+            name=session.get('name', ''),
+            event=kind,
+            mikrotik_id=session.get('.id'),
+            address=session.get('address'),
+            caller_id=session.get('caller-id'),
+            uptime=uptime if uptime is not None else session.get('uptime'),
+            source=source,
+            occurred_at=datetime.utcnow(),
+        )
+
+    @staticmethod
+    def record(app, events: List[SessionEvent]) -> None:
+        if not events:
+            return
+        with app.app_context():
+            try:
+                db.session.add_all(events)
+                db.session.commit()
+            finally:
+                db.session.remove()
+
+    @staticmethod
+    def _disconnect_uptime(router_id: int, session_id: str) -> Optional[str]:
+        started = SessionListenerService._connected_at.pop((router_id, session_id), None)
+        return _format_uptime(time.monotonic() - started) if started is not None else None
+
+    @staticmethod
+    def _prune_connected(router_id: int, active) -> None:
+        """Forget connection times of sessions of ``router_id`` not in ``active`` (lock held).
+
+        A disconnect missed while the listener was down would otherwise
+        keep its entry forever.
+        """
+
+        connected_at = SessionListenerService._connected_at
+        for key in [key for key in connected_at if key[0] == router_id and key[1] not in active]:
+            del connected_at[key]
+
+    @staticmethod
+    def reconcile(app, router_id: int, rows: List[Dict[str, Any]]) -> None:
+        """Replace the session map of ``router_id`` with a full listing.
+
+        Differences with the previous map (or, on first start, with the
+        last collected snapshot) are recorded as events.  When nothing is
+        known about the router yet the listing only seeds the map.
+        """
+
+        current = {row['.id']: row for row in rows if row.get('.id')}
+        with SessionListenerService._lock:
+            previous = SessionListenerService._sessions.get(router_id)
+
+        if previous is None:
+            with app.app_context():
+                try:
+                    state = RouterSyncState.query.get(router_id)
+                    if state is None or state.sessions_collected_at is None:
+                        previous = dict(current)
+                    else:
+                        previous = {
+                            row.mikrotik_id: {'.id': row.mikrotik_id, 'name': row.name,
+                                              'address': row.address, 'caller-id': row.caller_id,
+                                              'uptime': row.uptime}
+                            for row in ActiveSession.query.filter_by(router_id=router_id).all()
+                            if row.mikrotik_id
+                        }
+                finally:
+                    db.session.remove()
+
+        events = []
+        now = time.monotonic()
+        with SessionListenerService._lock:
+            for session_id, row in current.items():
+                SessionListenerService._connected_at.setdefault((router_id, session_id), now)
+                if session_id not in previous:
+                    events.append(SessionListenerService._event(
+                        router_id, SessionEvent.CONNECT, row, 'listener'))
+            for session_id, row in previous.items():
+                if session_id not in current:
+                    uptime = SessionListenerService._disconnect_uptime(router_id, session_id)
+                    events.append(SessionListenerService._event(
+                        router_id, SessionEvent.DISCONNECT, row, 'listener', uptime))
+            SessionListenerService._sessions[router_id] = current
+            SessionListenerService._prune_connected(router_id, current)
+
+        SessionListenerService.record(app, events)
+
+    @staticmethod
+    def apply_change(app, router_id: int, change: Dict[str, Any]) -> None:
+        """Apply one ``listen`` notification to the session map."""
+
+        session_id = change.get('.id')
+        if not session_id:
+            return
+
+        event = None
+        with SessionListenerService._lock:
+            current = SessionListenerService._sessions.setdefault(router_id, {})
+            if change.get('.dead') in ('yes', 'true'):
+                row = current.pop(session_id, None)
+                if row is not None:
+                    uptime = SessionListenerService._disconnect_uptime(router_id, session_id)
+                    event = SessionListenerService._event(
+                        router_id, SessionEvent.DISCONNECT, row, 'listener', uptime)
+            else:
+                row = current.get(session_id)
+                if row is None:
+                    current[session_id] = dict(change)
+                    SessionListenerService._connected_at[(router_id, session_id)] = time.monotonic()
+                    event = SessionListenerService._event(
+                        router_id, SessionEvent.CONNECT, change, 'listener')
+                else:
+                    row.update(change)
+
+        if event is not None:
+            SessionListenerService.record(app, [event])
+
+    @staticmethod
+    def is_listened(router_ids: Iterable[int]) -> set:
+        """Routers with a live listener in any process (fresh lease)."""
+
+        lease = get_setting('SESSION_LISTENER_LEASE', 90)
+        fresh_after = datetime.utcnow() - timedelta(seconds=lease)
+        return {
+            router_id for (router_id,) in
+            db.session.query(RouterSyncState.router_id).filter(
+                RouterSyncState.router_id.in_(list(router_ids)),
+                RouterSyncState.listener_owner.isnot(None),
+                RouterSyncState.listener_heartbeat_at >= fresh_after,
+            ).all()
+        }
+
+    # ------------------------------------------------------------------
+    # Supervisor
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _fingerprint(router: Router) -> str:
+        raw = f"{router.uri}|{router.username}|{router.password}|{router.api_transport}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    @staticmethod
+    def _stop(router_id: int) -> None:
+        with SessionListenerService._lock:
+            listener = SessionListenerService._listeners.pop(router_id, None)
+            SessionListenerService._sessions.pop(router_id, None)
+            SessionListenerService._prune_connected(router_id, ())
+        if listener is not None:
+            listener.stop()
+
+    @staticmethod
+    def supervise(app) -> None:
+        """One supervisor pass: renew leases, start and stop listeners (needs an app context)."""
+
+        routers = {
+            router.id: router for router in Router.query.filter(
+                Router.is_active == True,
+                Router.api_transport.in_(RouterOSApiTransport.TRANSPORTS),
+            ).all()
+        }
+        owner = SessionListenerService.OWNER
+        lease = get_setting('SESSION_LISTENER_LEASE', 90)
+
+        with SessionListenerService._lock:
+            running = dict(SessionListenerService._listeners)
+
+        # Routers removed, switched to REST or with new credentials
+        for router_id, listener in running.items():
+            router = routers.get(router_id)
+            if router is None or listener.fingerprint != SessionListenerService._fingerprint(router):
+                SessionListenerService._stop(router_id)
+                running.pop(router_id)
+
+        kept = set(RouterSyncState.claim(
+            list(running), 'listener_heartbeat_at', 0, RouterSyncState.listener_owner == owner
+        ))
+        for router_id in set(running) - kept:
+            # Lease lost to another process
+            SessionListenerService._stop(router_id)
+
+        candidates = [router_id for router_id in routers if router_id not in kept]
+        acquired = RouterSyncState.claim(
+            candidates, 'listener_heartbeat_at', lease, values={'listener_owner': owner}
+        )
+        for router_id in acquired:
+            router = routers[router_id]
+            listener = _RouterListener(
+                app, router_id,
+                RouterCredentials.for_router(router),
+                SessionListenerService._fingerprint(router),
+            )
+            with SessionListenerService._lock:
+                SessionListenerService._listeners[router_id] = listener
+            listener.start()
+
+    @staticmethod
+    def _loop(app) -> None:
+        while True:
+            with app.app_context():
+                try:
+                    SessionListenerService.supervise(app)
+                except Exception:  # pragma: no cover - keep the supervisor alive
+                    db.session.rollback()
+                    app.logger.exception('Error supervisando listeners de sesiones')
+                finally:
+                    db.session.remove()
+            time.sleep(get_setting('SESSION_LISTENER_RESCAN', 30))
+
+    @staticmethod
+    def start(app) -> bool:
+        """Start the supervisor thread once per process (``SESSION_LISTENER_ENABLED``)."""
+
+        if not app.config.get('SESSION_LISTENER_ENABLED', True):
+            return False
+        with SessionListenerService._lock:
+            supervisor = SessionListenerService._supervisor
+            if supervisor is not None and supervisor.is_alive():
+                return False
+            supervisor = threading.Thread(
+                target=SessionListenerService._loop, args=(app,),
+                name='pppoe-listener-supervisor', daemon=True,
+            )
+            supervisor.start()
+            SessionListenerService._supervisor = supervisor
+        return True
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from config.config import get_setting
+from models import db
+from models.pppoe_session import ActiveSession
+from models.router import Router
+
+# Fields whose changes are sent as counter updates
+COUNTER_KEYS = ('rxBytes', 'txBytes', 'rxPackets', 'txPackets')
+# Changes on every poll: sent with the counters, but on its own only
+# every ``SESSION_STREAM_UPTIME_INTERVAL`` seconds
+UPTIME_KEY = 'uptime'
+
+
+class SessionSubscription:
+    """Queue of events for one stream client."""
+
+    __slots__ = ('events', 'dropped')
+
+    def __init__(self, size: int):
+        self.events: queue.Queue = queue.Queue(maxsize=size)
+        self.dropped = False
+
+
+class SessionPublisher:
+    """Shared, in-process source of live PPPoE session events.
+
+    One thread per process reads the session snapshot (kept by
+    :class:`SessionCollectorService`) every ``SESSION_STREAM_INTERVAL``
+    seconds, diffs it against the previous read and pushes only the
+    changes to every subscriber.  The cost is one snapshot read per
+    interval regardless of the number of open streams, and routers are
+    never queried from here.  The thread stops when the last subscriber
+    leaves.
+
+    Subscribers that fall ``SESSION_STREAM_QUEUE_SIZE`` events behind are
+    dropped; their stream ends and the client reconnects to get a fresh
+    snapshot.
+    """
+
+    _subscribers: List[SessionSubscription] = []
+    _state: Optional[Dict[str, Dict[str, Any]]] = None
+    _lock = threading.Lock()
+    _thread: Optional[threading.Thread] = None
+    _uptime_sent_at = 0.0
+
+    @staticmethod
+    def read_sessions() -> Dict[str, Dict[str, Any]]:
+        """Current snapshot keyed by ``'<router_id>:<session id or name>'``."""
+
+        rows = db.session.query(ActiveSession, Router.name).join(
+            Router, ActiveSession.router_id == Router.id
+        ).filter(Router.is_active == True).all()
+
+        sessions = {}
+        for row, router_name in rows:
+            session = row.to_session_dict(router_name)
+            session['key'] = f"{row.router_id}:{row.mikrotik_id or row.name}"
+            sessions[session['key']] = session
+        return sessions
+
+    @staticmethod
+    def diff(previous: Dict[str, Dict[str, Any]], current: Dict[str, Dict[str, Any]],
+             uptime: bool = False) -> Optional[Dict[str, Any]]:
+        """Delta event between two snapshots, or ``None`` if nothing changed.
+
+        A session whose only change is its uptime is included only when
+        ``uptime`` is true.
+        """
+
+        fields = COUNTER_KEYS + (UPTIME_KEY,) if uptime else COUNTER_KEYS
+        connected = [session for key, session in current.items() if key not in previous]
+        disconnected = [key for key in previous if key not in current]
+        counters = []
+        for key, session in current.items():
+            old = previous.get(key)
+            if old is not None and any(old[field] != session[field] for field in fields):
+                counters.append({'key': key, **{field: session[field] for field in COUNTER_KEYS + (UPTIME_KEY,)}})
+
+        if not (connected or disconnected or counters):
+            return None
+        return {
+            'type': 'delta',
+            'connected': connected,
+            'disconnected': disconnected,
+            'counters': counters,
+        }
+
+    @staticmethod
+    def subscribe(app) -> Tuple[SessionSubscription, List[Dict[str, Any]]]:
+        """Register a stream client; returns its subscription and the initial snapshot.
+
+        Must be called inside an app context.  The snapshot and the
+        registration happen under the publisher lock, so the client sees
+        every later delta exactly once.
+        """
+
+        subscription = SessionSubscription(get_setting('SESSION_STREAM_QUEUE_SIZE', 100))
+        with SessionPublisher._lock:
+            if SessionPublisher._state is None:
+                SessionPublisher._state = SessionPublisher.read_sessions()
+            snapshot = list(SessionPublisher._state.values())
+            SessionPublisher._subscribers.append(subscription)
+
+            if SessionPublisher._thread is None:
+                SessionPublisher._thread = threading.Thread(
+                    target=SessionPublisher._loop, args=(app,),
+                    name='pppoe-session-publisher', daemon=True,
+                )
+                SessionPublisher._thread.start()
+        return subscription, snapshot
+
+    @staticmethod
+    def unsubscribe(subscription: SessionSubscription) -> None:
+        with SessionPublisher._lock:
+            if subscription in SessionPublisher._subscribers:
+                SessionPublisher._subscribers.remove(subscription)
+
+    @staticmethod
+    def _publish(current: Dict[str, Dict[str, Any]]) -> None:
+        now = time.monotonic()
+        with SessionPublisher._lock:
+            uptime = now - SessionPublisher._uptime_sent_at >= get_setting('SESSION_STREAM_UPTIME_INTERVAL', 60)
+            event = SessionPublisher.diff(SessionPublisher._state or {}, current, uptime)
+            SessionPublisher._state = current
+            if uptime:
+                SessionPublisher._uptime_sent_at = now
+            if event is None:
+                return
+            for subscription in list(SessionPublisher._subscribers):
+                try:
+                    subscription.events.put_nowait(event)
+                except queue.Full:
+                    subscription.dropped = True
+                    SessionPublisher._subscribers.remove(subscription)
+
+    @staticmethod
+    def _loop(app) -> None:
+        while True:
+            time.sleep(get_setting('SESSION_STREAM_INTERVAL', 5))
+            with SessionPublisher._lock:
+                if not SessionPublisher._subscribers:
+                    # Nobody is listening: stop and forget the stale state
+                    SessionPublisher._thread = None
+                    SessionPublisher._state = None
+                    return
+
+            with app.app_context():
+                try:
+                    SessionPublisher._publish(SessionPublisher.read_sessions())
+                except Exception:  # pragma: no cover - keep the stream alive
+                    app.logger.exception('Error publicando sesiones PPPoE')
+                finally:
+                    db.session.remove()
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from config.config import get_setting as _setting
+
+# Poll interval while another worker holds the flight lock
+POLL_SECONDS = 0.05
+
+
+class _LocalStore:
+    """In-process stand-in for the shared store (``memory://``).
+
+    Implements the same lock/result operations as :class:`_RedisStore`, so
+    the coordination code is identical with a single worker.
+    """
+
+    def __init__(self) -> None:
+        self._values: Dict[str, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._values[key]
+            return None
+        return entry[1]
+
+    def acquire(self, key: str, token: str, ttl: float) -> bool:
+        with self._lock:
+            if self._get(key) is not None:
+                return False
+            self._values[key] = (time.monotonic() + ttl, token)
+            return True
+
+    def release(self, key: str, token: str) -> None:
+        with self._lock:
+            if self._get(key) == token:
+                del self._values[key]
+
+    def locked(self, key: str) -> bool:
+        with self._lock:
+            return self._get(key) is not None
+
+    def put(self, key: str, value: str, ttl: float) -> None:
+        with self._lock:
+            self._values[key] = (time.monotonic() + ttl, value)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._get(key)
+
+
+class _RedisStore:
+    """Shared store for several workers (``redis://``); needs the ``redis`` package."""
+
+    # Delete the lock only if this worker still owns it
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url: str) -> None:
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._release = self._client.register_script(self._RELEASE)
+
+    def acquire(self, key: str, token: str, ttl: float) -> bool:
+        return bool(self._client.set(key, token, nx=True, px=int(ttl * 1000)))
+
+    def release(self, key: str, token: str) -> None:
+        self._release(keys=[key], args=[token])
+
+    def locked(self, key: str) -> bool:
+        return bool(self._client.exists(key))
+
+    def put(self, key: str, value: str, ttl: float) -> None:
+        self._client.set(key, value, px=int(ttl * 1000))
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._client.get(key)
+        return value.decode() if value is not None else None
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'waiters', 'generation')
+
+    def __init__(self, generation: Optional[int] = None) -> None:
+        self.done = threading.Event()
+        self.generation = generation
+        self.result: Tuple[Optional[Any], Optional[str]] = (None, 'Solicitud cancelada')
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesce identical concurrent router reads into one request.
+
+    Within a process the first caller of a key runs the request and the
+    other threads wait for its ``(data, error)`` result.  Across workers
+    the leader also takes a lock in the store configured with
+    ``SINGLEFLIGHT_STORE_URL`` and publishes a successful result there
+    for ``SINGLEFLIGHT_RESULT_TTL`` seconds; a worker that finds the lock
+    taken waits for that result instead of asking the router again (and
+    runs the request itself if the leader fails or takes longer than
+    ``MIKROTIK_TIMEOUT``).  ``memory://`` (the default) uses a local
+    stand-in, so only threads are coalesced.
+
+    ``generation`` (e.g. :meth:`RouterReadCache.generation`) guards against
+    sharing a read that raced a write: callers only join a flight started
+    at the current generation, and the leader does not publish its result
+    if the generation moved while it ran.
+
+    Shared results must be treated as read-only.
+    """
+
+    _flights: Dict[Hashable, _Flight] = {}
+    _lock = threading.Lock()
+    _store: Any = None
+    _store_url: Optional[str] = None
+    _stats = {'requests': 0, 'shared_local': 0, 'shared_remote': 0}
+
+    @staticmethod
+    def _get_store():
+        url = _setting('SINGLEFLIGHT_STORE_URL', 'memory://') or 'memory://'
+        with SingleFlight._lock:
+            if SingleFlight._store is None or SingleFlight._store_url != url:
+                SingleFlight._store = _LocalStore() if url.startswith('memory://') else _RedisStore(url)
+                SingleFlight._store_url = url
+            return SingleFlight._store
+
+    @staticmethod
+    def _store_key(key: Hashable) -> str:
+        return 'singleflight:' + hashlib.sha256(repr(key).encode()).hexdigest()
+
+    @staticmethod
+    def do(key: Hashable, fn: Callable[[], Tuple[Optional[Any], Optional[str]]],
+           generation: Optional[Callable[[], int]] = None) -> Tuple[Optional[Any], Optional[str]]:
+        """Run ``fn`` once for all concurrent callers of ``key`` and share its result."""
+
+        if not _setting('SINGLEFLIGHT_ENABLED', True):
+            return SingleFlight._call(fn)
+
+        current = generation() if generation is not None else None
+        with SingleFlight._lock:
+            flight = SingleFlight._flights.get(key)
+            # A flight started before a write may return stale data
+            leader = flight is None or flight.generation != current
+            if leader:
+                flight = SingleFlight._flights[key] = _Flight(current)
+            else:
+                flight.waiters += 1
+                SingleFlight._stats['shared_local'] += 1
+
+        if not leader:
+            flight.done.wait()
+            return flight.result
+
+        try:
+            flight.result = SingleFlight._run_shared(key, fn, generation)
+        finally:
+            with SingleFlight._lock:
+                if SingleFlight._flights.get(key) is flight:
+                    del SingleFlight._flights[key]
+            flight.done.set()
+        return flight.result
+
+    @staticmethod
+    def _call(fn: Callable[[], Tuple[Optional[Any], Optional[str]]]) -> Tuple[Optional[Any], Optional[str]]:
+        with SingleFlight._lock:
+            SingleFlight._stats['requests'] += 1
+        return fn()
+
+    @staticmethod
+    def _run_shared(key: Hashable, fn: Callable[[], Tuple[Optional[Any], Optional[str]]],
+                    generation: Optional[Callable[[], int]] = None) -> Tuple[Optional[Any], Optional[str]]:
+        """Leader path: coordinate with the other workers through the store."""
+
+        store = SingleFlight._get_store()
+        if isinstance(store, _LocalStore):
+            # A single worker: the in-process flights already cover it
+            return SingleFlight._call(fn)
+
+        base = SingleFlight._store_key(key)
+        lock_key, result_key = base + ':lock', base + ':result'
+        timeout = _setting('MIKROTIK_TIMEOUT', 10)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+
+        try:
+            waited = False
+            while True:
+                # Only results published while we waited: this is not a cache
+                shared = store.get(result_key) if waited else None
+                if shared is not None:
+                    with SingleFlight._lock:
+                        SingleFlight._stats['shared_remote'] += 1
+                    return json.loads(shared), None
+                if store.acquire(lock_key, token, timeout * 2):
+                    break
+                if time.monotonic() >= deadline:
+                    return SingleFlight._call(fn)
+                waited = True
+                time.sleep(POLL_SECONDS)
+        except Exception:  # pragma: no cover - store unavailable
+            return SingleFlight._call(fn)
+
+        try:
+            current = generation() if generation is not None else None
+            data, error = SingleFlight._call(fn)
+            if error is None and (generation is None or generation() == current):
+                try:
+                    store.put(result_key, json.dumps(data), _setting('SINGLEFLIGHT_RESULT_TTL', 2))
+                except Exception:  # pragma: no cover - store unavailable
+                    pass
+            return data, error
+        finally:
+            try:
+                store.release(lock_key, token)
+            except Exception:  # pragma: no cover - store unavailable
+                pass
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        """Requests sent to routers and reads served by another caller's request."""
+
+        with SingleFlight._lock:
+            stats = dict(SingleFlight._stats)
+            stats['in_flight'] = len(SingleFlight._flights)
+        stats['store'] = (_setting('SINGLEFLIGHT_STORE_URL', 'memory://') or 'memory://').split('://')[0]
+        return stats
@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from flask import current_app
+from sqlalchemy import or_
+
+from config.config import get_setting
+from models import db
+from models.router import Router, RouterSyncState
+from models.sync_log import SyncLog
+from services.sync_service import SyncService
+
+
+class SyncJob:
+    """Background sync job kept in the in-memory job table.
+
+    Only the plan of the job lives here (which routers, when it was
+    submitted, whether the runner crashed); progress is read from the
+    ``SyncLog`` rows tagged with the job id, so it is the same whether the
+    lanes ran in this process or in Celery workers.
+    """
+
+    def __init__(self, kind: str, lanes: List[List[int]], sync_type: str):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.lanes = lanes
+        self.sync_type = sync_type
+        self.status = 'queued'
+        self.error: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+        # Id del resultado del chord cuando corre en Celery
+        self.result_id: Optional[str] = None
+
+    @property
+    def total_routers(self) -> int:
+        return sum(len(lane) for lane in self.lanes)
+
+
+class SyncJobService:
+    """Submit router syncs as background jobs and report their progress.
+
+    ``SYNC_JOB_BACKEND`` selects where the jobs run: ``'thread'`` (default)
+    uses a small local thread pool, ``'celery'`` dispatches the lanes as a
+    chord (see ``tasks.sync_task.schedule_lanes``).
+    """
+
+    _jobs: Dict[str, SyncJob] = {}
+    _jobs_lock = threading.Lock()
+    _executor: Optional[ThreadPoolExecutor] = None
+
+    @staticmethod
+    def _get_executor() -> ThreadPoolExecutor:
+        with SyncJobService._jobs_lock:
+            if SyncJobService._executor is None:
+                SyncJobService._executor = ThreadPoolExecutor(
+                    max_workers=get_setting('SYNC_JOB_WORKERS', 2),
+                    thread_name_prefix='sync-job',
+                )
+            return SyncJobService._executor
+
+    @staticmethod
+    def _remember(job: SyncJob) -> None:
+        """Store ``job``, dropping the oldest ones beyond ``SYNC_JOB_HISTORY``."""
+
+        limit = get_setting('SYNC_JOB_HISTORY', 200)
+        with SyncJobService._jobs_lock:
+            SyncJobService._jobs[job.id] = job
+            while len(SyncJobService._jobs) > limit:
+                oldest = next(iter(SyncJobService._jobs))
+                del SyncJobService._jobs[oldest]
+
+    @staticmethod
+    def _run(app, job: SyncJob) -> None:
+        job.status = 'running'
+        try:
+            if job.kind == 'firewall':
+                SyncJobService._run_firewall(app, job)
+            else:
+                SyncService.run_lanes(app, job.lanes, job.sync_type, job.id)
+            job.status = 'completed'
+        except Exception as exc:  # pragma: no cover - defensive
+            job.status = 'failed'
+            job.error = str(exc)
+        job.finished_at = datetime.utcnow()
+
+    @staticmethod
+    def _run_firewall(app, job: SyncJob) -> None:
+        """Sync the firewall rules of the job's routers one after another."""
+
+        failed = []
+        with app.app_context():
+            try:
+                for router_id in (router_id for lane in job.lanes for router_id in lane):
+                    result = SyncService.sync_firewall_rules(router_id)
+                    if not result['success']:
+                        failed.append(f"router {router_id}: {result['message']}")
+            finally:
+                db.session.remove()
+        if failed:
+            raise RuntimeError('; '.join(failed))
+
+    @staticmethod
+    def submit(kind: str, lanes: List[List[int]], sync_type: str) -> SyncJob:
+        """Create a job for ``lanes`` and start it in the configured backend."""
+
+        job = SyncJob(kind, lanes, sync_type)
+        SyncJobService._remember(job)
+
+        if get_setting('SYNC_JOB_BACKEND', 'thread') == 'celery':
+            from tasks.sync_task import schedule_firewall, schedule_lanes
+            if kind == 'firewall':
+                result = schedule_firewall([router_id for lane in lanes for router_id in lane])
+            else:
+                result = schedule_lanes(lanes, sync_type, job.id)
+            job.result_id = result.id if result is not None else None
+        else:
+            app = current_app._get_current_object()
+            SyncJobService._get_executor().submit(SyncJobService._run, app, job)
+        return job
+
+    @staticmethod
+    def active_jobs() -> List[SyncJob]:
+        """Jobs of this process that have not finished yet."""
+
+        with SyncJobService._jobs_lock:
+            jobs = [job for job in SyncJobService._jobs.values() if job.status in ('queued', 'running')]
+        # Celery jobs only finish in the database: refresh them from SyncLog
+        return [job for job in jobs if SyncJobService.get_job(job.id)['status'] in ('queued', 'running')]
+
+    @staticmethod
+    def _chord_outcome(job: Optional[SyncJob]):
+        """``(status, error)`` of a finished Celery chord or task, or ``None`` while it runs.
+
+        A lane that crashes before writing its ``SyncLog`` only shows up
+        here.
+        """
+
+        if job is None or not job.result_id:
+            return None
+        try:
+            from tasks.sync_task import celery
+            result = celery.AsyncResult(job.result_id)
+            if result.failed():
+                return 'failed', str(result.result)
+            if result.successful():
+                return 'completed', None
+        except Exception:  # pragma: no cover - result backend unavailable
+            current_app.logger.exception(f'Error consultando el trabajo {job.id}')
+        return None
+
+    @staticmethod
+    def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the progress of ``job_id`` or ``None`` if it is unknown.
+
+        Jobs submitted by another process (or before a restart) are still
+        reported from their ``SyncLog`` rows, with the routers seen so far
+        as the total.  Celery jobs also finish with their chord, and any
+        job still unfinished after ``SYNC_JOB_TIMEOUT`` seconds is failed
+        (a lane that died without reporting).
+        """
+
+        with SyncJobService._jobs_lock:
+            job = SyncJobService._jobs.get(job_id)
+        logs = SyncLog.query.filter_by(job_id=job_id).order_by(SyncLog.id).all()
+        if job is None and not logs:
+            return None
+
+        finished = [log for log in logs if log.status != 'running']
+        failed = [log for log in finished if log.status == 'error']
+        total = job.total_routers if job else len(logs)
+        created_at = job.created_at if job else min(log.started_at for log in logs)
+
+        error = job.error if job else None
+        outcome = None if job and job.status in ('completed', 'failed') else SyncJobService._chord_outcome(job)
+        if job and job.status in ('completed', 'failed'):
+            status = job.status
+        elif total and len(finished) >= total:
+            status = 'completed'
+        elif outcome is not None:
+            status, error = outcome
+        elif (datetime.utcnow() - created_at).total_seconds() > get_setting('SYNC_JOB_TIMEOUT', 3600):
+            status = 'failed'
+            error = 'Tiempo agotado: algunos routers no reportaron su sincronización'
+        elif logs:
+            status = 'running'
+        else:
+            status = job.status
+
+        finished_at = None
+        if status in ('completed', 'failed'):
+            finished_at = max((log.completed_at for log in finished), default=None)
+            if job:
+                job.status = status
+                job.error = error
+                job.finished_at = job.finished_at or finished_at or datetime.utcnow()
+                finished_at = job.finished_at
+
+        return {
+            'job_id': job_id,
+            'type': job.kind if job else None,
+            'status': status,
+            'error': error,
+            'total_routers': total,
+            'routers_done': len(finished),
+            'routers_failed': len(failed),
+            'rows_processed': sum(log.records_synced or 0 for log in finished),
+            'created_at': created_at.isoformat(),
+            'finished_at': finished_at.isoformat() if finished_at else None,
+            'elapsed_seconds': round(((finished_at or datetime.utcnow()) - created_at).total_seconds(), 1),
+            'logs': [log.to_dict() for log in logs],
+        }
+
+    @staticmethod
+    def refresh_stale(router_ids: List[int], force: bool = False) -> List[int]:
+        """Start one background refresh for the routers whose data is stale.
+
+        Data older than ``PPPOE_FRESHNESS_SECONDS`` is stale.  Each router
+        is claimed with a conditional ``UPDATE`` of its
+        ``router_sync_state`` row that only one process can win per
+        window, so concurrent requests on any number of workers trigger a
+        single refresh.  ``force`` ignores the data age but still refreshes
+        a router at most once every ``PPPOE_FORCE_REFRESH_SECONDS``.
+
+        Returns
+        -------
+        list
+            Ids of the routers whose refresh was started by this call.
+        """
+
+        freshness = get_setting('PPPOE_FRESHNESS_SECONDS', 300)
+        window = get_setting('PPPOE_FORCE_REFRESH_SECONDS', 30) if force else freshness
+
+        conditions = ()
+        if not force:
+            stale_before = datetime.utcnow() - timedelta(seconds=freshness)
+            conditions = (
+                or_(RouterSyncState.last_synced_at.is_(None),
+                    RouterSyncState.last_synced_at < stale_before),
+            )
+        claimed = RouterSyncState.claim(router_ids, 'refresh_claimed_at', window, *conditions)
+
+        if claimed:
+            routers = Router.query.filter(Router.id.in_(claimed)).order_by(Router.id).all()
+            SyncJobService.submit('refresh', SyncService.plan_lanes(routers), 'auto')
+        return claimed
+
+    @staticmethod
+    def refresh_firewall(router_ids: List[int]) -> List[int]:
+        """Start one background sync of the firewall rules of ``router_ids``.
+
+        Like :meth:`refresh_stale`, each router is claimed at most once
+        every ``PPPOE_FORCE_REFRESH_SECONDS`` across all processes (on
+        ``router_sync_state.firewall_claimed_at``).
+
+        Returns
+        -------
+        list
+            Ids of the routers whose refresh was started by this call.
+        """
+
+        window = get_setting('PPPOE_FORCE_REFRESH_SECONDS', 30)
+        claimed = RouterSyncState.claim(router_ids, 'firewall_claimed_at', window)
+        if claimed:
+            SyncJobService.submit('firewall', [sorted(claimed)], 'auto')
+        return claimed
+
+    @staticmethod
+    def data_age(router_ids: List[int]) -> Dict[str, Optional[float]]:
+        """Seconds since the last successful sync of each router (``None`` if never)."""
+
+        now = datetime.utcnow()
+        synced = dict(
+            db.session.query(RouterSyncState.router_id, RouterSyncState.last_synced_at)
+            .filter(RouterSyncState.router_id.in_(router_ids))
+            .all()
+        )
+        return {
+            str(router_id): round((now - synced[router_id]).total_seconds(), 1)
+            if synced.get(router_id) else None
+            for router_id in router_ids
+        }
@@ -1,29 +1,162 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from flask import current_app
+from sqlalchemy import func, or_
+from config.config import get_setting
 from models import db
-from models.router import Router, Secret, RouterFirewall
+from models.router import Router, Secret, RouterFirewall, RouterSyncState
 from models.sync_log import SyncLog
-from services.encryption_service import EncryptionService
+from services.bulk_loader import BulkLoader
+from services.client_search import ClientSearchService
+from services.ip_pool_service import IpPoolService
 from services.mikrotik_service import MikroTikService
+from services.router_credentials import RouterCredentials
+from services.router_scheduler import RouterScheduler
+from utils.ip_range import address_range, parse_ipv4
+from utils.streaming import chunked
 
 class SyncService:
+    # Campos de Secret que se copian desde el router
+    SECRET_FIELDS = ('mikrotik_id', 'ip_address', 'ip_value', 'name', 'password', 'comment', 'profile', 'contract')
+
+    @staticmethod
+    def _secret_values(secret):
+        """Mapea un secret de RouterOS a los campos del modelo Secret"""
+        return {
+            'mikrotik_id': secret.get('.id'),
+            # La IP del cliente es remote-address; local-address es la del gateway
+            'ip_address': secret.get('remote-address', ''),
+            'ip_value': parse_ipv4(secret.get('remote-address')),
+            'name': secret.get('name', ''),
+            'password': secret.get('password', ''),
+            'comment': secret.get('comment', ''),
+            'profile': secret.get('profile', ''),
+            'contract': secret.get('comment', ''),
+        }
+
+    @staticmethod
+    def _firewall_values(router_id, rule):
+        """Mapea una regla de firewall de RouterOS a los campos de RouterFirewall"""
+        ip_start, ip_end = address_range(rule.get('src-address'))
+        return {
+            'router_id': router_id,
+            'firewall_id': rule.get('.id', ''),
+            'ip_address': rule.get('src-address', ''),
+            'ip_start': ip_start,
+            'ip_end': ip_end,
+            'comment': rule.get('comment', ''),
+            'creation_date': rule.get('creation-time'),
+            'protocol': rule.get('protocol'),
+            'port': rule.get('dst-port'),
+            'action': rule.get('action'),
+            'chain': rule.get('chain'),
+            'is_active': rule.get('disabled', 'false') == 'false',
+        }
+
+    @staticmethod
+    def _apply_secret_diff(router_id, secrets):
+        """Aplica en la sesión actual las diferencias entre el router y la DB.
+
+        Cada secret del router se empareja con su fila por ``.id`` de
+        RouterOS y, si no lo tiene, por nombre.  Se insertan los nuevos,
+        se actualizan solo las filas con cambios y se eliminan las que ya
+        no existen en el router, todo mediante escrituras masivas
+        (:class:`BulkLoader`) en lugar de una operación ORM por fila.  Las
+        IPs que dejan de usarse vuelven a sus pools.  No hace commit: el
+        llamador confirma todo en una única transacción.
+
+        ``secrets`` puede ser un generador (ver ``MikroTikService.stream``):
+        se procesa en lotes de ``SYNC_BATCH_SIZE`` y por cada lote solo se
+        leen las filas que le corresponden, así que la memoria no depende
+        del tamaño del router (solo se guardan los ids ya emparejados).
+
+        Returns
+        -------
+        tuple
+            ``(received, inserted, updated, deleted)``
+        """
+        batch_size = get_setting('SYNC_BATCH_SIZE', 1000)
+        columns = [Secret.id] + [getattr(Secret, field) for field in SyncService.SECRET_FIELDS]
+        # Las filas insertadas por esta sincronización no se emparejan ni se eliminan
+        last_id = db.session.query(func.max(Secret.id)).filter(Secret.router_id == router_id).scalar() or 0
+        previous = (Secret.router_id == router_id, Secret.id <= last_id)
+
+        seen = set()
+        # IPs que dejaron de usar los clientes actualizados o eliminados
+        freed = []
+        received = inserted = updated = 0
+        for chunk in chunked(secrets, batch_size):
+            received += len(chunk)
+            values_list = [SyncService._secret_values(secret) for secret in chunk]
+            existing = db.session.execute(
+                db.select(*columns).where(*previous, or_(
+                    Secret.mikrotik_id.in_({values['mikrotik_id'] for values in values_list if values['mikrotik_id']}),
+                    Secret.name.in_({values['name'] for values in values_list}),
+                ))
+            ).mappings().all()
+            by_mikrotik_id = {row['mikrotik_id']: row for row in existing if row['mikrotik_id']}
+            by_name = {row['name']: row for row in existing}
+
+            new_rows, changed_rows = [], []
+            for values in values_list:
+                row = by_mikrotik_id.get(values['mikrotik_id']) or by_name.get(values['name'])
+
+                if row is None or row['id'] in seen:
+                    new_rows.append({'router_id': router_id, **values})
+                    continue
+
+                seen.add(row['id'])
+                changes = {
+                    field: values[field]
+                    for field in SyncService.SECRET_FIELDS
+                    if row[field] != values[field]
+                }
+                if changes:
+                    changed_rows.append({'id': row['id'], **changes})
+                    if 'ip_value' in changes:
+                        freed.append(row['ip_value'])
+
+            inserted += BulkLoader.insert(Secret, new_rows)
+            updated += BulkLoader.update(Secret, changed_rows)
+
+        # Filas que ya no existen en el router, recorridas por rangos de id
+        deleted, after = 0, 0
+        while True:
+            rows = db.session.execute(
+                db.select(Secret.id, Secret.ip_value).where(*previous, Secret.id > after)
+                .order_by(Secret.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            after = rows[-1].id
+            stale = [row for row in rows if row.id not in seen]
+            if stale:
+                Secret.query.filter(Secret.id.in_([row.id for row in stale])).delete(synchronize_session=False)
+                freed.extend(row.ip_value for row in stale)
+                deleted += len(stale)
+
+        # Los borrados y cambios masivos no pasan por IpPoolService.release
+        IpPoolService.release_many(router_id, freed)
+
+        return received, inserted, updated, deleted
+
     @staticmethod
-    def sync_router(router_id, sync_type='manual'):
-        """Sincroniza un router específico"""
+    def sync_router(router_id, sync_type='manual', job_id=None):
+        """Sincroniza un router específico.
+
+        ``job_id`` asocia el log de sincronización a un trabajo en segundo
+        plano (ver :class:`SyncJobService`).
+        """
         router = Router.query.get(router_id)
         if not router:
             return False, "Router no encontrado"
 
-        decrypted_password = EncryptionService.decrypt_password(router.password)
-        temp_router = type(
-            "RouterObj",
-            (object,),
-            {"uri": router.uri, "username": router.username, "password": decrypted_password},
-        )
+        temp_router = RouterCredentials.for_router(router)
         
         # Crear log de sincronización
         sync_log = SyncLog(
             router_id=router_id,
+            job_id=job_id,
             sync_type=sync_type,
             status='running'
         )
@@ -33,8 +166,9 @@ class SyncService:
         start_time = datetime.utcnow()
         
         try:
-            # Probar conexión
-            connected, message = MikroTikService.test_connection(temp_router)
+            # Probar conexión (trabajo de fondo: no ocupa los lugares de los operadores)
+            with RouterScheduler.background():
+                connected, message = MikroTikService.test_connection(temp_router)
             if not connected:
                 current_app.logger.error(
                     f"Error autenticando router {router_id}: {message}"
@@ -45,49 +179,53 @@ class SyncService:
                 db.session.commit()
                 return False, f"Error de conexión: {message}"
 
-            # Obtener secrets del router
-            secrets, error = MikroTikService.get_pppoe_secrets(temp_router)
-            if error:
-                current_app.logger.error(
-                    f"Error obteniendo secrets del router {router_id}: {error}"
-                )
-                sync_log.status = 'error'
-                sync_log.message = f"Error obteniendo secrets: {error}"
-                sync_log.completed_at = datetime.utcnow()
-                db.session.commit()
-                return False, f"Error obteniendo secrets: {error}"
+            # Leer los secrets del router a medida que llegan y aplicarlos por lotes
+            with RouterScheduler.background(), \
+                    MikroTikService.stream_pppoe_secrets(temp_router) as (secrets, error):
+                if error:
+                    current_app.logger.error(
+                        f"Error obteniendo secrets del router {router_id}: {error}"
+                    )
+                    sync_log.status = 'error'
+                    sync_log.message = f"Error obteniendo secrets: {error}"
+                    sync_log.completed_at = datetime.utcnow()
+                    db.session.commit()
+                    return False, f"Error obteniendo secrets: {error}"
 
-            # Reemplazar los registros existentes por los nuevos
-            Secret.query.filter_by(router_id=router_id).delete()
-            db.session.commit()
+                synced_count, inserted, updated, deleted = SyncService._apply_secret_diff(router_id, secrets)
 
-            synced_count = 0
-            for secret in secrets or []:
-                new_secret = Secret(
-                    router_id=router_id,
-                    ip_address=secret.get('local-address', ''),
-                    name=secret.get('name', ''),
-                    password=secret.get('password', ''),
-                    comment=secret.get('comment', ''),
-                    profile=secret.get('profile', ''),
-                    contract=secret.get('comment', ''),
-                )
-                db.session.add(new_secret)
-                synced_count += 1
-
-            # Completar log
+            # Completar log (misma transacción que los cambios)
             end_time = datetime.utcnow()
+            message = (
+                f"Sincronizados {synced_count} secrets "
+                f"({inserted} nuevos, {updated} actualizados, {deleted} eliminados)"
+            )
             sync_log.status = 'success'
-            sync_log.message = f"Sincronizados {synced_count} secrets"
+            sync_log.message = message
             sync_log.records_synced = synced_count
+            sync_log.records_inserted = inserted
+            sync_log.records_updated = updated
+            sync_log.records_deleted = deleted
             sync_log.duration_seconds = (end_time - start_time).total_seconds()
             sync_log.completed_at = end_time
 
+            RouterSyncState.ensure([router_id])
+            state = {'last_synced_at': end_time}
+            if inserted or updated or deleted:
+                # Los índices de búsqueda en memoria recargan este router
+                state['secrets_changed_at'] = end_time
+            RouterSyncState.query.filter_by(router_id=router_id).update(
+                state, synchronize_session=False
+            )
+
             db.session.commit()
+            if 'secrets_changed_at' in state:
+                ClientSearchService.notify_changed()
 
-            return True, f"Sincronizados {synced_count} secrets"
+            return True, message
 
         except Exception as e:
+            db.session.rollback()
             sync_log.status = 'error'
             sync_log.message = str(e)
             sync_log.completed_at = datetime.utcnow()
@@ -95,20 +233,105 @@ class SyncService:
             return False, str(e)
     
     @staticmethod
-    def sync_all_routers():
-        """Sincroniza todos los routers activos"""
-        routers = Router.query.filter_by(is_active=True).all()
-        results = []
-        
+    def plan_lanes(routers, per_branch=None):
+        """Reparte los routers en carriles que se sincronizan en secuencia.
+
+        Cada sucursal recibe como máximo ``per_branch`` carriles
+        (``SYNC_MAX_PER_BRANCH`` por defecto), así nunca se sincronizan a
+        la vez más routers de una misma sucursal.  Los carriles se
+        intercalan entre sucursales para que los primeros en ejecutarse
+        no sean todos de la misma.
+
+        Returns
+        -------
+        list
+            Listas de ids de router, una por carril.
+        """
+        per_branch = max(1, per_branch or get_setting('SYNC_MAX_PER_BRANCH', 2))
+
+        branch_lanes = {}
         for router in routers:
-            success, message = SyncService.sync_router(router.id, 'bulk')
+            lanes = branch_lanes.setdefault(router.branch_id, [])
+            position = sum(len(lane) for lane in lanes)
+            if len(lanes) < per_branch:
+                lanes.append([router.id])
+            else:
+                lanes[position % per_branch].append(router.id)
+
+        planned = []
+        groups = list(branch_lanes.values())
+        for index in range(max((len(lanes) for lanes in groups), default=0)):
+            planned.extend(lanes[index] for lanes in groups if index < len(lanes))
+        return planned
+
+    @staticmethod
+    def sync_lane(router_ids, sync_type='bulk', job_id=None):
+        """Sincroniza uno tras otro los routers de un carril.
+
+        Requiere un contexto de aplicación; un error en un router no
+        detiene al resto del carril.
+        """
+        results = []
+        for router_id in router_ids:
+            try:
+                success, message = SyncService.sync_router(router_id, sync_type, job_id)
+            except Exception as e:
+                db.session.rollback()
+                success, message = False, str(e)
+
+            router = Router.query.get(router_id)
             results.append({
-                'router_id': router.id,
-                'router_name': router.name,
+                'router_id': router_id,
+                'router_name': router.name if router else None,
                 'success': success,
                 'message': message
             })
-        
+        return results
+
+    @staticmethod
+    def _run_lane(app, router_ids, sync_type, job_id):
+        """Ejecuta un carril en un hilo con su propio contexto y sesión de DB"""
+        with app.app_context():
+            try:
+                return SyncService.sync_lane(router_ids, sync_type, job_id)
+            finally:
+                db.session.remove()
+
+    @staticmethod
+    def sync_all_routers(sync_type='bulk', max_workers=None, per_branch=None):
+        """Sincroniza todos los routers activos en paralelo.
+
+        Como máximo ``max_workers`` routers (``SYNC_MAX_WORKERS``) se
+        sincronizan a la vez en todo el proceso y ``per_branch`` por
+        sucursal (ver :meth:`plan_lanes`).  Cada hilo usa su propio
+        contexto de aplicación y sesión de base de datos, por lo que el
+        tiempo total se acerca al del router más lento de cada carril.
+        """
+        routers = Router.query.filter_by(is_active=True).order_by(Router.id).all()
+        lanes = SyncService.plan_lanes(routers, per_branch)
+        return SyncService.run_lanes(
+            current_app._get_current_object(), lanes, sync_type, max_workers=max_workers
+        )
+
+    @staticmethod
+    def run_lanes(app, lanes, sync_type='bulk', job_id=None, max_workers=None):
+        """Ejecuta los carriles de :meth:`plan_lanes` en un pool de hilos"""
+        if not lanes:
+            return []
+
+        max_workers = max(1, max_workers or get_setting('SYNC_MAX_WORKERS', 8))
+        results = []
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(lanes)),
+                                thread_name_prefix='router-sync') as executor:
+            futures = [
+                executor.submit(SyncService._run_lane, app, lane, sync_type, job_id)
+                for lane in lanes
+            ]
+            for future in futures:
+                results.extend(future.result())
+
+        results.sort(key=lambda result: result['router_id'])
         return results
 
     @staticmethod
@@ -118,46 +341,41 @@ class SyncService:
         if not router:
             return {'success': False, 'message': 'Router no encontrado'}
 
-        # Obtener reglas desde MikroTik
-        temp_router = type(
-            "RouterObj",
-            (object,),
-            {
-                "uri": router.uri,
-                "username": router.username,
-                "password": EncryptionService.decrypt_password(router.password),
-            },
-        )
-        rules, error = MikroTikService.get_firewall_rules(temp_router)
-        if error:
-            return {'success': False, 'message': error}
+        # Obtener reglas desde MikroTik (trabajo de fondo, como la sincronización de secrets)
+        temp_router = RouterCredentials.for_router(router)
+        with RouterScheduler.background(), \
+                MikroTikService.stream_firewall_rules(temp_router) as (rules, error):
+            if error:
+                return {'success': False, 'message': error}
 
-        try:
-            # Limpiar reglas existentes del router
-            RouterFirewall.query.filter_by(router_id=router_id).delete()
-            db.session.commit()
+            try:
+                # Reemplazar las reglas del router en una sola transacción, por lotes
+                RouterFirewall.query.filter_by(router_id=router_id).delete()
+                count = 0
+                for chunk in chunked(rules, get_setting('SYNC_BATCH_SIZE', 1000)):
+                    count += BulkLoader.insert(RouterFirewall, [
+                        SyncService._firewall_values(router_id, rule) for rule in chunk
+                    ])
 
-            for rule in rules or []:
-                new_rule = RouterFirewall(
-                    router_id=router_id,
-                    firewall_id=rule.get('.id', ''),
-                    ip_address=rule.get('src-address', ''),
-                    comment=rule.get('comment', ''),
-                    creation_date=rule.get('creation-time'),
-                    protocol=rule.get('protocol'),
-                    port=rule.get('dst-port'),
-                    action=rule.get('action'),
-                    chain=rule.get('chain'),
-                    is_active=rule.get('disabled', 'false') == 'false'
-                )
-                db.session.add(new_rule)
-
-            db.session.commit()
-            return {'success': True, 'message': f'{len(rules or [])} reglas sincronizadas'}
-        except Exception as e:
-            db.session.rollback()
-            return {'success': False, 'message': str(e)}
+                db.session.commit()
+                return {'success': True, 'message': f'{count} reglas sincronizadas'}
+            except Exception as e:
+                db.session.rollback()
+                return {'success': False, 'message': str(e)}
     
+    @staticmethod
+    def run_firewall_sync(app, router_id: int):
+        """Sincroniza el firewall de un router en un hilo con su propio contexto y sesión de DB.
+
+        Devuelve la tupla ``(mensaje, error)`` que espera :class:`FanOutService`.
+        """
+        with app.app_context():
+            try:
+                result = SyncService.sync_firewall_rules(router_id)
+            finally:
+                db.session.remove()
+        return (result['message'], None) if result['success'] else (None, result['message'])
+
     @staticmethod
     def get_sync_history(router_id=None, limit=50):
         """Obtiene historial de sincronizaciones"""
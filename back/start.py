@@ -2,7 +2,10 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import app
+from app import app, start_background_services
 
 if __name__ == '__main__':
+    # Con el recargador solo el proceso hijo (el que atiende) inicia los servicios
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services(app)
     app.run(debug=True, port=5000)
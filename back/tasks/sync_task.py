@@ -1,6 +1,7 @@
-from celery import Celery
+from celery import Celery, chord
 from services.sync_service import SyncService
 from models.router import Router
+from config.config import Config
 
 def create_celery_app():
     """Crea instancia de Celery"""
@@ -18,33 +19,84 @@ def create_celery_app():
 
 celery = create_celery_app()
 
+def _app_context():
+    """Contexto de aplicación Flask para ejecutar tareas con acceso a la DB"""
+    from app import app
+    return app.app_context()
+
 @celery.task
 def sync_all_routers_task():
     """Schedule synchronization of all active routers.
 
-    Each router is dispatched as an individual Celery task with a
-    small delay to avoid overloading either the application or the
-    routers themselves.  Results are reported by the subtasks.
+    Routers are split into lanes with :meth:`SyncService.plan_lanes`
+    (at most ``SYNC_MAX_PER_BRANCH`` lanes per branch) and every lane is
+    dispatched as one task of a chord, so all lanes start at once and the
+    global concurrency is bounded by the worker pool.  The chord callback
+    aggregates the results of the whole fleet.
     """
 
     try:
-        routers = Router.query.filter_by(is_active=True).all()
-        for index, router in enumerate(routers):
-            # Stagger execution by 10 seconds per router
-            sync_single_router_task.apply_async(args=[router.id], countdown=index * 10)
+        with _app_context():
+            routers = Router.query.filter_by(is_active=True).order_by(Router.id).all()
+            lanes = SyncService.plan_lanes(routers)
+
+        schedule_lanes(lanes, 'scheduled')
 
         return {
             'status': 'scheduled',
             'total': len(routers),
+            'lanes': len(lanes),
         }
     except Exception as e:  # pragma: no cover - best effort
         return {'status': 'error', 'message': str(e)}
 
+def schedule_lanes(lanes, sync_type, job_id=None):
+    """Encola los carriles como un chord cuyo callback resume el resultado"""
+    if not lanes:
+        return None
+    return chord(
+        sync_router_lane_task.si(lane, sync_type, job_id) for lane in lanes
+    )(sync_all_routers_done_task.s())
+
+@celery.task
+def sync_router_lane_task(router_ids, sync_type='scheduled', job_id=None):
+    """Sincroniza en secuencia los routers de un carril"""
+    with _app_context():
+        return SyncService.sync_lane(router_ids, sync_type, job_id)
+
+@celery.task
+def sync_all_routers_done_task(lane_results):
+    """Resume el resultado de todos los carriles de una sincronización completa"""
+    results = [result for lane in lane_results for result in lane]
+    successful = len([r for r in results if r['success']])
+    return {
+        'status': 'completed',
+        'results': results,
+        'total': len(results),
+        'successful': successful,
+        'failed': len(results) - successful
+    }
+
+def schedule_firewall(router_ids):
+    """Encola la sincronización de reglas de firewall de ``router_ids``"""
+    return sync_firewall_task.delay(router_ids)
+
+@celery.task
+def sync_firewall_task(router_ids):
+    """Sincroniza en secuencia las reglas de firewall de varios routers"""
+    with _app_context():
+        results = [SyncService.sync_firewall_rules(router_id) for router_id in router_ids]
+    failed = [result['message'] for result in results if not result['success']]
+    if failed:
+        raise RuntimeError('; '.join(failed))
+    return results
+
 @celery.task
 def sync_single_router_task(router_id):
     """Tarea de sincronización de un router específico"""
     try:
-        success, message = SyncService.sync_router(router_id, 'scheduled')
+        with _app_context():
+            success, message = SyncService.sync_router(router_id, 'scheduled')
         return {
             'status': 'completed' if success else 'error',
             'router_id': router_id,
@@ -57,10 +109,26 @@ def sync_single_router_task(router_id):
             'message': str(e)
         }
 
+@celery.task(name='tasks.sync_task.collect_sessions_task')
+def collect_sessions_task():
+    """Captura las sesiones PPPoE activas de todos los routers"""
+    from services.session_collector import SessionCollectorService
+    with _app_context():
+        fanout = SessionCollectorService.collect()
+    return {
+        'status': 'completed',
+        'routers': len(fanout.results),
+        'errors': fanout.to_dict()['errors']
+    }
+
 # Configurar tareas periódicas
 celery.conf.beat_schedule = {
     'sync-routers-every-15-minutes': {
         'task': 'app.tasks.sync_task.sync_all_routers_task',
         'schedule': 900.0,  # 15 minutos en segundos
     },
+    'collect-pppoe-sessions': {
+        'task': collect_sessions_task.name,
+        'schedule': float(Config.SESSION_COLLECT_INTERVAL),
+    },
 }
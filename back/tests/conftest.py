@@ -0,0 +1,21 @@
+import pytest
+from flask import Flask
+
+from models import db
+
+
+@pytest.fixture
+def app():
+    """Aplicación mínima con una base SQLite en memoria"""
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI='sqlite://',
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        TESTING=True,
+    )
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,109 @@
+import ipaddress
+
+from models import db
+from models.router import Secret
+from services.ip_pool_service import IpPoolService, _is_set, _next_free, _set
+
+
+def _bitmap(size, used=()):
+    bitmap = bytearray((size + 7) // 8)
+    for index in range(size, len(bitmap) * 8):
+        _set(bitmap, index, True)
+    for index in used:
+        _set(bitmap, index, True)
+    return bitmap
+
+
+def test_next_free_scans_forward_and_wraps_around():
+    bitmap = _bitmap(20, used=[0, 1, 2, 5])
+
+    assert _next_free(bitmap, 0, 20) == 3
+    assert _next_free(bitmap, 4, 20) == 4
+    assert _next_free(bitmap, 5, 20) == 6
+    assert _next_free(_bitmap(20, used=range(10, 20)), 12, 20) == 0
+
+
+def test_next_free_skips_full_bytes_and_padding():
+    bitmap = _bitmap(20, used=range(17))
+
+    assert _next_free(bitmap, 0, 20) == 17
+    assert _next_free(_bitmap(20, used=range(20)), 0, 20) is None
+
+
+def test_set_and_clear_bits():
+    bitmap = _bitmap(16)
+    _set(bitmap, 9, True)
+    assert _is_set(bitmap, 9) and not _is_set(bitmap, 8)
+    _set(bitmap, 9, False)
+    assert not _is_set(bitmap, 9)
+
+
+def test_allocate_hands_out_addresses_in_order_and_reuses_released(app):
+    pool = IpPoolService.create('p', '10.0.0.0/29', router_id=1)
+    db.session.commit()
+
+    addresses = [IpPoolService.allocate(pool.id)[0] for _ in range(6)]
+    assert addresses == [ipaddress.IPv4Address(f'10.0.0.{i}') for i in range(1, 7)]
+    assert IpPoolService.allocate(pool.id) == (None, 'No quedan direcciones libres en el pool')
+
+    IpPoolService.release(1, '10.0.0.3')
+    db.session.commit()
+    assert IpPoolService.allocate(pool.id) == (ipaddress.IPv4Address('10.0.0.3'), None)
+
+
+def test_allocate_skips_addresses_used_by_clients(app):
+    pool = IpPoolService.create('p', '10.0.0.0/29', router_id=1)
+    db.session.commit()
+    db.session.add(Secret(router_id=1, name='c', password='p', ip_address='10.0.0.1'))
+    db.session.commit()
+
+    assert IpPoolService.allocate(pool.id)[0] == ipaddress.IPv4Address('10.0.0.2')
+    assert IpPoolService.is_used(1, '10.0.0.1')
+    assert IpPoolService.is_used(1, '10.0.0.2')
+    assert not IpPoolService.is_used(1, '10.0.0.3')
+
+
+def test_release_many_keeps_addresses_still_in_use(app):
+    pool = IpPoolService.create('p', '10.0.0.0/29', router_id=1)
+    db.session.commit()
+    for _ in range(3):
+        IpPoolService.allocate(pool.id)
+    db.session.add(Secret(router_id=1, name='c', password='p', ip_address='10.0.0.2'))
+    db.session.commit()
+
+    released = IpPoolService.release_many(1, [ipaddress.IPv4Address('10.0.0.1'), ipaddress.IPv4Address('10.0.0.2')])
+    db.session.commit()
+
+    assert released == 1
+    assert IpPoolService.allocate(pool.id)[0] == ipaddress.IPv4Address('10.0.0.1')
+
+
+def test_rebuild_keeps_reservations_without_client(app):
+    pool = IpPoolService.create('p', '10.0.0.0/29', router_id=1)
+    db.session.commit()
+    reserved = IpPoolService.allocate(pool.id)[0]
+    db.session.add(Secret(router_id=1, name='c', password='p', ip_address='10.0.0.5'))
+    db.session.commit()
+
+    pool, error = IpPoolService.rebuild(pool.id)
+
+    assert error is None
+    assert pool.allocated == 2
+    assert IpPoolService.is_used(1, reserved)
+    assert IpPoolService.allocate(pool.id)[0] == ipaddress.IPv4Address('10.0.0.2')
+
+
+def test_rebuild_can_release_unused_reservations(app):
+    pool = IpPoolService.create('p', '10.0.0.0/29', router_id=1)
+    db.session.commit()
+    for _ in range(3):
+        IpPoolService.allocate(pool.id)
+    db.session.add(Secret(router_id=1, name='c', password='p', ip_address='10.0.0.3'))
+    db.session.commit()
+
+    pool, error = IpPoolService.rebuild(pool.id, release_unused=True)
+
+    assert error is None
+    assert pool.allocated == 1
+    assert not IpPoolService.has_client(1, '10.0.0.1')
+    assert IpPoolService.allocate(pool.id)[0] == ipaddress.IPv4Address('10.0.0.1')
@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+from services import router_cache, single_flight
+from services.router_cache import RouterReadCache
+from services.single_flight import SingleFlight
+
+URI = '10.0.0.1'
+KEY = ((URI, 'admin'), 'system/identity', ())
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    values = {'MIKROTIK_CACHE_ENABLED': True, 'SINGLEFLIGHT_ENABLED': True}
+    monkeypatch.setattr(router_cache, '_setting', lambda name, default=None: values.get(name, default))
+    monkeypatch.setattr(single_flight, '_setting', lambda name, default=None: values.get(name, default))
+    RouterReadCache.clear()
+    yield values
+    RouterReadCache.clear()
+
+
+def test_reads_are_cached():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return {'name': 'r1'}, None
+
+    assert RouterReadCache.get(KEY, 'system/identity', loader) == ({'name': 'r1'}, None)
+    assert RouterReadCache.get(KEY, 'system/identity', loader) == ({'name': 'r1'}, None)
+    assert len(calls) == 1
+
+
+def test_read_racing_a_write_is_not_stored():
+    def loader():
+        # The write lands while the GET is still in flight
+        RouterReadCache.invalidate(URI)
+        return {'name': 'old'}, None
+
+    assert RouterReadCache.get(KEY, 'system/identity', loader) == ({'name': 'old'}, None)
+    assert RouterReadCache.get(KEY, 'system/identity', lambda: ({'name': 'new'}, None)) == ({'name': 'new'}, None)
+
+
+def test_callers_after_a_write_do_not_join_the_stale_flight():
+    started, release = threading.Event(), threading.Event()
+    results = []
+
+    def stale():
+        started.set()
+        release.wait(5)
+        return 'old', None
+
+    def generation():
+        return RouterReadCache.generation(URI)
+
+    leader = threading.Thread(target=lambda: results.append(SingleFlight.do(KEY, stale, generation)))
+    leader.start()
+    started.wait(5)
+
+    RouterReadCache.invalidate(URI)
+    fresh = SingleFlight.do(KEY, lambda: ('new', None), generation)
+    release.set()
+    leader.join(5)
+
+    assert fresh == ('new', None)
+    assert results == [('old', None)]
@@ -0,0 +1,109 @@
+from types import SimpleNamespace
+
+import pytest
+
+from services import router_health
+from services.router_health import RouterHealth
+
+URI = '10.0.0.1'
+SETTINGS = {
+    'CIRCUIT_FAILURE_THRESHOLD': 3,
+    'CIRCUIT_OPEN_SECONDS': 10,
+    'CIRCUIT_MAX_OPEN_SECONDS': 30,
+    'MIKROTIK_TIMEOUT': 10,
+    'MIKROTIK_TIMEOUT_MIN': 2,
+    'MIKROTIK_TIMEOUT_FACTOR': 4,
+}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(router_health, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    monkeypatch.setattr(router_health, '_setting', lambda name, default=None: SETTINGS.get(name, default))
+    RouterHealth.reset()
+    yield now
+    RouterHealth.reset()
+
+
+def _fail(times=1):
+    for _ in range(times):
+        RouterHealth.record(URI, 'system/resource', False, error='timeout')
+
+
+def _state():
+    return RouterHealth.snapshot(URI)['state']
+
+
+def test_opens_after_consecutive_failures(clock):
+    _fail(2)
+    assert _state() == RouterHealth.CLOSED and RouterHealth.admit(URI) is None
+
+    _fail()
+    assert _state() == RouterHealth.OPEN
+    assert RouterHealth.admit(URI) is not None
+
+
+def test_success_resets_the_failure_count(clock):
+    _fail(2)
+    RouterHealth.record(URI, 'system/resource', True, 0.1)
+    _fail(2)
+
+    assert _state() == RouterHealth.CLOSED
+
+
+def test_half_open_lets_a_single_probe_through(clock):
+    _fail(3)
+    clock[0] += 10
+
+    assert RouterHealth.admit(URI) is None
+    assert _state() == RouterHealth.HALF_OPEN
+    assert RouterHealth.admit(URI) is not None
+
+    RouterHealth.record(URI, 'system/resource', True, 0.1)
+    assert _state() == RouterHealth.CLOSED
+    assert RouterHealth.admit(URI) is None
+
+
+def test_failed_probe_reopens_for_longer_up_to_the_maximum(clock):
+    _fail(3)
+    for open_seconds in (20, 30, 30):
+        clock[0] += 30
+        assert RouterHealth.admit(URI) is None
+        _fail()
+        assert _state() == RouterHealth.OPEN
+        clock[0] += open_seconds - 1
+        assert RouterHealth.admit(URI) is not None
+        clock[0] -= open_seconds - 1
+
+
+def test_abandoned_probe_can_be_taken_again(clock):
+    _fail(3)
+    clock[0] += 10
+    assert RouterHealth.admit(URI) is None
+
+    RouterHealth.abandon(URI)
+
+    assert RouterHealth.admit(URI) is None
+    assert _state() == RouterHealth.HALF_OPEN
+
+
+def test_stale_probe_is_replaced(clock):
+    _fail(3)
+    clock[0] += 10
+    assert RouterHealth.admit(URI) is None
+
+    clock[0] += 2 * SETTINGS['MIKROTIK_TIMEOUT']
+
+    assert RouterHealth.admit(URI) is None
+
+
+def test_timeout_follows_p95_latency(clock):
+    assert RouterHealth.timeout(URI, 'ppp/secret') == 10
+    for _ in range(10):
+        RouterHealth.record(URI, 'ppp/secret/*1', True, 0.5)
+
+    assert RouterHealth.timeout(URI, 'ppp/secret') == 2.0
+    for _ in range(10):
+        RouterHealth.record(URI, 'ppp/secret', True, 5.0)
+    assert RouterHealth.timeout(URI, 'ppp/secret') == 10
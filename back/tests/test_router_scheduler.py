@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from services import router_scheduler
+from services.router_scheduler import BACKGROUND, READ, WRITE, RouterScheduler
+
+URI = '10.0.0.1'
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    values = {
+        'ROUTER_MAX_CONCURRENT': 1,
+        'ROUTER_MAX_BACKGROUND': 1,
+        'ROUTER_QUEUE_WAIT_WRITE': 5,
+        'ROUTER_QUEUE_WAIT_READ': 5,
+        'ROUTER_QUEUE_WAIT_BACKGROUND': 5,
+    }
+    monkeypatch.setattr(router_scheduler, '_setting', lambda name, default=None: values.get(name, default))
+    RouterScheduler._queues.clear()
+    yield values
+    RouterScheduler._queues.clear()
+
+
+def _queued():
+    return sum(RouterScheduler.snapshot(URI)['queued'].values())
+
+
+def _start_waiter(priority, admitted):
+    def run():
+        assert RouterScheduler.acquire(URI, priority) is None
+        admitted.append(priority)
+        RouterScheduler.release(URI, priority, 0.01)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def _wait_until(condition):
+    deadline = time.monotonic() + 2
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_waiters_are_served_writes_then_reads_then_background(settings):
+    assert RouterScheduler.acquire(URI, READ) is None
+    admitted, threads = [], []
+    for count, priority in enumerate([BACKGROUND, READ, BACKGROUND, READ, WRITE], 1):
+        threads.append(_start_waiter(priority, admitted))
+        _wait_until(lambda: _queued() == count)
+
+    RouterScheduler.release(URI, READ, 0.01)
+    for thread in threads:
+        thread.join(2)
+
+    assert admitted == [WRITE, READ, READ, BACKGROUND, BACKGROUND]
+    assert RouterScheduler.snapshot(URI)['running'] == 0
+
+
+def test_background_work_is_capped(settings):
+    settings['ROUTER_MAX_CONCURRENT'] = 3
+    assert RouterScheduler.acquire(URI, BACKGROUND) is None
+    admitted = []
+    thread = _start_waiter(BACKGROUND, admitted)
+    _wait_until(lambda: _queued() == 1)
+
+    # Interactive requests still get the free slots
+    assert RouterScheduler.acquire(URI, READ) is None
+    assert admitted == []
+
+    RouterScheduler.release(URI, BACKGROUND, 0.01)
+    thread.join(2)
+    assert admitted == [BACKGROUND]
+
+
+def test_rejects_when_the_estimated_wait_exceeds_the_deadline(settings):
+    assert RouterScheduler.acquire(URI, READ) is None
+    RouterScheduler.release(URI, READ, 10.0)
+    assert RouterScheduler.acquire(URI, READ) is None
+
+    error = RouterScheduler.acquire(URI, READ)
+
+    assert error is not None and 'espera estimada' in error
+    assert RouterScheduler.snapshot(URI)['rejected']['read'] == 1
+
+
+def test_gives_up_after_the_queue_wait(settings):
+    settings['ROUTER_QUEUE_WAIT_READ'] = 0.05
+    assert RouterScheduler.acquire(URI, READ) is None
+
+    assert RouterScheduler.acquire(URI, READ) is not None
+    assert _queued() == 0
+
+
+def test_unsent_requests_do_not_change_the_service_time(settings):
+    assert RouterScheduler.acquire(URI, READ) is None
+    RouterScheduler.release(URI, READ, 1.0)
+    assert RouterScheduler.acquire(URI, READ) is None
+    RouterScheduler.release(URI, READ)
+
+    assert RouterScheduler.snapshot(URI)['service_time_ms']['read'] == 1000.0
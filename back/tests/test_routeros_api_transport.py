@@ -0,0 +1,118 @@
+from librouteros.exceptions import MultiTrapError, TrapError
+
+from services import routeros_api_transport
+from services.router_credentials import RouterCredentials
+from services.routeros_api_transport import RouterOSApiTransport, _RawApi
+
+
+class _FakeProtocol:
+    """Replays fixed sentences as the router would send them."""
+
+    def __init__(self, *sentences):
+        self.sentences = list(sentences)
+
+    def readSentence(self):
+        return self.sentences.pop(0)
+
+
+def _settings(name, default=None):
+    return default
+
+
+class _FakePool:
+    """Hands out one connection and remembers how it came back."""
+
+    def __init__(self):
+        self.released = []
+
+    def acquire(self, timeout):
+        return object(), False
+
+    def release(self, api, broken=False):
+        self.released.append(broken)
+
+
+def test_values_are_kept_as_raw_strings():
+    api = _RawApi(_FakeProtocol(
+        ('!re', ['=.id=*1A', '=name=00123', '=comment=1_000', '=disabled=yes', '=password=a=b']),
+    ))
+
+    reply, attributes = api.readSentence()
+
+    assert reply == '!re'
+    assert attributes == {
+        '.id': '*1A',
+        'name': '00123',
+        'comment': '1_000',
+        'disabled': 'yes',
+        'password': 'a=b',
+    }
+
+
+def test_responses_match_rest_records():
+    api = _RawApi(_FakeProtocol(
+        ('!re', ['=name=00123', '=remote-address=10.0.0.1']),
+        ('!re', ['=name=yes', '=comment=']),
+        ('!done', []),
+    ))
+
+    assert api.readResponse() == [
+        {'name': '00123', 'remote-address': '10.0.0.1'},
+        {'name': 'yes', 'comment': ''},
+    ]
+
+
+def test_trap_category_stays_numeric():
+    api = _RawApi(_FakeProtocol(
+        ('!trap', ['=category=2', '=message=failure: already have such entry']),
+        ('!done', []),
+    ))
+
+    try:
+        api.readResponse()
+    except TrapError as trap:
+        assert trap.category == 2
+        assert trap.message == 'failure: already have such entry'
+    else:
+        raise AssertionError('TrapError no lanzado')
+
+
+def test_connections_use_raw_api():
+    router = RouterCredentials('10.0.0.1', 'admin', 'x', 'api')
+    kwargs = RouterOSApiTransport._connect_kwargs(router, _settings, '10.0.0.1', 8728)
+
+    assert kwargs['subclass'] is _RawApi
+
+
+def test_multiple_traps_are_a_router_answer(monkeypatch):
+    router = RouterCredentials('10.0.0.1', 'admin', 'x', 'api')
+    pool = _FakePool()
+    outcomes = []
+
+    def execute(*args):
+        raise MultiTrapError(TrapError(message='invalid value'), TrapError(message='no such item'))
+
+    monkeypatch.setattr(RouterOSApiTransport, '_get_pool', staticmethod(lambda router, settings: pool))
+    monkeypatch.setattr(RouterOSApiTransport, '_execute', staticmethod(execute))
+    monkeypatch.setattr(routeros_api_transport.RouterHealth, 'record',
+                        staticmethod(lambda uri, endpoint, ok, *args, **kwargs: outcomes.append(ok)))
+
+    data, error = RouterOSApiTransport.request(router, 'ppp/secret', 'POST', {'name': 'x'}, _settings)
+
+    assert data is None
+    assert error == 'invalid value, no such item'
+    assert pool.released == [False]
+    assert outcomes == [True]
+
+
+def test_invalidate_matches_pools_of_any_uri_form():
+    for uri, host in [('10.0.0.1', '10.0.0.1'), ('10.0.0.1:8443', '10.0.0.1'),
+                      ('[2001:db8::1]:443', '2001:db8::1'), ('2001:db8::1', '2001:db8::1')]:
+        router = RouterCredentials(uri, 'admin', 'x', 'api')
+        assert RouterOSApiTransport._address(router, _settings) == (host, 8728)
+
+        pool = RouterOSApiTransport._get_pool(router, _settings)
+        closed = []
+        pool.close = lambda: closed.append(True)
+        assert RouterOSApiTransport.invalidate(uri) == 1
+        assert closed == [True]
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from utils.streaming import chunked, iter_json_array
+
+
+def _pieces(text, size):
+    data = text.encode('utf-8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+ITEMS = [
+    {'.id': '*1', 'name': 'ñandú', 'comment': 'a, b ] c'},
+    12.5,
+    -3,
+    'texto con "comillas"',
+    [1, [2, 3]],
+    None,
+    True,
+    {},
+]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 4096])
+def test_items_match_json_loads_for_any_chunk_size(size):
+    body = json.dumps(ITEMS, ensure_ascii=False, indent=1)
+
+    assert list(iter_json_array(_pieces(body, size))) == ITEMS
+
+
+def test_number_split_across_chunks_is_not_truncated():
+    assert list(iter_json_array([b'[12', b'.', b'5', b', 1', b'00]'])) == [12.5, 100]
+
+
+def test_empty_array():
+    assert list(iter_json_array([b' [ ', b' ] '])) == []
+
+
+@pytest.mark.parametrize('body', [b'{"a": 1}', b'[1, 2', b'[1 2]', b'[1,]', b'[1] x', b''])
+def test_invalid_bodies_raise_value_error(body):
+    with pytest.raises(ValueError):
+        list(iter_json_array(_pieces(body.decode(), 2)))
+
+
+def test_oversized_item_is_rejected():
+    body = json.dumps(['x' * 100])
+
+    with pytest.raises(ValueError):
+        list(iter_json_array(_pieces(body, 10), max_item_chars=50))
+
+
+def test_chunked_groups_items():
+    assert list(chunked(iter(range(7)), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(chunked([], 3)) == []
@@ -0,0 +1,65 @@
+"""Conversión de direcciones IPv4 y filtros por rango (CIDR o desde-hasta)"""
+
+import ipaddress
+
+from utils.exceptions import ValidationError
+
+
+def parse_ipv4(value):
+    """``IPv4Address`` de ``value`` o ``None`` si no es una IPv4 simple"""
+    try:
+        return ipaddress.IPv4Address((value or '').strip())
+    except ValueError:
+        return None
+
+
+def address_range(value):
+    """Primera y última dirección de una IP, red CIDR o rango ``a-b`` de RouterOS.
+
+    Devuelve ``(None, None)`` si ``value`` está vacío, es una negación
+    (``!1.2.3.4``) o no es IPv4.
+    """
+    value = (value or '').strip()
+    try:
+        if '-' in value:
+            start, end = (ipaddress.IPv4Address(part.strip()) for part in value.split('-', 1))
+            return (start, end) if start <= end else (end, start)
+        network = ipaddress.IPv4Network(value, strict=False)
+        return network.network_address, network.broadcast_address
+    except ValueError:
+        return None, None
+
+
+def range_filter(args):
+    """Rango ``(desde, hasta)`` pedido en ``args`` (``cidr`` o ``ip_from``/``ip_to``).
+
+    Devuelve ``None`` si no se pidió ninguno y lanza ``ValidationError``
+    si los valores no son IPv4 válidas.
+    """
+    cidr = args.get('cidr')
+    ip_from, ip_to = args.get('ip_from'), args.get('ip_to')
+    if cidr:
+        try:
+            network = ipaddress.IPv4Network(cidr.strip(), strict=False)
+        except ValueError:
+            raise ValidationError(f'CIDR inválido: {cidr}')
+        return network.network_address, network.broadcast_address
+    if not ip_from and not ip_to:
+        return None
+
+    low = parse_ipv4(ip_from) if ip_from else ipaddress.IPv4Address(0)
+    high = parse_ipv4(ip_to) if ip_to else ipaddress.IPv4Address(2 ** 32 - 1)
+    if low is None or high is None:
+        raise ValidationError('ip_from e ip_to deben ser direcciones IPv4')
+    if low > high:
+        raise ValidationError('ip_from debe ser menor o igual que ip_to')
+    return low, high
+
+
+def host_range(value):
+    """Rango asignable de un pool: como ``address_range`` pero sin la red ni el broadcast de un CIDR"""
+    value = (value or '').strip()
+    start, end = address_range(value)
+    if start is not None and '/' in value and int(end) - int(start) >= 3:
+        start, end = start + 1, end - 1
+    return start, end
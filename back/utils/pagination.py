@@ -0,0 +1,182 @@
+"""Paginación por cursor (keyset) para los listados grandes.
+
+``db.paginate`` hace ``OFFSET`` + ``COUNT(*)`` en cada página, así que las
+páginas profundas son cada vez más lentas.  Con cursor cada página filtra
+por la clave de orden de la última fila de la anterior
+(``WHERE (name, id) > (:name, :id) ORDER BY name, id LIMIT n``) y usa el
+índice directamente, sin importar la profundidad.
+
+El total es opcional (``?count=none|exact|estimate``):
+
+* ``none`` (por defecto): no se cuenta.
+* ``exact``: ``COUNT(*)`` cacheado ``PAGINATION_COUNT_TTL`` segundos por
+  consulta, de modo que recorrer las páginas no repite el conteo.
+* ``estimate``: estimación del planificador en PostgreSQL (``EXPLAIN``);
+  en otros motores se usa el conteo cacheado.
+"""
+
+import base64
+import binascii
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request
+from sqlalchemy import and_, or_
+
+from config.config import get_setting
+from models import db
+from utils.exceptions import ValidationError
+
+COUNT_MODES = ('none', 'exact', 'estimate')
+
+_count_cache = OrderedDict()
+_count_lock = threading.Lock()
+
+
+class KeysetPage:
+    """Página de resultados paginados por cursor"""
+
+    __slots__ = ('items', 'limit', 'next_cursor', 'total', 'total_is_estimate')
+
+    def __init__(self, items, limit, next_cursor=None, total=None, total_is_estimate=False):
+        self.items = items
+        self.limit = limit
+        self.next_cursor = next_cursor
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+
+    def meta(self):
+        """Datos de paginación para la respuesta JSON"""
+        return {
+            'limit': self.limit,
+            'next_cursor': self.next_cursor,
+            'has_more': self.next_cursor is not None,
+            'total': self.total,
+            'total_is_estimate': self.total_is_estimate,
+        }
+
+
+def wants_cursor():
+    """Indica si la petición pide paginación por cursor (``cursor`` o ``limit``)"""
+    return 'cursor' in request.args or 'limit' in request.args
+
+
+def encode_cursor(sort, values):
+    """Cursor opaco con el orden y la clave de la última fila"""
+    payload = json.dumps({'s': sort, 'k': list(values)}, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort, size):
+    """Valores de la clave guardados en ``cursor``; ``ValidationError`` si no es válido"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = payload['k']
+        valid = payload['s'] == sort and isinstance(values, list) and len(values) == size
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        valid = False
+    if not valid:
+        raise ValidationError('Cursor de paginación inválido')
+    return values
+
+
+def _after(columns, values):
+    """Condición ``(c1, c2, ...) > (v1, v2, ...)`` expandida para cualquier motor"""
+    conditions = []
+    for i, column in enumerate(columns):
+        equal = [columns[j] == values[j] for j in range(i)]
+        conditions.append(and_(*equal, column > values[i]))
+    return or_(*conditions)
+
+
+def _count_key(query):
+    compiled = query.statement.compile(
+        dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True}
+    )
+    return str(compiled), repr(sorted(compiled.params.items()))
+
+
+def cached_count(query):
+    """``COUNT(*)`` de ``query`` reutilizado durante ``PAGINATION_COUNT_TTL`` segundos"""
+    query = query.order_by(None)
+    key = _count_key(query)
+    now = time.monotonic()
+    with _count_lock:
+        entry = _count_cache.get(key)
+        if entry and entry[1] > now:
+            _count_cache.move_to_end(key)
+            return entry[0]
+
+    total = query.count()
+    with _count_lock:
+        _count_cache[key] = (total, now + get_setting('PAGINATION_COUNT_TTL', 30))
+        _count_cache.move_to_end(key)
+        while len(_count_cache) > get_setting('PAGINATION_COUNT_CACHE_SIZE', 256):
+            _count_cache.popitem(last=False)
+    return total
+
+
+def estimated_count(query):
+    """Filas estimadas por el planificador de PostgreSQL, o ``None`` en otros motores"""
+    dialect = db.engine.dialect
+    if dialect.name != 'postgresql':
+        return None
+    compiled = query.order_by(None).statement.compile(
+        dialect=dialect, compile_kwargs={'render_postcompile': True}
+    )
+    plan = db.session.connection().exec_driver_sql(
+        'EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params
+    ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_rows(query, mode):
+    """Devuelve ``(total, es_estimado)`` según ``mode`` (ver ``COUNT_MODES``)"""
+    if mode == 'estimate':
+        estimate = estimated_count(query)
+        if estimate is not None:
+            return estimate, True
+        mode = 'exact'
+    if mode == 'exact':
+        return cached_count(query), False
+    return None, False
+
+
+def keyset_paginate(query, sorts, default_sort='id', default_limit=50, max_limit=500):
+    """Pagina ``query`` por cursor según los parámetros de la petición.
+
+    ``sorts`` asocia cada ``?sort=`` permitido con sus columnas de orden;
+    la última debe ser única (normalmente el ``id``).  Lee ``cursor``,
+    ``limit``, ``sort`` y ``count`` de ``request.args`` y lanza
+    ``ValidationError`` si alguno no es válido.
+    """
+    sort = request.args.get('sort') or default_sort
+    if sort not in sorts:
+        raise ValidationError(f"Orden no soportado: {sort}")
+    count = request.args.get('count') or 'none'
+    if count not in COUNT_MODES:
+        raise ValidationError(f"Modo de conteo no soportado: {count}")
+    limit = request.args.get('limit', default_limit, type=int)
+    limit = max(1, min(limit, max_limit))
+
+    columns = sorts[sort]
+    total, total_is_estimate = count_rows(query, count)
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        query = query.filter(_after(columns, decode_cursor(cursor, sort, len(columns))))
+
+    # Una fila de más indica si hay página siguiente
+    rows = query.order_by(*columns).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, [getattr(last, column.key) for column in columns])
+
+    return KeysetPage(rows, limit, next_cursor, total, total_is_estimate)
@@ -0,0 +1,93 @@
+"""Lectura incremental de respuestas JSON grandes y procesamiento por lotes"""
+
+import codecs
+import json
+from itertools import islice
+
+_WHITESPACE = ' \t\n\r'
+_DELIMITERS = _WHITESPACE + ',]'
+_DECODER = json.JSONDecoder()
+
+# Tamaño máximo de un elemento del arreglo; evita acumular todo el cuerpo
+# si la respuesta está corrupta
+MAX_ITEM_CHARS = 1 << 20
+
+
+def iter_json_array(chunks, max_item_chars=MAX_ITEM_CHARS):
+    """Genera los elementos de un arreglo JSON leyendo ``chunks`` (bytes) de a poco.
+
+    Solo mantiene en memoria el fragmento pendiente y el elemento en
+    curso, no el cuerpo completo.  Lanza ``ValueError`` si el cuerpo no es
+    un arreglo JSON válido.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer, pos, eof = '', 0, False
+
+    def fill():
+        # Agrega el siguiente fragmento descartando lo ya consumido
+        nonlocal buffer, pos, eof
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            text = decoder.decode(b'', final=True)
+        else:
+            text = decoder.decode(chunk)
+        buffer, pos = buffer[pos:] + text, 0
+
+    def next_char():
+        # Primer carácter que no es espacio (o '' al terminar)
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos] if pos < len(buffer) else ''
+            fill()
+
+    if next_char() != '[':
+        raise ValueError('La respuesta no es un arreglo JSON')
+    pos += 1
+
+    first = True
+    while True:
+        char = next_char()
+        if char == ']':
+            pos += 1
+            break
+        if not first:
+            if char != ',':
+                raise ValueError(f"Se esperaba ',' o ']' en la posición {pos}")
+            pos += 1
+            next_char()
+
+        # Un valor al final del fragmento puede estar cortado (p. ej. ``12.``
+        # de ``12.5``): solo se acepta si le sigue un separador
+        while True:
+            try:
+                item, end = _DECODER.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise ValueError('Respuesta JSON incompleta o inválida')
+            else:
+                if eof or (end < len(buffer) and buffer[end] in _DELIMITERS):
+                    break
+            if len(buffer) - pos > max_item_chars:
+                raise ValueError('Elemento JSON demasiado grande')
+            fill()
+        pos = end
+        first = False
+        yield item
+
+    if next_char() != '':
+        raise ValueError('Contenido inesperado después del arreglo JSON')
+
+
+def chunked(items, size):
+    """Agrupa un iterable en listas de hasta ``size`` elementos"""
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
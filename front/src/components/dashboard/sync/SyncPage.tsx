@@ -76,7 +76,15 @@ export const SyncPage: React.FC = () => {
   const handleSyncAll = async () => {
     setSyncing(true);
     try {
-      await axios.post('/api/sync/all');
+      const response = await axios.post('/api/sync/all');
+      const jobId = response.data.job_id;
+      // La sincronización corre en segundo plano: esperar a que termine el trabajo
+      while (jobId) {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        const job = await axios.get(`/api/sync/jobs/${jobId}`);
+        await fetchSyncLogs();
+        if (['completed', 'failed'].includes(job.data.job?.status)) break;
+      }
       await fetchSyncStatus();
       await fetchSyncLogs();
     } catch (err: any) {